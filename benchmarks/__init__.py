@@ -0,0 +1 @@
+"""Бенчмарки парсера расписания (python -m benchmarks.run) и нагрузочный тест бота (python -m benchmarks.loadtest)"""
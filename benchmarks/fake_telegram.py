@@ -0,0 +1,238 @@
+"""Локальный сервер, который притворяется Telegram Bot API
+
+Нужен, чтобы гонять bot.py под нагрузкой без обращения к Telegram
+(см. benchmarks/loadtest.py). Понимает getUpdates (long polling),
+sendMessage, answerCallbackQuery, editMessageText, sendDocument,
+sendPhoto и отвечает "ok" на остальные методы. Каждый ответ можно
+задержать (latency + случайный jitter), а часть исходящих вызовов —
+отклонить с кодом 429, как делает Telegram при превышении лимитов.
+
+    api = FakeBotApi(latency=0.03, error_rate=0.01).start()
+    apihelper.API_URL = api.api_url
+    api.push_message(chat_id=1, text='5А')
+    ...
+    api.stop()
+"""
+import collections
+import http.server
+import json
+import random
+import threading
+import time
+import urllib.parse
+
+# Методы, которые отправляют сообщения пользователю (на них срабатывает 429)
+OUTBOUND_METHODS = {'sendMessage', 'sendDocument', 'sendPhoto', 'editMessageText', 'answerCallbackQuery'}
+
+class FakeBotApi:
+    """Фейковый Bot API: очередь входящих обновлений и счётчики исходящих вызовов"""
+    
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, retry_after=1, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._updates_ready = threading.Condition(self._lock)
+        self._updates = collections.deque()
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self.calls = collections.Counter()      # метод -> число вызовов
+        self.rejected = collections.Counter()   # метод -> сколько отклонено с 429
+        self.sent = collections.defaultdict(list)  # chat_id -> [(время, текст)]
+        self.delivered_at = {}  # update_id -> когда бот забрал обновление
+        self._server = None
+    
+    # ====== ЗАПУСК ======
+    
+    def start(self):
+        """Запускает сервер на свободном порту"""
+        api = self
+        
+        class Handler(_Handler):
+            fake_api = api
+        
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True, name='fake-bot-api').start()
+        return self
+    
+    def stop(self):
+        if self._server is not None:
+            with self._updates_ready:
+                self._updates_ready.notify_all()
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+    
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+    
+    @property
+    def api_url(self):
+        """Шаблон для apihelper.API_URL"""
+        return self.base_url + "/bot{0}/{1}"
+    
+    # ====== ВХОДЯЩИЕ ОБНОВЛЕНИЯ ======
+    
+    def _push(self, make_update):
+        with self._updates_ready:
+            update_id = self._next_update_id
+            self._next_update_id += 1
+            update = make_update(update_id)
+            self._updates.append(update)
+            self._updates_ready.notify_all()
+        return update
+    
+    def push_message(self, chat_id, text):
+        """Сообщение пользователя chat_id; возвращает message_id"""
+        with self._lock:
+            message_id = self._next_message_id
+            self._next_message_id += 1
+        
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private', 'first_name': f"user{chat_id}"},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': f"user{chat_id}"},
+            'text': text
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        self._push(lambda update_id: {'update_id': update_id, 'message': message})
+        return message_id
+    
+    def push_callback(self, chat_id, data, message_id=None):
+        """Нажатие inline-кнопки с callback_data=data; возвращает id запроса"""
+        with self._lock:
+            query_id = str(self._next_message_id)
+            self._next_message_id += 1
+        
+        callback_query = {
+            'id': query_id,
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': f"user{chat_id}"},
+            'chat_instance': str(chat_id),
+            'data': data,
+            'message': {
+                'message_id': message_id or 0,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': ''
+            }
+        }
+        self._push(lambda update_id: {'update_id': update_id, 'callback_query': callback_query})
+        return query_id
+    
+    def _get_updates(self, offset, limit, timeout):
+        """getUpdates: подтверждает обновления до offset и ждёт новых до timeout секунд"""
+        deadline = time.monotonic() + timeout
+        with self._updates_ready:
+            while self._updates and offset and self._updates[0]['update_id'] < offset:
+                self._updates.popleft()
+            while not self._updates and self._server is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._updates_ready.wait(remaining)
+            
+            updates = list(self._updates)[:limit]
+            now = time.perf_counter()
+            for update in updates:
+                self.delivered_at.setdefault(update['update_id'], now)
+            return updates
+    
+    # ====== ИСХОДЯЩИЕ ВЫЗОВЫ ======
+    
+    def _call(self, method, params):
+        """Ответ на вызов метода: (HTTP-код, JSON)"""
+        with self._lock:
+            self.calls[method] += 1
+            reject = method in OUTBOUND_METHODS and self._random.random() < self.error_rate
+            if reject:
+                self.rejected[method] += 1
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        
+        if method != 'getUpdates' and delay:
+            time.sleep(delay)
+        
+        if reject:
+            return 429, {
+                'ok': False, 'error_code': 429,
+                'description': f"Too Many Requests: retry after {self.retry_after}",
+                'parameters': {'retry_after': self.retry_after}
+            }
+        
+        if method == 'getUpdates':
+            return 200, {'ok': True, 'result': self._get_updates(
+                int(params.get('offset') or 0), int(params.get('limit') or 100), float(params.get('timeout') or 0)
+            )}
+        if method == 'getMe':
+            return 200, {'ok': True, 'result': {'id': 1, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot'}}
+        if method in ('sendMessage', 'sendDocument', 'sendPhoto', 'editMessageText'):
+            return 200, {'ok': True, 'result': self._record_message(method, params)}
+        return 200, {'ok': True, 'result': True}
+    
+    def _record_message(self, method, params):
+        chat_id = int(params.get('chat_id') or 0)
+        text = params.get('text') or params.get('caption') or ''
+        with self._lock:
+            message_id = self._next_message_id
+            self._next_message_id += 1
+            self.sent[chat_id].append((time.perf_counter(), text))
+        
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'text': text
+        }
+        if method == 'sendDocument':
+            message['document'] = {'file_id': f"doc{message_id}", 'file_unique_id': f"udoc{message_id}"}
+        elif method == 'sendPhoto':
+            message['photo'] = [{'file_id': f"photo{message_id}", 'file_unique_id': f"uphoto{message_id}",
+                                 'width': 1, 'height': 1}]
+        return message
+    
+    def outbound_total(self):
+        """Число исходящих вызовов (без getUpdates)"""
+        with self._lock:
+            return sum(count for method, count in self.calls.items() if method in OUTBOUND_METHODS)
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """/bot<токен>/<метод>: параметры в строке запроса или в теле (форма, JSON)"""
+    
+    fake_api = None
+    protocol_version = 'HTTP/1.1'
+    
+    def _params(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = {key: values[-1] for key, values in urllib.parse.parse_qs(url.query).items()}
+        
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        content_type = self.headers.get('Content-Type', '')
+        if body and content_type.startswith('application/json'):
+            params.update(json.loads(body))
+        elif body and content_type.startswith('application/x-www-form-urlencoded'):
+            params.update({key: values[-1] for key, values in urllib.parse.parse_qs(body.decode('utf-8')).items()})
+        return url.path, params
+    
+    def _handle(self):
+        path, params = self._params()
+        method = path.rsplit('/', 1)[-1]
+        status, payload = self.fake_api._call(method, params)
+        
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    do_GET = _handle
+    do_POST = _handle
+    
+    def log_message(self, format, *args):
+        pass
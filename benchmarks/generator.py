@@ -0,0 +1,178 @@
+"""Генератор синтетического расписания
+
+Строит таблицу в том же виде, что и выгрузка Excel на сайте школы:
+заголовок "РАСПИСАНИЕ НА <ДЕНЬ>", строка с классами, затем для каждого
+урока три строки — предметы, время с учителями, кабинеты. Из одной таблицы
+получаются HTML (как sheet001.htm) и соответствующий ему CSV (как после
+download_schedule_from_site).
+"""
+import csv
+import html
+import os
+import random
+
+DAYS = ['ПОНЕДЕЛЬНИК', 'ВТОРНИК', 'СРЕДА', 'ЧЕТВЕРГ', 'ПЯТНИЦА', 'СУББОТА']
+
+SHIFT_TIMES = [
+    ['8.30–9.10', '9.20–10.00', '10.15–10.55', '11.10–11.50', '12.00–12.40', '12.50–13.30', '13.40–14.20'],
+    ['14.00–14.40', '14.50–15.30', '15.45–16.25', '16.40–17.20', '17.30–18.10', '18.20–19.00', '19.10–19.50'],
+]
+
+SUBJECTS = [
+    'Математика', 'Алгебра', 'Геометрия', 'Русский язык', 'Литература', 'Физика',
+    'Химия', 'Биология', 'География', 'История', 'Обществознание', 'Информатика',
+    'Английский язык', 'Немецкий язык', 'Физкультура', 'ИЗО', 'Музыка', 'Технология', 'ОБЖ'
+]
+
+SURNAMES = [
+    'ПРОТАСОВА', 'ИНКИНА', 'ЛАТЫШЕВА', 'ШУМОВА', 'ПЕТРОВ', 'СИДОРОВА', 'ИВАНОВ',
+    'КУЗНЕЦОВА', 'СМИРНОВА', 'ПОПОВ', 'ВАСИЛЬЕВА', 'СОКОЛОВ', 'МИХАЙЛОВА', 'НОВИКОВ',
+    'ФЕДОРОВА', 'МОРОЗОВ', 'ВОЛКОВА', 'АЛЕКСЕЕВ', 'ЛЕБЕДЕВА', 'СЕМЕНОВ', 'ЕГОРОВА',
+    'ПАВЛОВ', 'КОЗЛОВА', 'СТЕПАНОВ', 'НИКОЛАЕВА', 'ОРЛОВ', 'АНДРЕЕВА', 'МАКАРОВ'
+]
+
+LETTERS = 'АБВГДЕЖИКЛМН'
+
+DEFAULT_CONFIG = {
+    'classes': 40,
+    'days': 6,
+    'shifts': 2,
+    'lessons_per_shift': 6,
+    'classes_per_block': 12,
+    'teachers': 80,
+    'rooms': 60,
+    'split_ratio': 0.15,
+    'empty_ratio': 0.05,
+    'seed': 25
+}
+
+def scaled_config(scale, **overrides):
+    """Конфигурация для масштаба scale (1 — реальная школа, 10 — в 10 раз больше)"""
+    config = dict(DEFAULT_CONFIG)
+    for key in ('classes', 'teachers', 'rooms'):
+        config[key] = int(config[key] * scale)
+    config.update(overrides)
+    return config
+
+def _make_classes(count):
+    """Названия классов: 1А, 1Б, ..., 11Н"""
+    per_grade = max(1, -(-count // 11))
+    classes = []
+    for grade in range(1, 12):
+        for letter in range(per_grade):
+            # При большом масштабе добавляем вторую букву: 5АБ
+            suffix = LETTERS[letter % len(LETTERS)]
+            if letter >= len(LETTERS):
+                suffix += LETTERS[letter // len(LETTERS) - 1]
+            classes.append(f"{grade}{suffix}")
+    return classes[:count]
+
+def _make_teachers(count):
+    """Фамилии учителей, при нехватке — с номером"""
+    teachers = []
+    for i in range(count):
+        surname = SURNAMES[i % len(SURNAMES)]
+        teachers.append(surname if i < len(SURNAMES) else f"{surname}{i // len(SURNAMES) + 1}")
+    return teachers
+
+def _make_rooms(count):
+    """Номера кабинетов, часть — в форме '1 ГРУППА 456'"""
+    rooms = [str(100 + i * 7 % 400 + i // 400 * 1000) for i in range(count)]
+    for i in range(0, count, 10):
+        rooms[i] = f"1 ГРУППА {rooms[i]}"
+    return rooms
+
+def generate_rows(config=None):
+    """Генерирует строки таблицы расписания (список списков ячеек)"""
+    config = dict(DEFAULT_CONFIG, **(config or {}))
+    rng = random.Random(config['seed'])
+    
+    classes = _make_classes(config['classes'])
+    teachers = _make_teachers(config['teachers'])
+    rooms = _make_rooms(config['rooms'])
+    
+    # Классы поровну делятся между сменами
+    shifts = max(1, min(config['shifts'], len(SHIFT_TIMES)))
+    classes_by_shift = [classes[i::shifts] for i in range(shifts)]
+    
+    rows = []
+    for day in DAYS[:config['days']]:
+        rows.append([f"РАСПИСАНИЕ НА {day}"])
+        
+        for shift, shift_classes in enumerate(classes_by_shift):
+            times = SHIFT_TIMES[shift][:config['lessons_per_shift']]
+            block = config['classes_per_block']
+            
+            for start in range(0, len(shift_classes), block):
+                block_classes = shift_classes[start:start + block]
+                rows.append(['', ''] + block_classes)
+                
+                for lesson_num, lesson_time in enumerate(times, 1):
+                    subjects, lesson_teachers, lesson_rooms = [], [], []
+                    
+                    for _ in block_classes:
+                        if rng.random() < config['empty_ratio']:
+                            subjects.append('')
+                            lesson_teachers.append('')
+                            lesson_rooms.append('')
+                        elif rng.random() < config['split_ratio']:
+                            # Деление на группы: ИНКИНА/ЛАТЫШЕВА, 453\241
+                            pair = rng.sample(teachers, 2)
+                            subjects.append(rng.choice(['Английский язык', 'Информатика', 'Технология']))
+                            lesson_teachers.append('/'.join(pair))
+                            lesson_rooms.append('\\'.join(rng.sample(rooms, 2)))
+                        else:
+                            subjects.append(rng.choice(SUBJECTS))
+                            lesson_teachers.append(rng.choice(teachers))
+                            lesson_rooms.append(rng.choice(rooms))
+                    
+                    rows.append([str(lesson_num), ''] + subjects)
+                    rows.append(['', lesson_time] + lesson_teachers)
+                    rows.append(['', ''] + lesson_rooms)
+                
+                rows.append([''])
+    
+    return rows
+
+def render_html(rows):
+    """HTML в стиле выгрузки Excel ("Сохранить как веб-страницу")"""
+    width = max(len(row) for row in rows)
+    parts = [
+        '<html xmlns:o="urn:schemas-microsoft-com:office:office"\n'
+        'xmlns:x="urn:schemas-microsoft-com:office:excel">\n'
+        '<head>\n<meta http-equiv=Content-Type content="text/html; charset=windows-1251">\n'
+        '<meta name=ProgId content=Excel.Sheet>\n</head>\n<body link=blue vlink=purple>\n'
+        '<table border=0 cellpadding=0 cellspacing=0 style=\'border-collapse:collapse\'>\n'
+    ]
+    for row in rows:
+        parts.append(' <tr height=17 style=\'height:12.75pt\'>\n')
+        for col in range(width):
+            cell = row[col] if col < len(row) else ''
+            text = html.escape(cell) if cell else '&nbsp;'
+            parts.append(f'  <td class=xl{65 + col % 5}>{text}</td>\n')
+        parts.append(' </tr>\n')
+    parts.append('</table>\n</body>\n</html>\n')
+    return ''.join(parts)
+
+def write_schedule(directory, config=None):
+    """Записывает school_schedule.csv и расписание.files/sheet001.htm в directory
+    
+    Возвращает пути к CSV и HTML.
+    """
+    rows = generate_rows(config)
+    
+    csv_path = os.path.join(directory, 'school_schedule.csv')
+    with open(csv_path, 'w', encoding='utf-8', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        width = max(len(row) for row in rows)
+        for row in rows:
+            # Как в download_schedule: пустые ячейки сохраняются до ширины таблицы
+            writer.writerow([' '.join(cell.split()) for cell in row] + [''] * (width - len(row)))
+    
+    html_dir = os.path.join(directory, 'расписание.files')
+    os.makedirs(html_dir, exist_ok=True)
+    html_path = os.path.join(html_dir, 'sheet001.htm')
+    with open(html_path, 'w', encoding='windows-1251') as htmlfile:
+        htmlfile.write(render_html(rows))
+    
+    return csv_path, html_path
@@ -0,0 +1,84 @@
+"""Проверка времени импорта bot.py
+
+Запускает `python -X importtime -c "import bot"` в отдельном процессе,
+суммирует время импорта и проверяет бюджет. Также проверяет, что тяжёлые
+модули (bs4, pandas, numpy, openpyxl) не загружаются при старте.
+
+    python -m benchmarks.importtime
+    python -m benchmarks.importtime --budget-ms 300 --runs 5
+
+Код возврата 1, если бюджет превышен или загружен запрещённый модуль.
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_BUDGET_MS = 300
+FORBIDDEN_MODULES = ['bs4', 'pandas', 'numpy', 'openpyxl', 'download_schedule', 'schedule_checker']
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+def measure_import(module='bot'):
+    """Один замер: возвращает (время импорта module в мс, множество загруженных модулей)"""
+    env = dict(os.environ, BOT_TOKEN=os.environ.get('BOT_TOKEN', '0:importtime'), METRICS_PORT='0')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT_DIR, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Импорт {module} завершился с ошибкой:\n{result.stderr[-2000:]}")
+    
+    total_us = None
+    loaded = set()
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        cumulative_us, indent, name = int(match.group(2)), match.group(3), match.group(4)
+        loaded.add(name.split('.')[0])
+        # Модуль верхнего уровня печатается последним с отступом в один пробел
+        if name == module and len(indent) == 1:
+            total_us = cumulative_us
+    
+    if total_us is None:
+        raise RuntimeError(f"В выводе -X importtime нет строки для {module}")
+    return total_us / 1000, loaded
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бюджет времени импорта bot.py")
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS, help="допустимое время импорта (медиана)")
+    parser.add_argument('--runs', type=int, default=5, help="число замеров")
+    parser.add_argument('--module', default='bot', help="модуль для замера")
+    args = parser.parse_args(argv)
+    
+    timings = []
+    loaded = set()
+    for _ in range(args.runs):
+        elapsed_ms, loaded_modules = measure_import(args.module)
+        timings.append(elapsed_ms)
+        loaded |= loaded_modules
+    
+    median_ms = statistics.median(timings)
+    print(f"import {args.module}: медиана {median_ms:.1f} мс, "
+          f"мин {min(timings):.1f} мс, макс {max(timings):.1f} мс (бюджет {args.budget_ms:g} мс)")
+    
+    failed = False
+    forbidden = sorted(set(FORBIDDEN_MODULES) & loaded)
+    if forbidden:
+        print(f"❌ При старте загружены тяжёлые модули: {', '.join(forbidden)}")
+        failed = True
+    if median_ms > args.budget_ms:
+        print(f"❌ Бюджет превышен на {median_ms - args.budget_ms:.1f} мс")
+        failed = True
+    
+    if not failed:
+        print("✅ Бюджет импорта соблюдён")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
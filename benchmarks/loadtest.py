@@ -0,0 +1,428 @@
+"""Нагрузочный тест бота на локальном фейковом Telegram Bot API
+
+Поднимает FakeBotApi (см. fake_telegram.py), направляет на него
+pyTelegramBotAPI и запускает bot.py в обычном режиме long polling на
+синтетическом расписании. N пользователей по очереди шлют запросы из
+смеси: класс текстом, /teacher, /room и поиск по части фамилии. Каждый
+пользователь ждёт, пока обработчик закончит, и только потом пишет снова
+(замкнутый цикл), поэтому задержка включает ожидание в getUpdates и в
+пуле потоков бота.
+
+Отчёт: сообщений в секунду, p50/p95/p99 задержки (всего и только
+обработчика) по видам запросов, число исходящих вызовов по методам и
+ответов 429. Результаты сохраняются в JSON для сравнения между версиями.
+
+    python -m benchmarks.loadtest
+    python -m benchmarks.loadtest --users 50 --duration 30 --latency-ms 40 --error-rate 0.01
+    python -m benchmarks.loadtest --compare old.json
+
+Масштабирование по процессам (см. workers.py): прогон с --workers 1 и
+сравнение с ним прогона с несколькими процессами.
+
+    python -m benchmarks.loadtest --workers 1 --users 100 --latency-ms 0 --output w1.json
+    python -m benchmarks.loadtest --workers 4 --users 100 --latency-ms 0 --compare w1.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+# Запуск из корня репозитория: python -m benchmarks.loadtest
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from benchmarks import generator
+from benchmarks.fake_telegram import FakeBotApi
+from benchmarks.run import _git_revision
+
+DEFAULT_OUTPUT = os.path.join(ROOT_DIR, 'benchmarks', 'loadtest.json')
+
+# Доли видов запросов в смеси
+QUERY_MIX = {'class': 0.45, 'teacher': 0.2, 'room': 0.2, 'partial': 0.15}
+
+# Как в bot.main: пауза между getUpdates и таймаут long polling
+POLL_INTERVAL = 2
+POLL_TIMEOUT = 30
+
+# Сколько ждать ответа на один запрос, прежде чем считать его потерянным
+REPLY_TIMEOUT = 60
+
+# ====== ЗАПРОСЫ ======
+
+def make_queries(table, rng):
+    """Генераторы запросов каждого вида по словарям таблицы уроков"""
+    classes = [name for name in table.dictionaries['class_name'].values if name]
+    teachers = [name for name in table.dictionaries['teacher'].values if name and '/' not in name]
+    rooms = [name for name in table.dictionaries['classroom'].values if name and '/' not in name]
+    
+    def class_query():
+        name = rng.choice(classes)
+        # Пользователи пишут по-разному: 5А, 5а
+        return name if rng.random() < 0.5 else name.lower()
+    
+    return {
+        'class': class_query,
+        'teacher': lambda: f"/teacher {rng.choice(teachers).capitalize()}",
+        'room': lambda: f"/room {rng.choice(rooms)}",
+        'partial': lambda: f"/teachers {rng.choice(teachers)[:3].lower()}"
+    }
+
+def pick_kind(rng):
+    point = rng.random()
+    for kind, share in QUERY_MIX.items():
+        point -= share
+        if point < 0:
+            return kind
+    return kind
+
+# ====== ОТСЛЕЖИВАНИЕ ОБРАБОТКИ ======
+
+class Tracker:
+    """Отмечает начало и конец обработки входящих сообщений ботом
+    
+    У каждого пользователя не больше одного запроса без ответа, поэтому
+    запросы различаются по chat_id. Процессы-обработчики (--workers)
+    передают отметки в главный процесс через очередь.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiting = {}   # chat_id -> threading.Event
+        self._results = {}   # chat_id -> (начало обработки, конец, ошибка)
+        self._pid = os.getpid()
+        self._completions = None
+    
+    def share_with_children(self):
+        """Создаёт очередь для отметок из процессов (до их запуска)"""
+        self._completions = multiprocessing.get_context('fork').SimpleQueue()
+    
+    def start_collecting(self):
+        """Принимает отметки из процессов (после их запуска)"""
+        threading.Thread(target=self._collect, daemon=True, name='loadtest-tracker').start()
+    
+    def _collect(self):
+        while True:
+            self._record(*self._completions.get())
+    
+    def expect(self, chat_id):
+        event = threading.Event()
+        with self._lock:
+            self._waiting[chat_id] = event
+            self._results.pop(chat_id, None)
+        return event
+    
+    def finish(self, chat_id, started, failed):
+        finished = time.perf_counter()  # монотонные часы общие для всех процессов
+        if os.getpid() != self._pid:
+            self._completions.put((chat_id, started, finished, failed))
+        else:
+            self._record(chat_id, started, finished, failed)
+    
+    def _record(self, chat_id, started, finished, failed):
+        with self._lock:
+            self._results[chat_id] = (started, finished, failed)
+            event = self._waiting.pop(chat_id, None)
+        if event is not None:
+            event.set()
+    
+    def result(self, chat_id):
+        with self._lock:
+            return self._results.pop(chat_id, None)
+    
+    def install(self, telebot_instance):
+        """Оборачивает задачи пула потоков бота, чтобы видеть конец обработки"""
+        exec_task = telebot_instance._exec_task
+        tracker = self
+        
+        def traced_exec_task(task, *args, **kwargs):
+            item = args[0] if args else None
+            chat = getattr(item, 'chat', None)
+            if chat is None:
+                return exec_task(task, *args, **kwargs)
+            
+            def traced(*task_args, **task_kwargs):
+                started = time.perf_counter()
+                failed = True
+                try:
+                    result = task(*task_args, **task_kwargs)
+                    failed = False
+                    return result
+                finally:
+                    tracker.finish(chat.id, started, failed)
+            
+            return exec_task(traced, *args, **kwargs)
+        
+        telebot_instance._exec_task = traced_exec_task
+
+# ====== ПОЛЬЗОВАТЕЛИ ======
+
+def run_user(chat_id, api, tracker, queries, deadline, think_time, seed, samples):
+    """Один пользователь: запрос, ожидание ответа, пауза — до deadline"""
+    rng = random.Random(seed)
+    while time.perf_counter() < deadline:
+        kind = pick_kind(rng)
+        text = queries[kind]()
+        
+        # Ожидание регистрируется до отправки, иначе бот может успеть раньше
+        event = tracker.expect(chat_id)
+        sent_at = time.perf_counter()
+        api.push_message(chat_id, text)
+        
+        if not event.wait(REPLY_TIMEOUT):
+            samples.append({'kind': kind, 'lost': True})
+            continue
+        started, finished, failed = tracker.result(chat_id)
+        samples.append({
+            'kind': kind,
+            'lost': False,
+            'failed': failed,
+            'total_ms': (finished - sent_at) * 1000,
+            'handler_ms': (finished - started) * 1000
+        })
+        
+        if think_time:
+            time.sleep(rng.expovariate(1 / think_time))
+
+# ====== ОТЧЁТ ======
+
+def percentiles(values):
+    if not values:
+        return {'count': 0}
+    values = sorted(values)
+    if len(values) > 1:
+        cuts = statistics.quantiles(values, n=100, method='inclusive')
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = values[0]
+    return {
+        'count': len(values),
+        'p50_ms': round(p50, 2),
+        'p95_ms': round(p95, 2),
+        'p99_ms': round(p99, 2),
+        'max_ms': round(values[-1], 2)
+    }
+
+def summarize(samples, elapsed, api, snapshot):
+    done = [sample for sample in samples if not sample['lost']]
+    outbound = {method: count for method, count in api.calls.items() if method != 'getUpdates'}
+    
+    by_kind = {}
+    for kind in QUERY_MIX:
+        kind_samples = [sample for sample in done if sample['kind'] == kind]
+        by_kind[kind] = {
+            'total': percentiles([sample['total_ms'] for sample in kind_samples]),
+            'handler': percentiles([sample['handler_ms'] for sample in kind_samples])
+        }
+    
+    handlers = {
+        name: stats for (kind, name), stats in snapshot['histograms'].items() if kind == 'handler'
+    }
+    errors = {
+        label: value for (counter, label), value in snapshot['counters'].items() if counter == 'errors'
+    }
+    
+    return {
+        'elapsed_s': round(elapsed, 2),
+        'queries': len(samples),
+        'completed': len(done),
+        'lost': len(samples) - len(done),
+        'failed': sum(1 for sample in done if sample['failed']),
+        'queries_per_s': round(len(done) / elapsed, 2),
+        'messages_per_s': round(sum(outbound.get(method, 0) for method in ('sendMessage', 'sendDocument', 'sendPhoto'))
+                                / elapsed, 2),
+        'total': percentiles([sample['total_ms'] for sample in done]),
+        'handler': percentiles([sample['handler_ms'] for sample in done]),
+        'by_kind': by_kind,
+        'outbound_calls': outbound,
+        'get_updates_calls': api.calls.get('getUpdates', 0),
+        'rejected_429': dict(api.rejected),
+        'bot_handlers': {name: stats for name, stats in sorted(handlers.items())},
+        'bot_errors': errors
+    }
+
+def print_summary(summary):
+    print(f"\nЗа {summary['elapsed_s']} с: запросов {summary['completed']} из {summary['queries']}, "
+          f"потеряно {summary['lost']}, с ошибкой {summary['failed']}")
+    print(f"  запросов в секунду       {summary['queries_per_s']:>10}")
+    print(f"  сообщений в секунду      {summary['messages_per_s']:>10}")
+    for label, key in (('задержка (всего)', 'total'), ('обработчик', 'handler')):
+        stats = summary[key]
+        if stats['count']:
+            print(f"  {label:<24} p50 {stats['p50_ms']:>9.1f}  p95 {stats['p95_ms']:>9.1f}  "
+                  f"p99 {stats['p99_ms']:>9.1f} мс")
+    
+    print("  по видам запросов (p95 всего / обработчик, мс):")
+    for kind, stats in summary['by_kind'].items():
+        if stats['total']['count']:
+            print(f"    {kind:<10} {stats['total']['count']:>6}  "
+                  f"{stats['total']['p95_ms']:>9.1f} / {stats['handler']['p95_ms']:>9.1f}")
+    
+    print("  исходящие вызовы:")
+    for method, count in sorted(summary['outbound_calls'].items()):
+        rejected = summary['rejected_429'].get(method, 0)
+        print(f"    {method:<24} {count:>8}" + (f"  (429: {rejected})" if rejected else ''))
+    print(f"    {'getUpdates':<24} {summary['get_updates_calls']:>8}")
+    if summary['bot_errors']:
+        print(f"  ошибки бота: {summary['bot_errors']}")
+
+def compare(current, baseline):
+    """Печатает изменение основных показателей относительно baseline"""
+    print(f"\nСравнение с {baseline.get('meta', {}).get('revision', '?')}:")
+    rows = [
+        ('запросов в секунду', ('queries_per_s',)),
+        ('сообщений в секунду', ('messages_per_s',)),
+        ('p95 всего, мс', ('total', 'p95_ms')),
+        ('p95 обработчика, мс', ('handler', 'p95_ms'))
+    ]
+    for label, path in rows:
+        old, new = baseline.get('summary', {}), current['summary']
+        for key in path:
+            old, new = (old or {}).get(key), (new or {}).get(key)
+        if old is None or new is None:
+            continue
+        ratio = f"x{new / old:.2f}" if old else ''
+        print(f"  {label:<24} {old:>10} -> {new:>10}  {ratio}")
+
+# ====== ЗАПУСК ======
+
+def start_bot(api, args):
+    """Импортирует bot.py, направленный на фейковый API, и запускает polling
+    
+    Возвращает (модуль bot, Tracker, WorkerPool или None).
+    """
+    os.environ['BOT_TOKEN'] = '0:loadtest'
+    os.environ['METRICS_PORT'] = '0'
+    os.environ['WORKERS'] = str(args.workers)
+    os.environ['WORKER_THREADS'] = str(args.worker_threads)
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    
+    from telebot import apihelper
+    import bot
+    import metrics
+    import workers
+    
+    apihelper.API_URL = api.api_url
+    bot.modules['schedule_parser'].warm_up_index()  # индекс строится до начала замера
+    metrics.reset()
+    
+    tracker = Tracker()
+    tracker.install(bot.bot)
+    if bot.WORKERS > 1:
+        # Как в bot.main: процессы создаются до запуска фоновых потоков
+        tracker.share_with_children()
+        pool = workers.WorkerPool(
+            bot.bot, bot.WORKERS, args.worker_threads,
+            before_update=bot.modules['schedule_parser'].reload_changed_sources,
+            on_start=bot.outbox.start
+        ).start()
+        tracker.start_collecting()
+        target, kwargs = pool.poll_forever, {'timeout': POLL_TIMEOUT}
+    else:
+        pool = None
+        target = bot.bot.polling
+        kwargs = {'non_stop': True, 'interval': args.poll_interval, 'timeout': POLL_TIMEOUT}
+    
+    bot.outbox.start()
+    threading.Thread(target=target, kwargs=kwargs, daemon=True, name='loadtest-polling').start()
+    return bot, tracker, pool
+
+def run_load(args):
+    config = generator.scaled_config(args.scale)
+    print(f"Масштаб {args.scale:g}x: {config['classes']} классов, {config['teachers']} учителей, "
+          f"{config['rooms']} кабинетов; пользователей {args.users}, {args.duration:g} с")
+    
+    api = FakeBotApi(
+        latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+        error_rate=args.error_rate, seed=args.seed
+    ).start()
+    
+    with tempfile.TemporaryDirectory() as work_dir:
+        generator.write_schedule(work_dir, config)
+        previous_dir = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            bot, tracker, pool = start_bot(api, args)
+            import metrics
+            
+            rng = random.Random(args.seed)
+            samples = []
+            deadline = time.perf_counter() + args.duration
+            users = [
+                threading.Thread(
+                    target=run_user, daemon=True,
+                    args=(1000 + number, api, tracker, make_queries(bot.modules['schedule_parser'].get_lesson_table(),
+                                                                     random.Random(rng.random())),
+                          deadline, args.think_ms / 1000, rng.random(), samples)
+                )
+                for number in range(args.users)
+            ]
+            
+            started = time.perf_counter()
+            for user in users:
+                user.start()
+            for user in users:
+                user.join()
+            elapsed = time.perf_counter() - started
+            
+            summary = summarize(samples, elapsed, api, metrics.snapshot())
+            if pool is not None:
+                pool.stop()
+            else:
+                bot.bot.stop_polling()
+        finally:
+            os.chdir(previous_dir)
+            api.stop()
+    
+    return config, summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота на фейковом Telegram Bot API")
+    parser.add_argument('--users', type=int, default=20, help="число одновременных пользователей")
+    parser.add_argument('--duration', type=float, default=20.0, help="длительность теста, с")
+    parser.add_argument('--scale', type=float, default=1.0, help="масштаб синтетического расписания")
+    parser.add_argument('--think-ms', type=float, default=0.0, help="средняя пауза пользователя между запросами")
+    parser.add_argument('--latency-ms', type=float, default=30.0, help="задержка ответа Bot API")
+    parser.add_argument('--jitter-ms', type=float, default=20.0, help="случайная добавка к задержке")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="доля исходящих вызовов с ответом 429")
+    parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL, help="пауза между getUpdates, с")
+    parser.add_argument('--workers', type=int, default=1, help="процессов-обработчиков (см. workers.py)")
+    parser.add_argument('--worker-threads', type=int, default=4, help="потоков в каждом процессе-обработчике")
+    parser.add_argument('--seed', type=int, default=25)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help="файл для результатов (JSON)")
+    parser.add_argument('--compare', help="JSON с прошлыми результатами для сравнения")
+    args = parser.parse_args(argv)
+    
+    config, summary = run_load(args)
+    print_summary(summary)
+    
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': vars(args),
+            'config': config
+        },
+        'summary': summary
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты сохранены: {args.output}")
+    
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(report, json.load(f))
+    
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
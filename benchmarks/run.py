@@ -0,0 +1,321 @@
+"""Замеры производительности парсера расписания
+
+Генерирует синтетическое расписание нужного масштаба, замеряет основные
+функции schedule_parser и download_schedule_from_site (с локального
+HTTP-сервера) и сохраняет результаты в JSON для сравнения между версиями.
+
+    python -m benchmarks.run
+    python -m benchmarks.run --scale 1 --repeat 10 --output results.json
+    python -m benchmarks.run --compare old.json --fail-on-regression
+"""
+import argparse
+import functools
+import http.server
+import importlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import tracemalloc
+
+# Запуск из корня репозитория: python -m benchmarks.run
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from benchmarks import generator
+
+DEFAULT_SCALES = [1, 10]
+DEFAULT_OUTPUT = os.path.join(ROOT_DIR, 'benchmarks', 'results.json')
+
+# ====== ЗАМЕРЫ ======
+
+def measure(func, repeat, max_seconds):
+    """Запускает func до repeat раз (но не дольше max_seconds, минимум один раз)"""
+    timings = []
+    started = time.perf_counter()
+    
+    while len(timings) < repeat:
+        run_started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - run_started) * 1000)
+        if time.perf_counter() - started > max_seconds:
+            break
+    
+    return {
+        'runs': len(timings),
+        'min_ms': round(min(timings), 3),
+        'median_ms': round(statistics.median(timings), 3),
+        'mean_ms': round(statistics.mean(timings), 3),
+        'max_ms': round(max(timings), 3)
+    }
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    """Раздача файлов без логов в stderr"""
+    
+    def log_message(self, format, *args):
+        pass
+
+def serve_directory(directory):
+    """Запускает локальный HTTP-сервер для directory, возвращает (server, base_url)"""
+    handler = functools.partial(_QuietHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+def _read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+# ====== СЦЕНАРИИ ======
+
+def bench_parser(parser, repeat, max_seconds):
+    """Замеры запросов и форматирования в текущем каталоге"""
+    results = {}
+    
+    def run(name, func):
+        parser.reload_schedule()
+        results[name] = measure(func, repeat, max_seconds)
+        print(f"  {name:<32} {results[name]['median_ms']:>12.3f} мс ({results[name]['runs']} запусков)")
+    
+    lessons = parser.get_all_lessons()
+    classes = parser.get_available_classes()
+    teachers = sorted({t for lesson in lessons for t in parser.split_by_slash(lesson['teacher'])})
+    rooms = sorted({r for lesson in lessons for r in parser.split_by_slash(lesson['classroom'])})
+    
+    class_name = classes[len(classes) // 2]
+    teacher = teachers[len(teachers) // 2]
+    room = rooms[len(rooms) // 2]
+    substring = teacher[:3]
+    
+    # run() сбрасывает кэш один раз перед замером, поэтому повторы
+    # get_all_lessons — попадания в кэш; разбор файла замеряется отдельно
+    def get_all_lessons_cold():
+        parser.reload_schedule()
+        return parser.get_all_lessons()
+    
+    run('get_all_lessons (cold)', get_all_lessons_cold)
+    run('parse_all_lessons', parser.parse_all_lessons)
+    run('get_all_lessons', parser.get_all_lessons)
+    run('get_available_classes', parser.get_available_classes)
+    run('get_schedule_for_class', lambda: parser.get_schedule_for_class(class_name))
+    run('get_teacher_schedule', lambda: parser.get_teacher_schedule(teacher))
+    run('search_teachers_by_substring', lambda: parser.search_teachers_by_substring(substring))
+    run('get_room_schedule', lambda: parser.get_room_schedule(room))
+    run('search_rooms_by_prefix', lambda: parser.search_rooms_by_prefix(room[:2]))
+    
+    class_schedules = parser.get_schedule_for_class(class_name)
+    teacher_schedule = parser.get_teacher_schedule(teacher)
+    room_schedule = parser.get_room_schedule(room)
+    
+    run('format_class_schedule', lambda: parser.format_class_schedule(class_name, class_schedules))
+    run('format_teacher_schedule', lambda: parser.format_teacher_schedule(teacher, teacher_schedule))
+    run('format_room_schedule', lambda: parser.format_room_schedule(room, room_schedule))
+    
+    return results, {
+        'lessons': len(lessons),
+        'classes': len(classes),
+        'teachers': len(teachers),
+        'rooms': len(rooms)
+    }
+
+def bench_memory(parser, number=200):
+    """Память на запись урока и выделения памяти на один запрос"""
+    parser.reload_schedule()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        lessons = parser.get_all_lessons()
+        lessons_bytes = tracemalloc.get_traced_memory()[0] - before
+        
+        teachers = sorted(parser.get_cached_teacher_index())
+        rooms = sorted(room for room, _ in parser.get_cached_room_index().values())
+        teacher = teachers[len(teachers) // 2]
+        room = rooms[len(rooms) // 2]
+        
+        def allocated_per_query(func):
+            func()
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            for _ in range(number):
+                result = func()
+            peak = tracemalloc.get_traced_memory()[1]
+            del result
+            return peak - before
+        
+        result = {
+            'lessons_bytes': lessons_bytes,
+            'bytes_per_lesson': round(lessons_bytes / len(lessons), 1) if lessons else 0,
+            'teacher_query_peak_bytes': allocated_per_query(lambda: parser.get_teacher_schedule(teacher)),
+            'room_query_peak_bytes': allocated_per_query(lambda: parser.get_room_schedule(room))
+        }
+    finally:
+        tracemalloc.stop()
+    
+    print(f"  {'память на урок':<32} {result['bytes_per_lesson']:>12.1f} байт")
+    print(f"  {'пик на запрос учителя':<32} {result['teacher_query_peak_bytes']:>12} байт")
+    print(f"  {'пик на запрос кабинета':<32} {result['room_query_peak_bytes']:>12} байт")
+    return result
+
+def bench_download(site_dir, work_dir, expected_csv, repeat, max_seconds):
+    """Замер download_schedule_from_site с локального сервера"""
+    try:
+        download_schedule = importlib.import_module('download_schedule')
+    except ImportError as e:
+        print(f"  download_schedule_from_site       пропущено: {e}")
+        return {'skipped': str(e)}
+    
+    server, base_url = serve_directory(site_dir)
+    previous_dir = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        result = measure(lambda: download_schedule.download_schedule_from_site(base_url=base_url), repeat, max_seconds)
+        result['csv_matches'] = _read_bytes('school_schedule.csv') == _read_bytes(expected_csv)
+    finally:
+        os.chdir(previous_dir)
+        server.shutdown()
+        server.server_close()
+    
+    print(f"  {'download_schedule_from_site':<32} {result['median_ms']:>12.3f} мс "
+          f"({result['runs']} запусков, CSV совпадает: {result['csv_matches']})")
+    return result
+
+def bench_scale(scale, repeat, max_seconds):
+    """Все замеры для одного масштаба"""
+    config = generator.scaled_config(scale)
+    print(f"Масштаб {scale}x: {config['classes']} классов, {config['teachers']} учителей, {config['rooms']} кабинетов")
+    
+    with tempfile.TemporaryDirectory() as site_dir, tempfile.TemporaryDirectory() as work_dir:
+        csv_path, _ = generator.write_schedule(site_dir, config)
+        csv_bytes = os.path.getsize(csv_path)
+        
+        previous_dir = os.getcwd()
+        os.chdir(site_dir)
+        try:
+            import schedule_parser
+            results, sizes = bench_parser(schedule_parser, repeat, max_seconds)
+            memory = bench_memory(schedule_parser)
+        finally:
+            os.chdir(previous_dir)
+        
+        results['download_schedule_from_site'] = bench_download(site_dir, work_dir, csv_path, repeat, max_seconds)
+    
+    return {
+        'config': config,
+        'sizes': dict(sizes, csv_bytes=csv_bytes),
+        'memory': memory,
+        'results': results
+    }
+
+def bench_metrics_overhead(number=200000):
+    """Накладные расходы хуков metrics на один вызов, нс"""
+    import metrics
+    
+    def noop():
+        return None
+    
+    timed_noop = metrics.timed('benchmark', 'noop')(noop)
+    
+    def with_timer():
+        with metrics.timer('benchmark', 'timer'):
+            return None
+    
+    def per_call_ns(func):
+        return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e9
+    
+    baseline = per_call_ns(noop)
+    result = {
+        'noop_ns': round(baseline, 1),
+        'timed_decorator_ns': round(per_call_ns(timed_noop) - baseline, 1),
+        'timer_context_ns': round(per_call_ns(with_timer) - baseline, 1),
+        'inc_counter_ns': round(per_call_ns(lambda: metrics.inc('benchmark')) - baseline, 1)
+    }
+    metrics.reset()
+    
+    print("Накладные расходы метрик:")
+    for name, value in result.items():
+        print(f"  {name:<32} {value:>12.1f} нс")
+    return result
+
+# ====== СРАВНЕНИЕ ======
+
+def compare(current, baseline, threshold):
+    """Печатает изменение медиан относительно baseline, возвращает число регрессий"""
+    regressions = 0
+    print(f"\nСравнение с {baseline.get('meta', {}).get('revision', '?')} (порог x{threshold}):")
+    
+    for scale, scale_data in current['scales'].items():
+        base_scale = baseline.get('scales', {}).get(scale)
+        if not base_scale:
+            continue
+        for name, result in scale_data['results'].items():
+            base_result = base_scale['results'].get(name)
+            if not base_result or 'median_ms' not in result or 'median_ms' not in base_result:
+                continue
+            ratio = result['median_ms'] / base_result['median_ms'] if base_result['median_ms'] else float('inf')
+            mark = ''
+            if ratio > threshold:
+                mark = '  ⚠️ регрессия'
+                regressions += 1
+            print(f"  {scale}x {name:<32} {base_result['median_ms']:>12.3f} -> {result['median_ms']:>12.3f} мс  x{ratio:.2f}{mark}")
+    
+    return regressions
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры производительности парсера расписания")
+    parser.add_argument('--scale', type=float, action='append', help="масштаб расписания (можно несколько раз)")
+    parser.add_argument('--repeat', type=int, default=5, help="число повторов каждого замера")
+    parser.add_argument('--max-seconds', type=float, default=10.0, help="ограничение времени на один замер")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help="файл для результатов (JSON)")
+    parser.add_argument('--compare', help="JSON с прошлыми результатами для сравнения")
+    parser.add_argument('--threshold', type=float, default=1.2, help="во сколько раз медленнее считать регрессией")
+    parser.add_argument('--fail-on-regression', action='store_true', help="код возврата 1 при регрессии")
+    args = parser.parse_args(argv)
+    
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+            'max_seconds': args.max_seconds
+        },
+        'scales': {}
+    }
+    
+    report['metrics_overhead'] = bench_metrics_overhead()
+    
+    for scale in args.scale or DEFAULT_SCALES:
+        report['scales'][f"{scale:g}"] = bench_scale(scale, args.repeat, args.max_seconds)
+    
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты сохранены: {args.output}")
+    
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions and args.fail_on_regression:
+            return 1
+    
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,30 +1,64 @@
 import telebot
-from telebot import types
+from telebot import types, apihelper
 import os
 import sys
 import logging
 import time
+import datetime
 import re
+import io
+import functools
+import threading
+import importlib
+import importlib.util
 from dotenv import load_dotenv
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+import log_setup
+
+# Настройка логирования: записи уходят в очередь, в stdout их пишет
+# отдельный поток (LOG_LEVEL, LOG_FORMAT=json — см. log_setup.py)
+load_dotenv()
+log_setup.setup_logging()
 logger = logging.getLogger(__name__)
 
 # Добавляем путь для локальных модулей
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+import http_pool
+import metrics
+import schedule_sources
+import sender
+import singleflight
+import state_store
+import workers
+
 # ====== СОСТОЯНИЯ ПОЛЬЗОВАТЕЛЯ ======
 user_states = {}  # Словарь для хранения состояний пользователей
+last_entities = {}  # Последний найденный класс/учитель/кабинет чата: (школа, вид, название)
+chat_sources = {}  # Выбранная школа для каждого чата
+update_failures = {}  # Школа -> время последней неудачной попытки обновления
 
 # ====== БЕЗОПАСНАЯ ЗАГРУЗКА КОНФИГУРАЦИИ ======
 def load_config():
     """Безопасная загрузка конфигурации"""
     config = {
-        'BOT_TOKEN': None
+        'BOT_TOKEN': None,
+        'ADMIN_IDS': [],
+        'METRICS_PORT': 9108,
+        'SCHEDULE_SOURCES': None,
+        'INDEX_IDLE_MINUTES': 30,
+        'SUBSCRIPTIONS_PATH': 'subscriptions.json',
+        'DIGESTS_PATH': 'digests.json',
+        'IMAGE_CACHE_DIR': 'image_cache',
+        'HISTORY_DIR': 'schedule_history',
+        'WORKERS': 1,
+        'WORKER_THREADS': 4,
+        'STATE_PATH': state_store.DEFAULT_PATH,
+        'HTTP_POOL_SIZE': http_pool.POOL_SIZE,
+        'HTTP_CONNECT_RETRIES': http_pool.CONNECT_RETRIES,
+        'HTTP_KEEPALIVE_SECONDS': http_pool.KEEPALIVE_SECONDS,
+        'HTTP_CONNECT_TIMEOUT': http_pool.CONNECT_TIMEOUT,
+        'HTTP_READ_TIMEOUT': http_pool.READ_TIMEOUT
     }
     load_dotenv()
     # ПРИОРИТЕТ 1: Переменные окружения BotHost
@@ -41,11 +75,70 @@ def load_config():
             config['BOT_TOKEN'] = token_from_env
             logger.info("✅ Токен загружен из переменной TOKEN")
     
+    # ID администраторов через запятую: ADMIN_IDS=123456789,987654321
+    admin_ids = os.getenv('ADMIN_IDS', '')
+    config['ADMIN_IDS'] = [int(admin_id) for admin_id in re.findall(r'-?\d+', admin_ids)]
+    if config['ADMIN_IDS']:
+        logger.info(f"✅ Администраторов: {len(config['ADMIN_IDS'])}")
+    
+    # Порт эндпоинта метрик Prometheus (0 - выключен)
+    metrics_port = os.getenv('METRICS_PORT')
+    if metrics_port and metrics_port.isdigit():
+        config['METRICS_PORT'] = int(metrics_port)
+    
+    # Школы, которые обслуживает бот (JSON, см. schedule_sources.py)
+    config['SCHEDULE_SOURCES'] = os.getenv('SCHEDULE_SOURCES')
+    
+    # Через сколько минут без запросов выгружать индекс школы (0 - никогда)
+    idle_minutes = os.getenv('INDEX_IDLE_MINUTES')
+    if idle_minutes and idle_minutes.isdigit():
+        config['INDEX_IDLE_MINUTES'] = int(idle_minutes)
+    
+    # Файл с подписками на изменения расписания
+    config['SUBSCRIPTIONS_PATH'] = os.getenv('SUBSCRIPTIONS_PATH', config['SUBSCRIPTIONS_PATH'])
+    config['DIGESTS_PATH'] = os.getenv('DIGESTS_PATH', config['DIGESTS_PATH'])
+    
+    # Папка для кэша картинок с расписанием
+    config['IMAGE_CACHE_DIR'] = os.getenv('IMAGE_CACHE_DIR', config['IMAGE_CACHE_DIR'])
+    
+    # Папка с историей версий файлов расписания
+    config['HISTORY_DIR'] = os.getenv('HISTORY_DIR', config['HISTORY_DIR'])
+    
+    # Несколько процессов-обработчиков (см. workers.py) и общее состояние чатов
+    for key in ['WORKERS', 'WORKER_THREADS']:
+        value = os.getenv(key)
+        if value and value.isdigit() and int(value) > 0:
+            config[key] = int(value)
+    config['STATE_PATH'] = os.getenv('STATE_PATH', config['STATE_PATH'])
+    if config['WORKERS'] > 1 and not hasattr(os, 'fork'):
+        logger.warning("⚠️ Несколько процессов не поддерживаются на этой платформе, WORKERS=1")
+        config['WORKERS'] = 1
+    
+    # Пул HTTP-соединений к Telegram и сайту школы (см. http_pool.py)
+    for key in ['HTTP_POOL_SIZE', 'HTTP_CONNECT_RETRIES', 'HTTP_KEEPALIVE_SECONDS',
+                'HTTP_CONNECT_TIMEOUT', 'HTTP_READ_TIMEOUT']:
+        value = os.getenv(key)
+        if value and value.isdigit():
+            config[key] = int(value)
+    
     return config
 
 # Загружаем конфигурацию
 config = load_config()
 BOT_TOKEN = config['BOT_TOKEN']
+ADMIN_IDS = config['ADMIN_IDS']
+METRICS_PORT = config['METRICS_PORT']
+INDEX_IDLE_MINUTES = config['INDEX_IDLE_MINUTES']
+WORKERS = config['WORKERS']
+SOURCES = schedule_sources.load_sources(config['SCHEDULE_SOURCES'])
+
+http_pool.configure(
+    pool_size=config['HTTP_POOL_SIZE'],
+    connect_retries=config['HTTP_CONNECT_RETRIES'],
+    keepalive_seconds=config['HTTP_KEEPALIVE_SECONDS'],
+    connect_timeout=config['HTTP_CONNECT_TIMEOUT'],
+    read_timeout=config['HTTP_READ_TIMEOUT']
+)
 
 # Проверяем токен
 if not BOT_TOKEN:
@@ -58,10 +151,46 @@ if not BOT_TOKEN:
 
 logger.info(f"✅ Токен получен (первые 10 символов): {BOT_TOKEN[:10]}...")
 
+# Процессы-обработчики не видят словарей друг друга: состояния чатов
+# хранятся в общей базе SQLite
+if WORKERS > 1:
+    shared_state = state_store.StateStore(config['STATE_PATH'])
+    user_states = shared_state.mapping('user_states')
+    last_entities = shared_state.mapping('last_entities')
+    chat_sources = shared_state.mapping('chat_sources')
+
+# Запросы к Telegram API идут через общую сессию с пулом соединений,
+# а не через отдельную сессию в каждом потоке; длительность каждого
+# запроса записывается в метрики
+def timed_request_sender(method, url, **kwargs):
+    """Отправляет запрос к Telegram API и записывает его длительность"""
+    api_method = url.rsplit('/', 1)[-1]
+    with metrics.timer('telegram', api_method):
+        return http_pool.get_session('telegram').request(method, url, **kwargs)
+
+apihelper.CUSTOM_REQUEST_SENDER = timed_request_sender
+apihelper.CONNECT_TIMEOUT = http_pool.CONNECT_TIMEOUT
+apihelper.READ_TIMEOUT = http_pool.READ_TIMEOUT
+
 # Создаем бота
 bot = telebot.TeleBot(BOT_TOKEN)
 
+# Рассылки (уведомления подписчикам) идут через очередь с ограничением скорости.
+# Очередь своя в каждом процессе (обработчики + главный), поэтому общий лимит
+# бота делится между ними
+outbox = sender.RateLimitedSender(
+    bot.send_message,
+    rate=sender.GLOBAL_RATE / (WORKERS + 1) if WORKERS > 1 else sender.GLOBAL_RATE
+)
+
+# Одинаковые одновременные запросы расписания считаются один раз
+schedule_flight = singleflight.SingleFlight('schedule')
+
 # ====== БЕЗОПАСНАЯ ЗАГРУЗКА МОДУЛЕЙ ======
+# Модули, которые тянут тяжёлые зависимости (requests, bs4, pandas),
+# загружаются при первом использовании, а не при старте бота
+LAZY_MODULES = ['download_schedule', 'schedule_checker']
+
 def safe_import_modules():
     """Безопасная загрузка модулей с обработкой ошибок"""
     modules = {
@@ -69,14 +198,9 @@ def safe_import_modules():
         'schedule_parser': None
     }
     
-    try:
-        import download_schedule
-        modules['download_schedule'] = download_schedule
-        logger.info("✅ Модуль download_schedule загружен")
-    except ImportError as e:
-        logger.warning(f"⚠️ Модуль download_schedule не найден: {e}")
-    except Exception as e:
-        logger.error(f"❌ Ошибка загрузки download_schedule: {e}")
+    for module_name in LAZY_MODULES:
+        if importlib.util.find_spec(module_name) is None:
+            logger.warning(f"⚠️ Модуль {module_name} не найден")
     
     try:
         import schedule_parser
@@ -89,13 +213,65 @@ def safe_import_modules():
     
     return modules
 
+def get_module(module_name):
+    """Загружает модуль при первом обращении"""
+    if modules.get(module_name) is None:
+        try:
+            modules[module_name] = importlib.import_module(module_name)
+            logger.info(f"✅ Модуль {module_name} загружен")
+        except ImportError as e:
+            logger.warning(f"⚠️ Модуль {module_name} не найден: {e}")
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка загрузки {module_name}: {e}")
+            raise
+    return modules[module_name]
+
 # Загружаем модули
 modules = safe_import_modules()
-LOCAL_MODULES = modules['download_schedule'] is not None and modules['schedule_parser'] is not None
+LOCAL_MODULES = (
+    importlib.util.find_spec('download_schedule') is not None
+    and modules['schedule_parser'] is not None
+)
 
 if not LOCAL_MODULES:
     logger.warning("⚠️ Основные модули не загружены, некоторые функции будут недоступны")
 
+subscription_store = None
+calendar_cache = None
+image_renderer = None
+digest_store = None
+digest_scheduler = None
+version_store = None
+if modules['schedule_parser'] is not None:
+    for source in SOURCES:
+        modules['schedule_parser'].register_source(source['name'], source['path'])
+    
+    import subscriptions
+    import digest
+    import calendar_export
+    calendar_cache = calendar_export.CalendarCache()
+    import schedule_image
+    image_renderer = schedule_image.ImageRenderer(schedule_image.ImageCache(config['IMAGE_CACHE_DIR']))
+    import version_store as version_store_module
+    import schedule_diff
+    version_store = version_store_module.VersionStore(config['HISTORY_DIR'])
+    subscription_store = subscriptions.SubscriptionStore(config['SUBSCRIPTIONS_PATH'], shared=WORKERS > 1).load()
+    digest_store = digest.DigestStore(config['DIGESTS_PATH'], shared=WORKERS > 1).load()
+    digest_scheduler = digest.DigestScheduler(
+        digest_store, outbox.send,
+        source_titles={source['name']: source['title'] for source in SOURCES} if len(SOURCES) > 1 else None
+    )
+
+def forget_chat(chat_id):
+    """Удаляет подписки и дайджест чата, который заблокировал бота"""
+    if subscription_store is not None:
+        subscription_store.remove_chat(chat_id)
+    if digest_store is not None:
+        digest_store.remove(chat_id)
+
+outbox.on_blocked = forget_chat
+
 # ====== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ======
 def escape_markdown(text):
     """Экранирует специальные символы MarkdownV2"""
@@ -117,27 +293,180 @@ def escape_markdown(text):
     
     return result
 
-def update_schedule_file():
-    """Обновляет файл расписания с сайта"""
+def update_schedule_file(source_name=None):
+    """Обновляет файл расписания с сайта (по умолчанию — школы текущего чата)"""
     if not LOCAL_MODULES:
         return False, "Модули расписания не загружены"
     
+    source_name = source_name or modules['schedule_parser'].current_source()
+    source = schedule_sources.get_source(source_name)
+    if source is None:
+        return False, f"❌ Неизвестная школа: {source_name}"
+    
+    with modules['schedule_parser'].use_source(source_name):
+        return _update_source(source)
+
+def _update_source(source):
+    """Скачивает расписание источника и перестраивает его индекс"""
     try:
-        logger.info("🔄 Начинаю обновление расписания с сайта...")
-        modules['download_schedule'].download_schedule_from_site()
+        # Старая таблица нужна только для уведомлений подписчикам
+        old_table = None
+        if subscription_store is not None and subscription_store.has_source(source['name']) \
+                and os.path.exists(source['path']):
+            old_table = modules['schedule_parser'].get_lesson_table()
+        
+        logger.info(f"🔄 Начинаю обновление расписания {source['name']} с сайта...")
+        download_schedule = get_module('download_schedule')
+        try:
+            download_schedule.download_schedule_from_site(base_url=source['url'], csv_path=source['path'])
+        except download_schedule.DownloadError as e:
+            # Прежний файл не тронут, бот продолжает отвечать по нему
+            update_failures[source['name']] = time.time()
+            message = f"❌ Не удалось обновить расписание: {e}"
+            updated_at = modules['schedule_parser'].schedule_updated_at()
+            if updated_at is not None:
+                message += f"\n📂 Бот отвечает по данным от {format_updated_at(updated_at)}"
+            return False, message
+        update_failures.pop(source['name'], None)
+        save_version(source)
         
-        import importlib
-        importlib.reload(modules['schedule_parser'])
+        modules['schedule_parser'].reload_schedule()
+        modules['schedule_parser'].start_index_warmup()
         
-        if os.path.exists('school_schedule.csv'):
-            file_size = os.path.getsize('school_schedule.csv')
-            return True, f"✅ Расписание обновлено! Размер файла: {file_size} байт"
+        if os.path.exists(source['path']):
+            file_size = os.path.getsize(source['path'])
+            message = f"✅ Расписание обновлено! Размер файла: {file_size} байт"
+            
+            if old_table is not None:
+                try:
+                    changed, _ = subscriptions.notify_changes(
+                        subscription_store, source['name'], old_table,
+                        modules['schedule_parser'].get_lesson_table(), outbox.send,
+                        source_title=source['title'] if len(SOURCES) > 1 else None
+                    )
+                    if changed:
+                        message += f"\n🔔 Изменилось у подписок: {changed}"
+                except Exception as e:
+                    logger.error(f"Ошибка рассылки изменений: {e}")
+            
+            # Проверка на двойные бронирования при каждом обновлении
+            try:
+                report = get_module('schedule_checker').check_schedule()
+                conflicts_count = len(report['teachers']) + len(report['rooms'])
+                if conflicts_count:
+                    message += f"\n⚠️ Найдено конфликтов в расписании: {conflicts_count}"
+            except Exception as e:
+                logger.error(f"Ошибка проверки расписания: {e}")
+            
+            return True, message
         else:
             return False, "❌ Файл расписания не был создан"
     except Exception as e:
         logger.error(f"Ошибка обновления расписания: {e}")
         return False, f"❌ Ошибка: {escape_markdown(str(e))}"
 
+def save_version(source):
+    """Сохраняет текущий файл школы в историю версий (если он изменился)"""
+    if version_store is None or not os.path.exists(source['path']):
+        return None
+    try:
+        return version_store.save(source['name'], source['path'])
+    except Exception as e:
+        logger.error(f"Ошибка сохранения версии расписания {source['name']}: {e}")
+        return None
+
+def format_updated_at(timestamp):
+    """Время скачивания расписания для сообщений"""
+    return time.strftime('%d.%m.%Y %H:%M', time.localtime(timestamp))
+
+def freshness_note():
+    """Строка «данные от …» для ответов с расписанием (MarkdownV2)"""
+    updated_at = modules['schedule_parser'].schedule_updated_at()
+    if updated_at is None:
+        return ''
+    
+    note = f"\n🕒 _Данные от {escape_markdown(format_updated_at(updated_at))}_"
+    failed_at = update_failures.get(modules['schedule_parser'].current_source())
+    if failed_at is not None and failed_at > updated_at:
+        note += "\n⚠️ _Сайт школы сейчас недоступен, показана последняя сохранённая версия_"
+    return note
+
+def is_admin(user_id):
+    """Проверяет, является ли пользователь администратором"""
+    return user_id in ADMIN_IDS
+
+# ====== ВЫБОР ШКОЛЫ ======
+def get_chat_source(chat_id):
+    """Школа, выбранная в чате (или школа по умолчанию)"""
+    source_name = chat_sources.get(chat_id)
+    if source_name and schedule_sources.get_source(source_name) is None:
+        # Школу убрали из SCHEDULE_SOURCES — чат возвращается к школе по умолчанию
+        logger.info(f"🏫 Школа {source_name} чата {chat_id} больше не настроена, используется школа по умолчанию")
+        chat_sources.pop(chat_id, None)
+        source_name = None
+    return source_name or schedule_sources.default_source_name()
+
+def set_chat_source(chat_id, source_name):
+    """Запоминает школу для чата"""
+    chat_sources[chat_id] = source_name
+    logger.debug(f"Чат {chat_id} выбрал школу {source_name}")
+
+def with_chat_source(handler):
+    """Выполняет обработчик с расписанием школы, выбранной в чате
+    
+    Записи логов внутри обработчика помечаются чатом и номером запроса.
+    """
+    @functools.wraps(handler)
+    def wrapper(message, *args, **kwargs):
+        with log_setup.request_context(message.chat.id):
+            parser = modules['schedule_parser']
+            if parser is None:
+                return handler(message, *args, **kwargs)
+            with parser.use_source(get_chat_source(message.chat.id)):
+                return handler(message, *args, **kwargs)
+    return wrapper
+
+def refresh_sources_loop(check_interval=60):
+    """Фоновое автообновление школ по их периоду и выгрузка неиспользуемых индексов"""
+    last_attempts = {}
+    
+    while True:
+        time.sleep(check_interval)
+        now = time.time()
+        
+        # Файл мог обновить процесс-обработчик (/update): иначе уведомления
+        # об изменениях считались бы от устаревшей таблицы
+        modules['schedule_parser'].reload_changed_sources()
+        
+        for source in schedule_sources.list_sources():
+            period = source['refresh_minutes'] * 60
+            if not period:
+                continue
+            
+            # Отсчёт от последнего скачивания файла или последней попытки
+            updated_at = os.path.getmtime(source['path']) if os.path.exists(source['path']) else 0
+            if now - max(updated_at, last_attempts.get(source['name'], 0)) < period:
+                continue
+            
+            last_attempts[source['name']] = now
+            try:
+                success, message = update_schedule_file(source['name'])
+                logger.info(f"⏰ Автообновление {source['name']}: {message}")
+            except Exception as e:
+                logger.error(f"Ошибка автообновления {source['name']}: {e}")
+        
+        if INDEX_IDLE_MINUTES:
+            # Версии из истории (/history) выгружаются всегда, единственная
+            # школа — никогда: к ней идут все запросы
+            keep = [SOURCES[0]['name']] if len(SOURCES) == 1 else []
+            modules['schedule_parser'].evict_idle_indexes(INDEX_IDLE_MINUTES * 60, keep=keep)
+
+def start_refresh_loop():
+    """Запускает автообновление в фоновом потоке"""
+    thread = threading.Thread(target=refresh_sources_loop, name='schedule-refresh', daemon=True)
+    thread.start()
+    return thread
+
 def create_main_keyboard():
     """Создает основную клавиатуру с кнопками"""
     keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
@@ -157,12 +486,17 @@ def create_main_keyboard():
     row2 = buttons[3:5]
     row3 = buttons[5:]
     
+    keyboard.row(*DAY_BUTTONS)
     keyboard.row(*row1)
     keyboard.row(*row2)
     keyboard.row(*row3)
     
     return keyboard
 
+# Кнопки расписания на день и состояния, в которых бот ждёт для них класс/учителя/кабинет
+DAY_BUTTONS = {"📅 Сегодня": 'сегодня', "📅 Завтра": 'завтра'}
+DAY_STATES = {'waiting_for_today': 'сегодня', 'waiting_for_tomorrow': 'завтра'}
+
 def create_search_keyboard(search_type):
     """Создает клавиатуру для режима поиска"""
     keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
@@ -170,6 +504,83 @@ def create_search_keyboard(search_type):
     keyboard.add(types.KeyboardButton("🔙 Назад к меню"))
     return keyboard
 
+# ====== КЛАВИАТУРЫ ВЫБОРА ======
+# Inline-кнопки выбора класса (параллель -> класс) и учителя (буква ->
+# фамилия). Строятся по каталогу индекса один раз на версию расписания и
+# дальше берутся из кэша, поэтому выбор кнопкой не перечитывает классы
+PICK_PREFIX = 'pick:'
+CALLBACK_DATA_LIMIT = 64  # байт в callback_data, ограничение Telegram
+ROOM_MATCHES_LIMIT = 24   # кнопок кабинетов при поиске по началу номера
+
+PICK_PROMPTS = {
+    'grades': "👇 Или выберите класс кнопкой — сначала параллель:",
+    'grade': "👇 {value} класс — выберите букву:",
+    'letters': "👇 Или выберите учителя кнопкой — сначала первую букву фамилии:",
+    'letter': "👇 Учителя на букву {value}:"
+}
+
+_pick_keyboards = {}  # (источник, версия индекса, вид, значение) -> InlineKeyboardMarkup или None
+_pick_keyboards_lock = threading.Lock()
+
+def pick_button(text, action, value=''):
+    return types.InlineKeyboardButton(text, callback_data=f"{PICK_PREFIX}{action}:{value}")
+
+def build_pick_keyboard(catalog, kind, value=''):
+    """Клавиатура выбора или None, если выбирать не из чего"""
+    if kind == 'grades':
+        keyboard = types.InlineKeyboardMarkup(row_width=4)
+        keyboard.add(*(pick_button(grade, 'grade', grade) for grade in catalog.grades))
+    elif kind == 'grade':
+        keyboard = types.InlineKeyboardMarkup(row_width=4)
+        keyboard.add(*(pick_button(name, 'class', name) for name in catalog.grades.get(value, ())))
+        if keyboard.keyboard:
+            keyboard.row(pick_button("⬅️ Параллели", 'grades'))
+    elif kind == 'letters':
+        keyboard = types.InlineKeyboardMarkup(row_width=6)
+        keyboard.add(*(pick_button(letter, 'letter', letter) for letter in catalog.initials))
+    elif kind == 'letter':
+        # Слишком длинные фамилии не влезают в callback_data — их можно ввести текстом
+        keyboard = types.InlineKeyboardMarkup(row_width=2)
+        keyboard.add(*(
+            pick_button(name, 'teacher', name) for name in catalog.initials.get(value, ())
+            if len(f"{PICK_PREFIX}teacher:{name}".encode('utf-8')) <= CALLBACK_DATA_LIMIT
+        ))
+        if keyboard.keyboard:
+            keyboard.row(pick_button("⬅️ Буквы", 'letters'))
+    else:
+        return None
+    return keyboard if keyboard.keyboard else None
+
+def get_pick_keyboard(kind, value=''):
+    """Клавиатура выбора для школы текущего чата (из кэша)"""
+    parser = modules['schedule_parser']
+    catalog = parser.get_selection_catalog()
+    key = (parser.current_source(), catalog.version, kind, value)
+    with _pick_keyboards_lock:
+        if key in _pick_keyboards:
+            metrics.inc('cache_hits', 'pick_keyboard')
+            return _pick_keyboards[key]
+    
+    keyboard = build_pick_keyboard(catalog, kind, value)
+    with _pick_keyboards_lock:
+        # Клавиатуры прежних версий расписания больше не нужны
+        if len(_pick_keyboards) >= 512:
+            _pick_keyboards.clear()
+        _pick_keyboards[key] = keyboard
+    return keyboard
+
+def send_pick_keyboard(chat_id, kind, value=''):
+    """Отправляет кнопки выбора класса или учителя, если расписание загружено"""
+    if not LOCAL_MODULES or not modules['schedule_parser'].has_schedule_file():
+        return
+    try:
+        keyboard = get_pick_keyboard(kind, value)
+    except Exception as e:
+        logger.error(f"Ошибка построения кнопок выбора: {e}")
+        return
+    if keyboard is not None:
+        bot.send_message(chat_id, PICK_PROMPTS[kind].format(value=value), reply_markup=keyboard)
+
 def set_user_state(user_id, state):
     """Устанавливает состояние пользователя"""
     user_states[user_id] = state
@@ -187,6 +598,8 @@ def clear_user_state(user_id):
 
 # ====== ОБРАБОТЧИКИ КОМАНД ======
 @bot.message_handler(commands=['start', 'help'])
+@metrics.timed('handler')
+@with_chat_source
 def send_welcome(message):
     """Обработчик команд /start и /help"""
     clear_user_state(message.chat.id)
@@ -196,9 +609,11 @@ def send_welcome(message):
         "Я помогу вам быстро найти расписание уроков\\.\n\n"
         "🎯 *Основные возможности:*\n"
         "• Поиск расписания по классу\n"
+        "• Выбор класса и учителя кнопками \\(/classes\\)\n"
         "• Поиск расписания по учителю \\(полная фамилия\\)\n"
         "• Поиск учителей по части фамилии \\(с расписанием\\)\n"
-        "• Поиск расписания по кабинету \\(полный номер\\)\n"
+        "• Поиск расписания по кабинету \\(номер или его начало\\)\n"
+        "• Расписание только на сегодня или завтра \\(кнопки 📅\\)\n"
         "• Автоматическое обновление данных\n\n"
         "📱 *Используйте кнопки ниже для навигации*\n\n"
         "💡 *Совет:* Начните с кнопки 'Найти класс' или 'Найти учителя'"
@@ -212,6 +627,8 @@ def send_welcome(message):
     )
 
 @bot.message_handler(commands=['update'])
+@metrics.timed('handler')
+@with_chat_source
 def update_command(message):
     """Обновление расписания"""
     clear_user_state(message.chat.id)
@@ -230,6 +647,8 @@ def update_command(message):
         bot.send_message(message.chat.id, msg, reply_markup=create_main_keyboard())
 
 @bot.message_handler(commands=['schedule', 'class'])
+@metrics.timed('handler')
+@with_chat_source
 def schedule_command(message):
     """Запрос расписания класса"""
     set_user_state(message.chat.id, 'waiting_for_class')
@@ -245,110 +664,860 @@ def schedule_command(message):
         parse_mode='MarkdownV2',
         reply_markup=create_search_keyboard('class')
     )
+    send_pick_keyboard(message.chat.id, 'grades')
 
 @bot.message_handler(commands=['classes'])
+@metrics.timed('handler')
+@with_chat_source
 def classes_command(message):
     """Список всех классов"""
     if not LOCAL_MODULES:
         bot.send_message(message.chat.id, "❌ Модули не загружены", reply_markup=create_main_keyboard())
         return
     
-    clear_user_state(message.chat.id)
+    clear_user_state(message.chat.id)
+    
+    try:
+        # Классы уже разложены по параллелям в каталоге индекса
+        catalog = modules['schedule_parser'].get_selection_catalog()
+        if catalog.grades:
+            text = "📋 *Все доступные классы:*\n\n"
+            for grade, classes in catalog.grades.items():
+                text += f"*{grade} класс:* {escape_markdown(', '.join(sorted(classes)))}\n"
+            
+            text += f"\n📊 Всего: {catalog.classes_count} классов\n\n👇 Расписание класса — кнопками ниже"
+            
+            bot.send_message(message.chat.id, text, parse_mode='MarkdownV2', reply_markup=get_pick_keyboard('grades'))
+        else:
+            bot.send_message(message.chat.id, 
+                           "❌ Классы не найдены\\. Используйте /update", 
+                           parse_mode='MarkdownV2',
+                           reply_markup=create_main_keyboard())
+    except Exception as e:
+        logger.error(f"Ошибка получения классов: {e}")
+        error_msg = escape_markdown(str(e))
+        bot.send_message(message.chat.id, f"❌ Ошибка: {error_msg}", parse_mode='MarkdownV2', reply_markup=create_main_keyboard())
+
+@bot.message_handler(commands=['teacher'])
+@metrics.timed('handler')
+@with_chat_source
+def teacher_command(message):
+    """Поиск расписания по учителю"""
+    args = message.text.split()
+    if len(args) < 2:
+        set_user_state(message.chat.id, 'waiting_for_teacher_full')
+        
+        bot.send_message(
+            message.chat.id,
+            "👨‍🏫 *Режим поиска учителя \\(полная фамилия\\)*\n\n"
+            "✏️ *Введите полную фамилию учителя:*\n"
+            "Например: Протасова, ИНКИНА\n\n"
+            "Используйте команду /teachers или кнопку '🔍 Поиск учителя \\(часть фамилии\\)' если не знаете полную фамилию\\.",
+            parse_mode='MarkdownV2',
+            reply_markup=create_search_keyboard('teacher')
+        )
+        send_pick_keyboard(message.chat.id, 'letters')
+        return
+    
+    teacher_name = ' '.join(args[1:])
+    search_teacher_full(message, teacher_name)
+
+@bot.message_handler(commands=['teachers'])
+@metrics.timed('handler')
+@with_chat_source
+def search_teachers_command(message):
+    """Поиск учителей по части фамилии"""
+    args = message.text.split()
+    if len(args) < 2:
+        clear_user_state(message.chat.id)
+        
+        bot.send_message(
+            message.chat.id,
+            "🔍 *Поиск учителей по части фамилии:*\n\n"
+            "✏️ *Введите часть фамилии:*\n"
+            "Например: про, инк, шум\n\n"
+            "ℹ️ *Теперь бот покажет расписание для каждого найденного учителя\\!*",
+            parse_mode='MarkdownV2',
+            reply_markup=create_main_keyboard()
+        )
+        return
+    
+    search_query = args[1]
+    search_teacher_partial(message, search_query)
+    
+@bot.message_handler(commands=['room', 'cabinet', 'кабинет'])
+@metrics.timed('handler')
+@with_chat_source
+def room_command(message):
+    """Поиск расписания по кабинету"""
+    args = message.text.split()
+    if len(args) < 2:
+        set_user_state(message.chat.id, 'waiting_for_room_full')
+        
+        bot.send_message(
+            message.chat.id,
+            "🏫 *Режим поиска кабинета*\n\n"
+            "✏️ *Введите номер кабинета:*\n"
+            "Например: 164, 243, 1 ГРУППА 456\n\n"
+            "ℹ️ Можно ввести начало номера \\(24, груп\\) — бот покажет подходящие кабинеты\\.",
+            parse_mode='MarkdownV2',
+            reply_markup=create_search_keyboard('room')
+        )
+        return
+    
+    room_number = ' '.join(args[1:])
+    search_room_full(message, room_number)
+
+@bot.message_handler(commands=['free'])
+@metrics.timed('handler')
+@with_chat_source
+def free_rooms_command(message):
+    """Поиск свободных кабинетов на урок"""
+    clear_user_state(message.chat.id)
+    
+    if not LOCAL_MODULES:
+        bot.send_message(message.chat.id, "❌ Модули не загружены", reply_markup=create_main_keyboard())
+        return
+    
+    args = message.text.split()
+    if len(args) < 3:
+        bot.send_message(
+            message.chat.id,
+            "🟢 *Поиск свободных кабинетов*\n\n"
+            "✏️ *Укажите день и номер урока или время:*\n"
+            "Например: /free пн 3, /free среда 9\\.20\n\n"
+            "ℹ️ Номер урока — порядковый номер временного слота дня "
+            "с учетом обеих смен\\.",
+            parse_mode='MarkdownV2',
+            reply_markup=create_main_keyboard()
+        )
+        return
+    
+    if not modules['schedule_parser'].has_schedule_file():
+        bot.send_message(
+            message.chat.id,
+            "❌ Файл расписания не найден\\. Используйте /update",
+            parse_mode='MarkdownV2',
+            reply_markup=create_main_keyboard()
+        )
+        return
+    
+    day_text, period = args[1], args[2]
+    
+    try:
+        free_info = modules['schedule_parser'].find_free_rooms(day_text, period)
+        
+        if free_info is None:
+            day, slots = modules['schedule_parser'].get_day_slots(day_text)
+            if not day:
+                text = f"❌ День *{escape_markdown(day_text)}* не распознан\\."
+            elif not slots:
+                text = f"❌ На *{escape_markdown(day)}* уроков в расписании нет\\."
+            else:
+                slots_list = '\n'.join(
+                    f"{num}\\. `{escape_markdown(slot.replace('–', '-'))}`"
+                    for num, slot in enumerate(slots, 1)
+                )
+                text = (
+                    f"❌ Урок *{escape_markdown(period)}* не найден\\.\n\n"
+                    f"*Уроки, {escape_markdown(day)}:*\n{slots_list}"
+                )
+            bot.send_message(message.chat.id, text, parse_mode='MarkdownV2', reply_markup=create_main_keyboard())
+            return
+        
+        bot.send_message(
+            message.chat.id,
+            modules['schedule_parser'].format_free_rooms(free_info) + freshness_note(),
+            parse_mode='MarkdownV2',
+            reply_markup=create_main_keyboard()
+        )
+    
+    except Exception as e:
+        logger.error(f"Ошибка поиска свободных кабинетов {day_text} {period}: {e}")
+        error_msg = escape_markdown(str(e))
+        bot.send_message(message.chat.id, f"❌ Ошибка: {error_msg}", parse_mode='MarkdownV2', reply_markup=create_main_keyboard())
+
+@bot.message_handler(commands=['today', 'tomorrow', 'day'])
+@metrics.timed('handler')
+@with_chat_source
+def day_command(message):
+    """Расписание на день: /today 5А, /tomorrow учитель Иванов, /day пн-ср кабинет 243"""
+    clear_user_state(message.chat.id)
+    
+    if not LOCAL_MODULES:
+        bot.send_message(message.chat.id, "❌ Модули не загружены", reply_markup=create_main_keyboard())
+        return
+    
+    command = message.text.split(maxsplit=1)[0].lstrip('/').split('@')[0].lower()
+    if command == 'day':
+        args = message.text.split(maxsplit=2)
+        if len(args) < 2:
+            bot.send_message(
+                message.chat.id,
+                "📅 *Расписание на день*\n\n"
+                "✏️ *Укажите день и класс, учителя или кабинет:*\n"
+                "/day ср 5А\n/day пн\\-ср учитель Иванов\n/day пт кабинет 243",
+                parse_mode='MarkdownV2',
+                reply_markup=create_main_keyboard()
+            )
+            return
+        day_text = args[1]
+        entity_text = args[2] if len(args) > 2 else None
+    else:
+        args = message.text.split(maxsplit=1)
+        day_text = 'сегодня' if command == 'today' else 'завтра'
+        entity_text = args[1] if len(args) > 1 else None
+    
+    send_day_schedule(message, day_text, entity_text)
+
+@bot.message_handler(func=lambda message: message.text in DAY_BUTTONS)
+@metrics.timed('handler')
+@with_chat_source
+def handle_day_button(message):
+    """Обработка кнопок '📅 Сегодня' и '📅 Завтра'"""
+    clear_user_state(message.chat.id)
+    send_day_schedule(message, DAY_BUTTONS[message.text])
+
+@bot.message_handler(commands=['school'])
+@metrics.timed('handler')
+@with_chat_source
+def school_command(message):
+    """Выбор школы: /school или /school <имя|номер>"""
+    clear_user_state(message.chat.id)
+    
+    sources = schedule_sources.list_sources()
+    current = get_chat_source(message.chat.id)
+    args = message.text.split(maxsplit=1)
+    
+    if len(args) > 1:
+        source = schedule_sources.find_source(args[1])
+        if source is None:
+            bot.send_message(
+                message.chat.id,
+                f"❌ Школа *{escape_markdown(args[1])}* не найдена\\. Список: /school",
+                parse_mode='MarkdownV2',
+                reply_markup=create_main_keyboard()
+            )
+            return
+        
+        set_chat_source(message.chat.id, source['name'])
+        bot.send_message(
+            message.chat.id,
+            f"✅ Выбрана школа: *{escape_markdown(source['title'])}*",
+            parse_mode='MarkdownV2',
+            reply_markup=create_main_keyboard()
+        )
+        return
+    
+    if len(sources) == 1:
+        text = f"🏫 Бот работает с одной школой: *{escape_markdown(sources[0]['title'])}*"
+    else:
+        lines = [
+            f"{num}\\. {escape_markdown(source['title'])} \\(`{escape_markdown(source['name'])}`\\)"
+            + (" ✅" if source['name'] == current else "")
+            for num, source in enumerate(sources, 1)
+        ]
+        text = (
+            "🏫 *Выберите школу:*\n\n" + '\n'.join(lines) +
+            "\n\n✏️ Отправьте /school \\<номер или имя\\>, например: /school 2"
+        )
+    
+    bot.send_message(message.chat.id, text, parse_mode='MarkdownV2', reply_markup=create_main_keyboard())
+
+def describe_subscription(kind, name, source_name=None):
+    """Название подписки для сообщений: 'класс 5А'"""
+    text = f"{subscriptions.KIND_TITLES[kind]} {name}"
+    if source_name and len(SOURCES) > 1:
+        source = schedule_sources.get_source(source_name)
+        text += f" ({source['title'] if source else source_name})"
+    return text
+
+@bot.message_handler(commands=['subscribe', 'unsubscribe'])
+@metrics.timed('handler')
+@with_chat_source
+def subscribe_command(message):
+    """Подписка на изменения: /subscribe 5А, /subscribe учитель Иванов, /unsubscribe кабинет 243"""
+    clear_user_state(message.chat.id)
+    
+    if subscription_store is None:
+        bot.send_message(message.chat.id, "❌ Модули не загружены", reply_markup=create_main_keyboard())
+        return
+    
+    unsubscribe = message.text.lstrip('/').lower().startswith('unsubscribe')
+    args = message.text.split(maxsplit=1)
+    if len(args) < 2:
+        command = '/unsubscribe' if unsubscribe else '/subscribe'
+        bot.send_message(
+            message.chat.id,
+            "🔔 *Уведомления об изменениях в расписании*\n\n"
+            f"✏️ *Укажите класс, учителя или кабинет:*\n"
+            f"{command} 5А\n{command} учитель Иванов\n{command} кабинет 243\n\n"
+            "📋 Ваши подписки: /subscriptions",
+            parse_mode='MarkdownV2',
+            reply_markup=create_main_keyboard()
+        )
+        return
+    
+    source_name = modules['schedule_parser'].current_source()
+    
+    if unsubscribe:
+        # Ищем среди подписок чата, а не в расписании: отписаться можно
+        # и от того, что из расписания уже пропало
+        normalize_name = modules['schedule_parser'].normalize_name
+        wanted = {normalize_name(args[1]), normalize_name(args[1].split(maxsplit=1)[-1])}
+        entity = None
+        removed = False
+        for sub_source, kind, name in subscription_store.for_chat(message.chat.id):
+            if sub_source == source_name and normalize_name(name) in wanted:
+                removed = subscription_store.remove(message.chat.id, sub_source, kind, name)
+                entity = (kind, name)
+                break
+        
+        if removed:
+            text = f"🔕 Подписка отменена: *{escape_markdown(describe_subscription(*entity))}*"
+        else:
+            text = f"❌ Подписка *{escape_markdown(args[1])}* не найдена\\. Список: /subscriptions"
+        bot.send_message(message.chat.id, text, parse_mode='MarkdownV2', reply_markup=create_main_keyboard())
+        return
+    
+    if not modules['schedule_parser'].has_schedule_file():
+        bot.send_message(
+            message.chat.id,
+            "❌ Файл расписания не найден\\. Используйте /update",
+            parse_mode='MarkdownV2',
+            reply_markup=create_main_keyboard()
+        )
+        return
+    
+    try:
+        entity = subscriptions.resolve_entity(args[1])
+        if entity is None:
+            text = (
+                f"❌ *{escape_markdown(args[1])}* нет в расписании\\.\n\n"
+                "💡 Укажите вид явно: /subscribe учитель Иванов, /subscribe кабинет 243"
+            )
+        elif subscription_store.add(message.chat.id, source_name, *entity):
+            text = (
+                f"🔔 Вы подписаны: *{escape_markdown(describe_subscription(*entity))}*\n"
+                "Я пришлю сообщение, когда расписание изменится\\."
+            )
+        else:
+            text = f"ℹ️ Вы уже подписаны: *{escape_markdown(describe_subscription(*entity))}*"
+        
+        bot.send_message(message.chat.id, text, parse_mode='MarkdownV2', reply_markup=create_main_keyboard())
+    
+    except Exception as e:
+        logger.error(f"Ошибка подписки '{args[1]}': {e}")
+        error_msg = escape_markdown(str(e))
+        bot.send_message(message.chat.id, f"❌ Ошибка: {error_msg}", parse_mode='MarkdownV2', reply_markup=create_main_keyboard())
+
+@bot.message_handler(commands=['subscriptions'])
+@metrics.timed('handler')
+@with_chat_source
+def subscriptions_command(message):
+    """Список подписок чата"""
+    clear_user_state(message.chat.id)
+    
+    if subscription_store is None:
+        bot.send_message(message.chat.id, "❌ Модули не загружены", reply_markup=create_main_keyboard())
+        return
+    
+    items = subscription_store.for_chat(message.chat.id)
+    if not items:
+        text = "🔕 Подписок нет\\.\n\nПодписаться: /subscribe 5А"
+    else:
+        lines = [f"• {escape_markdown(describe_subscription(kind, name, source))}" for source, kind, name in items]
+        text = "🔔 *Ваши подписки:*\n\n" + '\n'.join(lines) + "\n\nОтписаться: /unsubscribe \\<название\\>"
+    
+    bot.send_message(message.chat.id, text, parse_mode='MarkdownV2', reply_markup=create_main_keyboard())
+
+@bot.message_handler(commands=['digest'])
+@metrics.timed('handler')
+@with_chat_source
+def digest_command(message):
+    """Утренний дайджест: /digest 5А 07:00, /digest off"""
+    clear_user_state(message.chat.id)
+    
+    if digest_store is None:
+        bot.send_message(message.chat.id, "❌ Модули не загружены", reply_markup=create_main_keyboard())
+        return
+    
+    args = message.text.split(maxsplit=1)
+    current = digest_store.get(message.chat.id)
+    
+    if len(args) < 2:
+        if current:
+            source_name, kind, name, minute = current
+            status = (
+                f"✅ Сейчас: *{escape_markdown(describe_subscription(kind, name, source_name))}* "
+                f"в {escape_markdown(digest.format_minute(minute))}\n\n"
+                "Выключить: /digest off"
+            )
+        else:
+            status = "Дайджест выключен\\."
+        bot.send_message(
+            message.chat.id,
+            "☀️ *Утренний дайджест — уроки на сегодня*\n\n"
+            f"{status}\n\n"
+            "✏️ *Включить:* /digest 5А 07:00\n"
+            "/digest учитель Иванов 7:30\n/digest кабинет 243 8:00",
+            parse_mode='MarkdownV2',
+            reply_markup=create_main_keyboard()
+        )
+        return
+    
+    if args[1].strip().lower() in ('off', 'выкл', 'стоп'):
+        if digest_store.remove(message.chat.id):
+            text = "🔕 Дайджест выключен\\."
+        else:
+            text = "ℹ️ Дайджест и так выключен\\."
+        bot.send_message(message.chat.id, text, parse_mode='MarkdownV2', reply_markup=create_main_keyboard())
+        return
+    
+    parts = args[1].rsplit(maxsplit=1)
+    minute = digest.parse_digest_time(parts[-1]) if len(parts) == 2 else None
+    if minute is None:
+        bot.send_message(
+            message.chat.id,
+            "❌ Укажите время в формате ЧЧ:ММ, например: /digest 5А 07:00",
+            reply_markup=create_main_keyboard()
+        )
+        return
+    
+    if not modules['schedule_parser'].has_schedule_file():
+        bot.send_message(
+            message.chat.id,
+            "❌ Файл расписания не найден\\. Используйте /update",
+            parse_mode='MarkdownV2',
+            reply_markup=create_main_keyboard()
+        )
+        return
+    
+    try:
+        entity = subscriptions.resolve_entity(parts[0])
+        if entity is None:
+            bot.send_message(
+                message.chat.id,
+                f"❌ *{escape_markdown(parts[0])}* нет в расписании\\.",
+                parse_mode='MarkdownV2',
+                reply_markup=create_main_keyboard()
+            )
+            return
+        
+        source_name = modules['schedule_parser'].current_source()
+        digest_store.set(message.chat.id, source_name, entity[0], entity[1], minute)
+        bot.send_message(
+            message.chat.id,
+            f"☀️ Дайджест включён: *{escape_markdown(describe_subscription(*entity))}* "
+            f"каждый день в {escape_markdown(digest.format_minute(minute))}",
+            parse_mode='MarkdownV2',
+            reply_markup=create_main_keyboard()
+        )
+    
+    except Exception as e:
+        logger.error(f"Ошибка настройки дайджеста '{args[1]}': {e}")
+        error_msg = escape_markdown(str(e))
+        bot.send_message(message.chat.id, f"❌ Ошибка: {error_msg}", parse_mode='MarkdownV2', reply_markup=create_main_keyboard())
+
+@bot.message_handler(commands=['ics'])
+@metrics.timed('handler')
+@with_chat_source
+def ics_command(message):
+    """Расписание в календарь телефона: /ics 5А, /ics учитель Иванов"""
+    clear_user_state(message.chat.id)
+    
+    if modules['schedule_parser'] is None:
+        bot.send_message(message.chat.id, "❌ Модули не загружены", reply_markup=create_main_keyboard())
+        return
+    
+    args = message.text.split(maxsplit=1)
+    if len(args) < 2:
+        bot.send_message(
+            message.chat.id,
+            "📆 *Расписание в календарь телефона*\n\n"
+            "✏️ *Укажите класс, учителя или кабинет:*\n"
+            "/ics 5А\n/ics учитель Иванов\n/ics кабинет 243\n\n"
+            "Откройте присланный файл \\.ics, и уроки появятся в календаре каждую неделю\\.",
+            parse_mode='MarkdownV2',
+            reply_markup=create_main_keyboard()
+        )
+        return
+    
+    if not modules['schedule_parser'].has_schedule_file():
+        bot.send_message(
+            message.chat.id,
+            "❌ Файл расписания не найден\\. Используйте /update",
+            parse_mode='MarkdownV2',
+            reply_markup=create_main_keyboard()
+        )
+        return
+    
+    try:
+        entity = subscriptions.resolve_entity(args[1])
+        if entity is None:
+            bot.send_message(
+                message.chat.id,
+                f"❌ *{escape_markdown(args[1])}* нет в расписании\\.\n\n"
+                "💡 Укажите вид явно: /ics учитель Иванов, /ics кабинет 243",
+                parse_mode='MarkdownV2',
+                reply_markup=create_main_keyboard()
+            )
+            return
+        
+        kind, name = entity
+        source_name = modules['schedule_parser'].current_source()
+        key = modules['schedule_parser'].normalize_name(name)
+        lessons = subscriptions.entity_lessons(modules['schedule_parser'].get_lesson_table(), kind, key)
+        cache_key = (source_name, kind, key, calendar_export.lessons_version(lessons))
+        caption = f"📆 {describe_subscription(kind, name, source_name)}"
+        
+        file_id = calendar_cache.get_file_id(cache_key)
+        if file_id:
+            try:
+                bot.send_document(message.chat.id, file_id, caption=caption, reply_markup=create_main_keyboard())
+                return
+            except telebot.apihelper.ApiTelegramException as e:
+                logger.warning(f"file_id календаря {name} не принят, загружаем заново: {e}")
+                calendar_cache.forget_file_id(cache_key)
+        
+        source = schedule_sources.get_source(source_name)
+        file_name = re.sub(r'[^\w\-]+', '_', name)
+        content = calendar_cache.get_file(cache_key, lambda: calendar_export.build_calendar(
+            subscriptions.KIND_TITLES[kind].capitalize(), name, lessons,
+            source_title=source['title'] if source and len(SOURCES) > 1 else None
+        ))
+        sent = bot.send_document(
+            message.chat.id, io.BytesIO(content),
+            visible_file_name=f"{file_name}.ics",
+            caption=caption,
+            reply_markup=create_main_keyboard()
+        )
+        if sent.document:
+            calendar_cache.set_file_id(cache_key, sent.document.file_id)
+    
+    except Exception as e:
+        logger.error(f"Ошибка экспорта календаря '{args[1]}': {e}")
+        error_msg = escape_markdown(str(e))
+        bot.send_message(message.chat.id, f"❌ Ошибка: {error_msg}", parse_mode='MarkdownV2', reply_markup=create_main_keyboard())
+
+@bot.message_handler(commands=['image'])
+@metrics.timed('handler')
+@with_chat_source
+def image_command(message):
+    """Неделя картинкой: /image 5А, /image учитель Иванов тёмная"""
+    clear_user_state(message.chat.id)
+    
+    if image_renderer is None:
+        bot.send_message(message.chat.id, "❌ Модули не загружены", reply_markup=create_main_keyboard())
+        return
+    
+    if not schedule_image.is_available():
+        bot.send_message(
+            message.chat.id,
+            "❌ Картинки недоступны: на сервере не установлен Pillow",
+            reply_markup=create_main_keyboard()
+        )
+        return
+    
+    args = message.text.split(maxsplit=1)
+    if len(args) < 2:
+        bot.send_message(
+            message.chat.id,
+            "🖼 *Расписание на неделю картинкой*\n\n"
+            "✏️ *Укажите класс, учителя или кабинет:*\n"
+            "/image 5А\n/image учитель Иванов\n/image кабинет 243 тёмная",
+            parse_mode='MarkdownV2',
+            reply_markup=create_main_keyboard()
+        )
+        return
+    
+    if not modules['schedule_parser'].has_schedule_file():
+        bot.send_message(
+            message.chat.id,
+            "❌ Файл расписания не найден\\. Используйте /update",
+            parse_mode='MarkdownV2',
+            reply_markup=create_main_keyboard()
+        )
+        return
+    
+    query = args[1]
+    theme = 'light'
+    words = query.rsplit(maxsplit=1)
+    if len(words) == 2 and words[1].lower() in schedule_image.THEME_ALIASES:
+        query, theme = words[0], schedule_image.THEME_ALIASES[words[1].lower()]
     
     try:
-        classes = modules['schedule_parser'].get_available_classes()
-        if classes:
-            classes_by_grade = {}
-            for cls in classes:
-                match = re.search(r'(\d+)([А\\-Я])', cls)
-                if match:
-                    grade = match.group(1)
-                    if grade not in classes_by_grade:
-                        classes_by_grade[grade] = []
-                    classes_by_grade[grade].append(cls)
-            
-            text = "📋 *Все доступные классы:*\n\n"
-            for grade in sorted(classes_by_grade.keys(), key=int):
-                text += f"*{grade} класс:* {', '.join(sorted(classes_by_grade[grade]))}\n"
-            
-            text += f"\n📊 Всего: {len(classes)} классов"
-            
-            bot.send_message(message.chat.id, text, parse_mode='MarkdownV2', reply_markup=create_main_keyboard())
-        else:
-            bot.send_message(message.chat.id, 
-                           "❌ Классы не найдены\\. Используйте /update", 
-                           parse_mode='MarkdownV2',
-                           reply_markup=create_main_keyboard())
+        entity = subscriptions.resolve_entity(query)
+        if entity is None:
+            bot.send_message(
+                message.chat.id,
+                f"❌ *{escape_markdown(query)}* нет в расписании\\.\n\n"
+                "💡 Укажите вид явно: /image учитель Иванов, /image кабинет 243",
+                parse_mode='MarkdownV2',
+                reply_markup=create_main_keyboard()
+            )
+            return
+        
+        kind, name = entity
+        source_name = modules['schedule_parser'].current_source()
+        key = modules['schedule_parser'].normalize_name(name)
+        lessons = subscriptions.entity_lessons(modules['schedule_parser'].get_lesson_table(), kind, key)
+        if not lessons:
+            bot.send_message(message.chat.id, "❌ Уроков не найдено", reply_markup=create_main_keyboard())
+            return
+        
+        cache_key = (source_name, kind, key, calendar_export.lessons_version(lessons), theme)
+        caption = f"🖼 {describe_subscription(kind, name, source_name)}"
+        
+        file_id = image_renderer.cache.get_file_id(cache_key)
+        if file_id:
+            try:
+                bot.send_photo(message.chat.id, file_id, caption=caption, reply_markup=create_main_keyboard())
+                return
+            except telebot.apihelper.ApiTelegramException as e:
+                logger.warning(f"file_id картинки {name} не принят, загружаем заново: {e}")
+                image_renderer.cache.forget_file_id(cache_key)
+        
+        def render():
+            title = f"{subscriptions.KIND_TITLES[kind].capitalize()} {name}"
+            return schedule_image.render_week(kind, title, lessons, theme)
+        
+        def deliver(chat_id, photo):
+            if photo is None:
+                bot.send_message(chat_id, "❌ Не удалось нарисовать расписание", reply_markup=create_main_keyboard())
+                return None
+            if isinstance(photo, bytes):
+                photo = io.BytesIO(photo)
+            sent = bot.send_photo(chat_id, photo, caption=caption, reply_markup=create_main_keyboard())
+            return sent.photo[-1].file_id if sent.photo else None
+        
+        bot.send_chat_action(message.chat.id, 'upload_photo')
+        image_renderer.submit(cache_key, message.chat.id, render, deliver)
+    
     except Exception as e:
-        logger.error(f"Ошибка получения классов: {e}")
+        logger.error(f"Ошибка картинки расписания '{args[1]}': {e}")
         error_msg = escape_markdown(str(e))
         bot.send_message(message.chat.id, f"❌ Ошибка: {error_msg}", parse_mode='MarkdownV2', reply_markup=create_main_keyboard())
 
-@bot.message_handler(commands=['teacher'])
-def teacher_command(message):
-    """Поиск расписания по учителю"""
-    args = message.text.split()
+@bot.message_handler(commands=['history'])
+@metrics.timed('handler')
+@with_chat_source
+def history_command(message):
+    """Прошлые версии расписания: /history, /history 14.10 5А"""
+    clear_user_state(message.chat.id)
+    
+    if version_store is None:
+        bot.send_message(message.chat.id, "❌ Модули не загружены", reply_markup=create_main_keyboard())
+        return
+    
+    source_name = modules['schedule_parser'].current_source()
+    versions = version_store.versions(source_name)
+    if not versions:
+        bot.send_message(message.chat.id, "🗂 История расписания пока пуста", reply_markup=create_main_keyboard())
+        return
+    
+    args = message.text.split(maxsplit=2)
     if len(args) < 2:
-        set_user_state(message.chat.id, 'waiting_for_teacher_full')
-        
+        lines = [
+            f"• {escape_markdown(format_updated_at(version['saved_at']))} "
+            f"\\({escape_markdown(str(version['size']))} байт\\)"
+            for version in reversed(versions[-10:])
+        ]
         bot.send_message(
             message.chat.id,
-            "👨‍🏫 *Режим поиска учителя \\(полная фамилия\\)*\n\n"
-            "✏️ *Введите полную фамилию учителя:*\n"
-            "Например: Протасова, ИНКИНА\n\n"
-            "Используйте команду /teachers или кнопку '🔍 Поиск учителя \\(часть фамилии\\)' если не знаете полную фамилию\\.",
+            f"🗂 *Версии расписания* \\(всего {len(versions)}\\):\n\n" + "\n".join(lines) +
+            "\n\n✏️ Расписание на дату: /history 14\\.10 5А",
             parse_mode='MarkdownV2',
-            reply_markup=create_search_keyboard('teacher')
+            reply_markup=create_main_keyboard()
         )
         return
     
-    teacher_name = ' '.join(args[1:])
-    search_teacher_full(message, teacher_name)
-
-@bot.message_handler(commands=['teachers'])
-def search_teachers_command(message):
-    """Поиск учителей по части фамилии"""
-    args = message.text.split()
-    if len(args) < 2:
-        clear_user_state(message.chat.id)
+    date = parse_history_date(args[1])
+    if date is None or len(args) < 3:
+        bot.send_message(
+            message.chat.id,
+            "✏️ Укажите дату и класс, учителя или кабинет: /history 14.10 5А, /history вчера учитель Иванов",
+            reply_markup=create_main_keyboard()
+        )
+        return
+    
+    # Версия, по которой бот отвечал в конце того дня
+    version = version_store.version_at(source_name, datetime.datetime.combine(date, datetime.time.max))
+    if version is None:
+        bot.send_message(
+            message.chat.id,
+            f"🗂 Самая ранняя сохранённая версия — от {format_updated_at(versions[0]['saved_at'])}",
+            reply_markup=create_main_keyboard()
+        )
+        return
+    
+    try:
+        with version_store.use_version(source_name, version['id']):
+            entity = subscriptions.resolve_entity(args[2])
+            text = render_day_schedule(*entity, modules['schedule_parser'].DAY_ORDER) if entity else None
+        if text is None:
+            bot.send_message(
+                message.chat.id,
+                f"❌ *{escape_markdown(args[2])}* нет в версии от {escape_markdown(format_updated_at(version['saved_at']))}\\.",
+                parse_mode='MarkdownV2',
+                reply_markup=create_main_keyboard()
+            )
+            return
         
         bot.send_message(
             message.chat.id,
-            "🔍 *Поиск учителей по части фамилии:*\n\n"
-            "✏️ *Введите часть фамилии:*\n"
-            "Например: про, инк, шум\n\n"
-            "ℹ️ *Теперь бот покажет расписание для каждого найденного учителя\\!*",
+            f"🗂 _Версия от {escape_markdown(format_updated_at(version['saved_at']))}_\n\n{text}",
             parse_mode='MarkdownV2',
             reply_markup=create_main_keyboard()
         )
+    except Exception as e:
+        logger.error(f"Ошибка чтения версии {version['id']}: {e}")
+        error_msg = escape_markdown(str(e))
+        bot.send_message(message.chat.id, f"❌ Ошибка: {error_msg}", parse_mode='MarkdownV2', reply_markup=create_main_keyboard())
+
+def parse_history_date(text):
+    """'14.10', '14.10.2026', 'вчера' -> date или None"""
+    today = datetime.date.today()
+    text = text.strip().lower()
+    if text in ('сегодня', 'вчера'):
+        return today - datetime.timedelta(days=1 if text == 'вчера' else 0)
+    
+    match = re.match(r'^(\d{1,2})\.(\d{1,2})(?:\.(\d{2,4}))?$', text)
+    if not match:
+        return None
+    day, month = int(match.group(1)), int(match.group(2))
+    year = int(match.group(3)) if match.group(3) else today.year
+    if year < 100:
+        year += 2000
+    if not match.group(3) and (month, day) > (today.month, today.day):
+        year -= 1  # 28.12 в январе — прошлый год
+    try:
+        return datetime.date(year, month, day)
+    except ValueError:
+        return None
+
+@bot.message_handler(commands=['changes'])
+@metrics.timed('handler')
+@with_chat_source
+def changes_command(message):
+    """Что изменилось при последнем обновлении: /changes, /changes 5А, /changes учитель Иванов"""
+    clear_user_state(message.chat.id)
+    
+    if version_store is None:
+        bot.send_message(message.chat.id, "❌ Модули не загружены", reply_markup=create_main_keyboard())
+        return
+    
+    source_name = modules['schedule_parser'].current_source()
+    versions = version_store.versions(source_name)
+    if len(versions) < 2:
+        bot.send_message(
+            message.chat.id,
+            "📭 Пока не с чем сравнивать: сохранена только одна версия расписания",
+            reply_markup=create_main_keyboard()
+        )
         return
     
-    search_query = args[1]
-    search_teacher_partial(message, search_query)
+    old_version, new_version = versions[-2], versions[-1]
+    note = f"обновление от {format_updated_at(new_version['saved_at'])}"
     
-@bot.message_handler(commands=['room', 'cabinet', 'кабинет'])
-def room_command(message):
-    """Поиск расписания по кабинету"""
-    args = message.text.split()
-    if len(args) < 2:
-        set_user_state(message.chat.id, 'waiting_for_room_full')
+    def version_table(version):
+        with version_store.use_version(source_name, version['id']):
+            return modules['schedule_parser'].get_lesson_table()
+    
+    try:
+        changes = schedule_diff.cached_diff(
+            (source_name, old_version['id'], new_version['id']),
+            lambda: version_table(old_version),
+            lambda: version_table(new_version)
+        )
+        
+        args = message.text.split(maxsplit=1)
+        if len(args) < 2:
+            text = schedule_diff.format_totals(changes, note)
+        else:
+            # Сущность ищем в новой версии, а если её убрали — в старой
+            entity = None
+            for version in (new_version, old_version):
+                with version_store.use_version(source_name, version['id']):
+                    entity = subscriptions.resolve_entity(args[1])
+                if entity:
+                    break
+            if entity is None:
+                bot.send_message(
+                    message.chat.id,
+                    f"❌ *{escape_markdown(args[1])}* нет в расписании\\.\n\n"
+                    "💡 Укажите вид явно: /changes учитель Иванов, /changes кабинет 243",
+                    parse_mode='MarkdownV2',
+                    reply_markup=create_main_keyboard()
+                )
+                return
+            
+            kind, name = entity
+            entity_changes = schedule_diff.filter_changes(
+                changes, kind, modules['schedule_parser'].normalize_name(name)
+            )
+            text = schedule_diff.format_changes_summary(kind, name, entity_changes, note)
         
+        bot.send_message(message.chat.id, text, parse_mode='MarkdownV2', reply_markup=create_main_keyboard())
+    
+    except Exception as e:
+        logger.error(f"Ошибка сравнения версий расписания: {e}")
+        error_msg = escape_markdown(str(e))
+        bot.send_message(message.chat.id, f"❌ Ошибка: {error_msg}", parse_mode='MarkdownV2', reply_markup=create_main_keyboard())
+
+@bot.message_handler(commands=['conflicts'])
+@metrics.timed('handler')
+@with_chat_source
+def conflicts_command(message):
+    """Отчёт о конфликтах в расписании (только для администраторов)"""
+    clear_user_state(message.chat.id)
+    
+    if not is_admin(message.from_user.id):
+        bot.send_message(message.chat.id, "⛔ Команда доступна только администраторам", reply_markup=create_main_keyboard())
+        return
+    
+    if not LOCAL_MODULES or not modules['schedule_parser'].has_schedule_file():
+        bot.send_message(message.chat.id, "❌ Файл расписания не найден\\. Используйте /update", parse_mode='MarkdownV2', reply_markup=create_main_keyboard())
+        return
+    
+    try:
+        schedule_checker = get_module('schedule_checker')
+        report = schedule_checker.get_last_report()
         bot.send_message(
             message.chat.id,
-            "🏫 *Режим поиска кабинета \\(полный номер\\)*\n\n"
-            "✏️ *Введите полный номер кабинета:*\n"
-            "Например: 164, 243, 1 ГРУППА 456\n\n"
-            "ℹ️ *Поиск по части номера кабинета больше не доступен\\.*\n"
-            "Вводите только полный номер кабинета\\.",
+            schedule_checker.format_conflicts_report(report),
             parse_mode='MarkdownV2',
-            reply_markup=create_search_keyboard('room')
+            reply_markup=create_main_keyboard()
         )
+    except Exception as e:
+        logger.error(f"Ошибка проверки расписания: {e}")
+        error_msg = escape_markdown(str(e))
+        bot.send_message(message.chat.id, f"❌ Ошибка: {error_msg}", parse_mode='MarkdownV2', reply_markup=create_main_keyboard())
+
+@bot.message_handler(commands=['metrics'])
+@metrics.timed('handler')
+@with_chat_source
+def metrics_command(message):
+    """Метрики производительности (только для администраторов)"""
+    clear_user_state(message.chat.id)
+    
+    if not is_admin(message.from_user.id):
+        bot.send_message(message.chat.id, "⛔ Команда доступна только администраторам", reply_markup=create_main_keyboard())
         return
     
-    room_number = ' '.join(args[1:])
-    search_room_full(message, room_number)
+    args = message.text.split()
+    kinds = args[1:] or None
+    
+    report = metrics.format_report(kinds)
+    # Ограничение Telegram на длину сообщения
+    if len(report) > 4000:
+        report = report[:4000] + "\n..."
+    
+    bot.send_message(message.chat.id, report, reply_markup=create_main_keyboard())
 
 @bot.message_handler(commands=['about', 'info'])
+@metrics.timed('handler')
+@with_chat_source
 def about_command(message):
     """Информация о боте"""
     clear_user_state(message.chat.id)
@@ -361,7 +1530,7 @@ def about_command(message):
         "• Поиск расписания по классам\n"
         "• Поиск расписания по учителям \\(полная фамилия\\)\n"
         "• Поиск учителей по части фамилии \\(с выводом расписания\\)\n"
-        "• Поиск расписания по кабинетам \\(полный номер\\)\n"
+        "• Поиск расписания по кабинетам \\(номер или его начало\\)\n"
         "• Автоматическое обновление данных\n"
         "• Удобный интерфейс с кнопками\n\n"
         "⚠️ *Важная информация:*\n"
@@ -387,6 +1556,8 @@ def about_command(message):
     )
 
 @bot.message_handler(commands=['stats'])
+@metrics.timed('handler')
+@with_chat_source
 def stats_command(message):
     """Статистика бота"""
     if not LOCAL_MODULES:
@@ -402,8 +1573,9 @@ def stats_command(message):
         file_exists = modules['schedule_parser'].has_schedule_file()
         file_info = ""
         
-        if file_exists and os.path.exists('school_schedule.csv'):
-            file_size = os.path.getsize('school_schedule.csv')
+        schedule_path = modules['schedule_parser'].get_index().path
+        if file_exists and os.path.exists(schedule_path):
+            file_size = os.path.getsize(schedule_path)
             file_info = f"Размер файла: {file_size} байт\n"
         
         # Экранируем дату отдельно
@@ -429,11 +1601,15 @@ def stats_command(message):
 
 # ====== ОБРАБОТЧИКИ КНОПОК ======
 @bot.message_handler(func=lambda message: message.text == "📋 Найти класс")
+@metrics.timed('handler')
+@with_chat_source
 def handle_find_class_button(message):
     """Обработка кнопки 'Найти класс'"""
     schedule_command(message)
 
 @bot.message_handler(func=lambda message: message.text == "👨‍🏫 Найти учителя")
+@metrics.timed('handler')
+@with_chat_source
 def handle_find_teacher_button(message):
     """Обработка кнопки 'Найти учителя' (полная фамилия)"""
     set_user_state(message.chat.id, 'waiting_for_teacher_full')
@@ -452,8 +1628,11 @@ def handle_find_teacher_button(message):
         parse_mode='MarkdownV2',
         reply_markup=create_search_keyboard('teacher')
     )
+    send_pick_keyboard(message.chat.id, 'letters')
 
 @bot.message_handler(func=lambda message: message.text == "🔍 Поиск учителя (часть фамилии)")
+@metrics.timed('handler')
+@with_chat_source
 def handle_search_teacher_partial_button(message):
     """Обработка кнопки 'Поиск учителя (часть фамилии)'"""
     set_user_state(message.chat.id, 'waiting_for_teacher_partial')
@@ -471,16 +1650,18 @@ def handle_search_teacher_partial_button(message):
     )
 
 @bot.message_handler(func=lambda message: message.text == "🏫 Найти кабинет")
+@metrics.timed('handler')
+@with_chat_source
 def handle_find_room_button(message):
-    """Обработка кнопки 'Найти кабинет' (полный номер)"""
+    """Обработка кнопки 'Найти кабинет'"""
     set_user_state(message.chat.id, 'waiting_for_room_full')
     
     bot.send_message(
         message.chat.id,
-        "🏫 *Режим поиска кабинета \\(полный номер\\)*\n\n"
-        "✏️ *Введите полный номер кабинета:*\n"
+        "🏫 *Режим поиска кабинета*\n\n"
+        "✏️ *Введите номер кабинета:*\n"
         "Например: 164, 243, 1 ГРУППА 456\n\n"
-        "ℹ️ *Поиск по части номера больше не доступен\\. Вводите только полный номер\\!*\n\n"
+        "ℹ️ Можно ввести начало номера \\(24, груп\\) — бот покажет подходящие кабинеты\\.\n\n"
         "⚠️ *Внимание:* Теперь любой ваш текст будет восприниматься как поиск кабинета\n"
         "Для выхода из режима поиска нажмите кнопку '🔙 Назад к меню'",
         parse_mode='MarkdownV2',
@@ -488,11 +1669,15 @@ def handle_find_room_button(message):
     )
 
 @bot.message_handler(func=lambda message: message.text == "🔄 Обновить")
+@metrics.timed('handler')
+@with_chat_source
 def handle_update_button(message):
     """Обработка кнопки 'Обновить'"""
     update_command(message)
 
 @bot.message_handler(func=lambda message: message.text == "❓ Помощь")
+@metrics.timed('handler')
+@with_chat_source
 def handle_help_button(message):
     """Обработка кнопки 'Помощь'"""
     clear_user_state(message.chat.id)
@@ -517,12 +1702,23 @@ def handle_help_button(message):
         "3\\. Например: про, инк, шум\n"
         "4\\. *Бот покажет расписание для каждого найденного учителя\\!*\n\n"
         
-        "🏫 *Как найти расписание кабинета \\(полный номер\\):*\n"
+        "🏫 *Как найти расписание кабинета:*\n"
         "1\\. Нажмите кнопку '🏫 Найти кабинет'\n"
-        "2\\. Введите полный номер кабинета\n"
+        "2\\. Введите номер кабинета\n"
         "3\\. Например: 164, 243, 1 ГРУППА 456\n"
         "4\\. *Важно:* Учитывайте составные кабинеты \\(453\\\\241\\)\n"
-        "5\\. *Поиск по части номера больше не доступен\\!*\n\n"
+        "5\\. По началу номера \\(24, груп\\) бот покажет подходящие кабинеты\n\n"
+        
+        "💬 *Короткий вопрос — короткий ответ:*\n"
+        "Напишите, кого и когда показать, и бот пришлёт только этот день или урок:\n"
+        "• 9а завтра\n"
+        "• Протасова среда\n"
+        "• каб 243 3 урок\n\n"
+        
+        "📅 *Расписание на сегодня или завтра:*\n"
+        "1\\. Нажмите кнопку '📅 Сегодня' или '📅 Завтра'\n"
+        "2\\. Бот покажет только этот день для класса, учителя или кабинета, который вы искали последним\n"
+        "3\\. Другой день: /day пт 5А, /day пн\\-ср учитель Иванов\n\n"
         
         "🔄 *Как обновить расписание:*\n"
         "\\- Нажмите кнопку '🔄 Обновить'\n"
@@ -551,7 +1747,16 @@ def handle_help_button(message):
         "/classes \\- все классы\n"
         "/teacher \\<фамилия\\> \\- найти учителя\n"
         "/teachers \\<часть\\> \\- поиск учителей \\(с расписанием\\)\n"
-        "/room \\<номер\\> \\- найти кабинет"
+        "/room \\<номер\\> \\- найти кабинет\n"
+        "/free \\<день\\> \\<урок\\> \\- свободные кабинеты\n"
+        "/subscribe \\<класс, учитель или кабинет\\> \\- уведомления об изменениях\n"
+        "/unsubscribe \\<…\\> \\- отписаться, /subscriptions \\- мои подписки\n"
+        "/image \\<класс, учитель или кабинет\\> \\- неделя картинкой\n"
+        "/ics \\<класс, учитель или кабинет\\> \\- файл для календаря телефона\n"
+        "/digest \\<класс, учитель или кабинет\\> \\<ЧЧ:ММ\\> \\- уроки на сегодня каждое утро\n"
+        "/changes \\[класс или учитель\\] \\- что изменилось при последнем обновлении\n"
+        "/history \\<дата\\> \\<класс, учитель или кабинет\\> \\- расписание, каким оно было в тот день\n"
+        "/school \\- выбрать школу"
     )
     
     bot.send_message(
@@ -562,11 +1767,15 @@ def handle_help_button(message):
     )
 
 @bot.message_handler(func=lambda message: message.text == "ℹ️ О боте")
+@metrics.timed('handler')
+@with_chat_source
 def handle_about_button(message):
     """Обработка кнопки 'О боте'"""
     about_command(message)
 
 @bot.message_handler(func=lambda message: message.text == "🔙 Назад к меню")
+@metrics.timed('handler')
+@with_chat_source
 def handle_back_button(message):
     """Обработка кнопки 'Назад к меню'"""
     clear_user_state(message.chat.id)
@@ -578,8 +1787,56 @@ def handle_back_button(message):
         reply_markup=create_main_keyboard()
     )
 
+# ====== КНОПКИ ВЫБОРА КЛАССА И УЧИТЕЛЯ ======
+@bot.callback_query_handler(func=lambda call: (call.data or '').startswith(PICK_PREFIX))
+@metrics.timed('handler')
+def handle_pick_callback(call):
+    """Нажатие inline-кнопки выбора (pick:<действие>:<значение>)"""
+    bot.answer_callback_query(call.id)
+    if call.message is None:
+        return
+    
+    action, _, value = call.data[len(PICK_PREFIX):].partition(':')
+    handle_pick(call.message, action, value)
+
+@with_chat_source
+def handle_pick(message, action, value):
+    """Следующий шаг выбора: другая клавиатура в том же сообщении или расписание"""
+    if not LOCAL_MODULES or not modules['schedule_parser'].has_schedule_file():
+        bot.send_message(message.chat.id, "❌ Расписание не загружено. Используйте /update", reply_markup=create_main_keyboard())
+        return
+    
+    if action == 'class':
+        search_class_schedule(message, value)
+        return
+    if action == 'teacher':
+        search_teacher_full(message, value)
+        return
+    if action == 'room':
+        search_room_full(message, value)
+        return
+    if action not in PICK_PROMPTS:
+        return
+    
+    keyboard = get_pick_keyboard(action, value)
+    if keyboard is None:
+        # Кнопка из старой версии расписания — начинаем выбор заново
+        action = 'grades' if action in ('grades', 'grade') else 'letters'
+        value = ''
+        keyboard = get_pick_keyboard(action)
+    
+    try:
+        bot.edit_message_text(
+            PICK_PROMPTS[action].format(value=value), message.chat.id, message.message_id, reply_markup=keyboard
+        )
+    except apihelper.ApiTelegramException as e:
+        # "message is not modified" при повторном нажатии той же кнопки
+        logger.debug(f"Кнопки выбора не обновлены: {e}")
+
 # ====== ОБРАБОТЧИКИ ТЕКСТА С УЧЕТОМ СОСТОЯНИЙ ======
 @bot.message_handler(func=lambda message: True)
+@metrics.timed('handler')
+@with_chat_source
 def handle_text(message):
     """Обработка текстовых сообщений с учетом состояний"""
     user_input = message.text.strip()
@@ -589,7 +1846,8 @@ def handle_text(message):
     # Проверяем, если это не обычный текст (уже обработанные кнопки)
     main_buttons = [
         "📋 Найти класс", "👨‍🏫 Найти учителя", "🔍 Поиск учителя (часть фамилии)",
-        "🏫 Найти кабинет", "🔄 Обновить", "❓ Помощь", "ℹ️ О боте", "🔙 Назад к меню"
+        "🏫 Найти кабинет", "🔄 Обновить", "❓ Помощь", "ℹ️ О боте", "🔙 Назад к меню",
+        *DAY_BUTTONS
     ]
     if user_input in main_buttons:
         return
@@ -609,6 +1867,10 @@ def handle_text(message):
         return
     
     try:
+        # "9а завтра", "Протасова среда", "каб 243 3 урок" — сразу нужный срез
+        if answer_narrow_query(message, user_input):
+            return
+        
         # Обработка в зависимости от состояния
         if current_state == 'waiting_for_class':
             search_class_schedule(message, user_input)
@@ -622,6 +1884,9 @@ def handle_text(message):
         elif current_state == 'waiting_for_room_full':
             search_room_full(message, user_input)
             
+        elif current_state in DAY_STATES:
+            send_day_schedule(message, DAY_STATES[current_state], user_input)
+            
         else:
             # Обычный режим - пытаемся определить, что хочет пользователь
             if re.match(r'^\d+\s*[А-Яа-яA-Za-z]$', user_input, re.IGNORECASE):
@@ -672,31 +1937,45 @@ def handle_text(message):
             reply_markup=create_main_keyboard()
         )
 
+def answer_narrow_query(message, user_input):
+    """Отвечает срезом расписания на запрос с днём или уроком
+    
+    Возвращает False, если в запросе нет дня или номера урока — тогда
+    сообщение обрабатывается как раньше (класс, кабинет, часть фамилии).
+    """
+    query_parser = get_module('query_parser')
+    query = query_parser.parse_query(user_input)
+    if not query_parser.is_narrow(query):
+        return False
+    
+    lessons = query_parser.select_lessons(query)
+    bot.send_message(
+        message.chat.id,
+        query_parser.format_slice(query, lessons) + freshness_note(),
+        parse_mode='MarkdownV2',
+        reply_markup=create_main_keyboard()
+    )
+    return True
+
 def search_room_full(message, room_number):
-    """Поиск кабинета по полному номеру"""
+    """Поиск кабинета по номеру, а если такого нет — по началу номера"""
     try:
-        schedule_by_day = modules['schedule_parser'].get_room_schedule(room_number)
+        def compute():
+            schedule_by_day = modules['schedule_parser'].get_room_schedule(room_number)
+            if not schedule_by_day:
+                return None
+            return modules['schedule_parser'].format_room_schedule(room_number, schedule_by_day)
         
-        if not schedule_by_day:
-            escaped_room = escape_markdown(room_number)
-            bot.send_message(
-                message.chat.id,
-                f"❌ Кабинет *{escaped_room}* не найден\\.\n\n"
-                "Возможные причины:\n"
-                "• Опечатка в номере кабинета\n"
-                "• Кабинет не используется в расписании\n"
-                "• Номер написан по\\-другому \\(например, 1 ГРУППА 456\\)\n\n"
-                "💡 *Важно:* Поиск по части номера больше не доступен\\!",
-                parse_mode='MarkdownV2',
-                reply_markup=create_search_keyboard('room')
-            )
-            return
+        response_text = shared_query('room', room_number, compute)
         
-        response_text = modules['schedule_parser'].format_room_schedule(room_number, schedule_by_day)
+        if response_text is None:
+            search_room_partial(message, room_number)
+            return
         
+        remember_entity(message.chat.id, 'room', room_number)
         bot.send_message(
             message.chat.id,
-            response_text,
+            response_text + freshness_note(),
             parse_mode='MarkdownV2',
             reply_markup=create_search_keyboard('room')
         )
@@ -711,13 +1990,62 @@ def search_room_full(message, room_number):
             reply_markup=create_search_keyboard('room')
         )
 
+def search_room_partial(message, prefix):
+    """Кабинеты, номер которых начинается с prefix: один — сразу расписание, несколько — кнопки"""
+    matches = modules['schedule_parser'].search_rooms_by_prefix(prefix, limit=ROOM_MATCHES_LIMIT + 1)
+    
+    if len(matches) == 1:
+        search_room_full(message, matches[0])
+        return
+    
+    escaped_room = escape_markdown(prefix)
+    if not matches:
+        bot.send_message(
+            message.chat.id,
+            f"❌ Кабинет *{escaped_room}* не найден\\.\n\n"
+            "Возможные причины:\n"
+            "• Опечатка в номере кабинета\n"
+            "• Кабинет не используется в расписании\n"
+            "• Номер написан по\\-другому \\(например, 1 ГРУППА 456\\)",
+            parse_mode='MarkdownV2',
+            reply_markup=create_search_keyboard('room')
+        )
+        return
+    
+    text = f"🔍 *Кабинеты, начинающиеся с '{escaped_room}':*\n\n👇 Выберите кабинет"
+    if len(matches) > ROOM_MATCHES_LIMIT:
+        matches = matches[:ROOM_MATCHES_LIMIT]
+        text += f" \\(показаны первые {ROOM_MATCHES_LIMIT}, уточните номер\\)"
+    
+    keyboard = types.InlineKeyboardMarkup(row_width=3)
+    keyboard.add(*(
+        pick_button(room, 'room', room) for room in matches
+        if len(f"{PICK_PREFIX}room:{room}".encode('utf-8')) <= CALLBACK_DATA_LIMIT
+    ))
+    bot.send_message(message.chat.id, text, parse_mode='MarkdownV2', reply_markup=keyboard)
+
 # ====== ФУНКЦИИ ПОИСКА ======
+def shared_query(kind, name, compute):
+    """Текст ответа compute(), общий для одновременных запросов той же сущности"""
+    parser = modules['schedule_parser']
+    index = parser.get_index()
+    key = (index.name, kind, parser.normalize_name(name), index.version)
+    return schedule_flight.do(key, compute)
+
 def search_class_schedule(message, class_name):
     """Поиск расписания для класса"""
     try:
-        schedules = modules['schedule_parser'].get_schedule_for_class(class_name)
+        def compute():
+            schedules = modules['schedule_parser'].get_schedule_for_class(class_name)
+            if not schedules:
+                return None
+            # Название класса — как в расписании, ответ общий для '7а' и '7А'
+            canonical_name = schedules[0]['lessons'][0]['class_name']
+            return modules['schedule_parser'].format_class_schedule(canonical_name, schedules)
+        
+        message_text = shared_query('class', class_name, compute)
         
-        if not schedules:
+        if message_text is None:
             escaped_class = escape_markdown(class_name)
             bot.send_message(
                 message.chat.id,
@@ -728,13 +2056,13 @@ def search_class_schedule(message, class_name):
                 parse_mode='MarkdownV2',
                 reply_markup=create_search_keyboard('class')
             )
+            send_pick_keyboard(message.chat.id, 'grades')
             return
         
-        message_text = modules['schedule_parser'].format_class_schedule(class_name, schedules)
-        
+        remember_entity(message.chat.id, 'class', class_name)
         bot.send_message(
             message.chat.id,
-            message_text,
+            message_text + freshness_note(),
             parse_mode='MarkdownV2',
             reply_markup=create_search_keyboard('class')
         )
@@ -749,12 +2077,128 @@ def search_class_schedule(message, class_name):
             reply_markup=create_search_keyboard('class')
         )
 
+def remember_entity(chat_id, kind, name):
+    """Запоминает, что чат искал, — для кнопок '📅 Сегодня' и '📅 Завтра'"""
+    last_entities[chat_id] = (modules['schedule_parser'].current_source(), kind, name)
+
+def render_day_schedule(kind, name, days):
+    """Текст расписания сущности только за дни days или None, если уроков нет"""
+    parser = modules['schedule_parser']
+    
+    def compute():
+        if kind == 'class':
+            schedules = parser.get_schedule_for_class(name, days)
+            if not schedules:
+                return None
+            return parser.format_class_schedule(schedules[0]['lessons'][0]['class_name'], schedules)
+        if kind == 'teacher':
+            schedule_by_day = parser.get_teacher_schedule(name, days)
+            return parser.format_teacher_schedule(name, schedule_by_day) if schedule_by_day else None
+        schedule_by_day = parser.get_room_schedule(name, days)
+        return parser.format_room_schedule(name, schedule_by_day) if schedule_by_day else None
+    
+    return shared_query(f"{kind}:{','.join(days)}", name, compute)
+
+def send_day_schedule(message, day_text, entity_text=None):
+    """Расписание за день или дни для сущности из текста или последней найденной"""
+    chat_id = message.chat.id
+    parser = modules['schedule_parser']
+    
+    if not parser.has_schedule_file():
+        bot.send_message(
+            chat_id,
+            "❌ Файл расписания не найден\\. Используйте /update",
+            parse_mode='MarkdownV2',
+            reply_markup=create_main_keyboard()
+        )
+        return
+    
+    days = parser.parse_day_range(day_text)
+    if days is None:
+        bot.send_message(
+            chat_id,
+            f"❌ Не понял день *{escape_markdown(day_text)}*\\.\n\n"
+            "💡 Примеры: ср, пт, пн\\-ср, сегодня, завтра",
+            parse_mode='MarkdownV2',
+            reply_markup=create_main_keyboard()
+        )
+        return
+    
+    try:
+        if entity_text:
+            entity = subscriptions.resolve_entity(entity_text)
+            if entity is None:
+                bot.send_message(
+                    chat_id,
+                    f"❌ *{escape_markdown(entity_text)}* нет в расписании\\.\n\n"
+                    "💡 Укажите вид явно: учитель Иванов, кабинет 243",
+                    parse_mode='MarkdownV2',
+                    reply_markup=create_main_keyboard()
+                )
+                return
+            kind, name = entity
+            remember_entity(chat_id, kind, name)
+        else:
+            last = last_entities.get(chat_id)
+            state = next((state for state, text in DAY_STATES.items() if text == day_text), None)
+            if (last is None or last[0] != parser.current_source()) and state is None:
+                bot.send_message(
+                    chat_id,
+                    "✏️ Укажите класс, учителя или кабинет: /day ср 5А",
+                    reply_markup=create_main_keyboard()
+                )
+                return
+            if last is None or last[0] != parser.current_source():
+                # Не знаем, чьё расписание показать, — спрашиваем
+                set_user_state(chat_id, state)
+                bot.send_message(
+                    chat_id,
+                    f"📅 *Расписание на {escape_markdown(day_text)}*\n\n"
+                    "✏️ *Введите класс, фамилию учителя или кабинет:*\n"
+                    "Например: 5А, учитель Иванов, кабинет 243\n\n"
+                    "В следующий раз кнопка сразу покажет расписание того, кого вы искали последним\\.",
+                    parse_mode='MarkdownV2',
+                    reply_markup=create_search_keyboard('day')
+                )
+                return
+            _, kind, name = last
+        
+        if not days:
+            text = f"😴 *{escape_markdown(day_text.capitalize())} воскресенье* — уроков нет\\."
+        else:
+            text = render_day_schedule(kind, name, days)
+            if text is None:
+                title = f"{subscriptions.KIND_TITLES[kind]} {name}"
+                text = (
+                    f"📅 У *{escape_markdown(title)}* нет уроков: "
+                    f"{escape_markdown(', '.join(day.lower() for day in days))}\\."
+                )
+        
+        bot.send_message(
+            chat_id,
+            text + freshness_note(),
+            parse_mode='MarkdownV2',
+            reply_markup=create_main_keyboard()
+        )
+    
+    except Exception as e:
+        logger.error(f"Ошибка расписания на день '{day_text}': {e}")
+        error_msg = escape_markdown(str(e)) if str(e) else "Неизвестная ошибка"
+        bot.send_message(chat_id, f"❌ Ошибка: {error_msg}", parse_mode='MarkdownV2', reply_markup=create_main_keyboard())
+
+def render_teacher_schedule(teacher_name):
+    """Текст расписания учителя или None, если учителя нет"""
+    schedule_by_day = modules['schedule_parser'].get_teacher_schedule(teacher_name)
+    if not schedule_by_day:
+        return None
+    return modules['schedule_parser'].format_teacher_schedule(teacher_name, schedule_by_day)
+
 def search_teacher_full(message, teacher_name):
     """Поиск учителя по полной фамилии"""
     try:
-        schedule_by_day = modules['schedule_parser'].get_teacher_schedule(teacher_name)
+        response_text = shared_query('teacher', teacher_name, lambda: render_teacher_schedule(teacher_name))
         
-        if not schedule_by_day:
+        if response_text is None:
             escaped_teacher = escape_markdown(teacher_name)
             bot.send_message(
                 message.chat.id,
@@ -766,13 +2210,13 @@ def search_teacher_full(message, teacher_name):
                 parse_mode='MarkdownV2',
                 reply_markup=create_search_keyboard('teacher')
             )
+            send_pick_keyboard(message.chat.id, 'letters')
             return
         
-        response_text = modules['schedule_parser'].format_teacher_schedule(teacher_name, schedule_by_day)
-        
+        remember_entity(message.chat.id, 'teacher', teacher_name)
         bot.send_message(
             message.chat.id,
-            response_text,
+            response_text + freshness_note(),
             parse_mode='MarkdownV2',
             reply_markup=create_search_keyboard('teacher')
         )
@@ -823,9 +2267,8 @@ def search_teacher_partial(message, search_query):
         # Показываем расписание для каждого найденного учителя
         for teacher in matches:
             try:
-                schedule_by_day = modules['schedule_parser'].get_teacher_schedule(teacher)
-                if schedule_by_day:
-                    response_text = modules['schedule_parser'].format_teacher_schedule(teacher, schedule_by_day)
+                response_text = shared_query('teacher', teacher, lambda: render_teacher_schedule(teacher))
+                if response_text:
                     bot.send_message(
                         message.chat.id,
                         response_text,
@@ -843,7 +2286,7 @@ def search_teacher_partial(message, search_query):
             f"✅ *Готово\\! Показано расписание для {len(matches)} учителей\\.*\n\n"
             f"💡 *Для поиска другого учителя:*\n"
             f"• Введите другую часть фамилии\n"
-            f"• Или нажмите '🔙 Назад к меню'",
+            f"• Или нажмите '🔙 Назад к меню'" + freshness_note(),
             parse_mode='MarkdownV2',
             reply_markup=create_search_keyboard('teacher')
         )
@@ -865,28 +2308,61 @@ def main():
     logger.info("🤖 ШКОЛЬНЫЙ БОТ ЗАПУСКАЕТСЯ")
     logger.info("=" * 60)
     
-    global user_states
-    user_states = {}
+    user_states.clear()
     logger.info("✅ Система состояний инициализирована")
     
     if LOCAL_MODULES:
-        if os.path.exists('school_schedule.csv'):
-            logger.info("✅ Файл расписания найден")
-            
-            try:
-                teacher_index = modules['schedule_parser'].get_cached_teacher_index()
-                logger.info(f"✅ Индекс учителей создан: {len(teacher_index)} учителей")
-            except Exception as e:
-                logger.error(f"⚠️ Ошибка создания индекса учителей: {e}")
-        else:
-            logger.info("📭 Файл расписания не найден")
-            logger.info("ℹ️  Используйте /update в боте для загрузки")
+        if WORKERS > 1:
+            # Таблица уроков одна на все процессы: файл .idx через mmap
+            modules['schedule_parser'].enable_mapped_index()
+        for source in SOURCES:
+            if os.path.exists(source['path']):
+                logger.info(f"✅ Файл расписания найден: {source['path']}")
+                save_version(source)
+                
+                if WORKERS > 1:
+                    # Процессы-обработчики получат уже построенный индекс
+                    with modules['schedule_parser'].use_source(source['name']):
+                        modules['schedule_parser'].warm_up_index()
+                else:
+                    # Индекс строится в фоне, polling стартует сразу;
+                    # запросы, пришедшие раньше, дождутся индекса
+                    modules['schedule_parser'].start_index_warmup(source['name'])
+                    logger.info(f"⏳ Индекс {source['name']} строится в фоне")
+            else:
+                logger.info(f"📭 Файл расписания не найден: {source['path']}")
+                logger.info("ℹ️  Используйте /update в боте для загрузки")
+    
+    # Процессы создаются до запуска фоновых потоков: fork копирует только
+    # вызывающий поток
+    worker_pool = None
+    if WORKERS > 1:
+        worker_pool = workers.WorkerPool(
+            bot, WORKERS, config['WORKER_THREADS'],
+            before_update=modules['schedule_parser'].reload_changed_sources if LOCAL_MODULES else None,
+            on_start=outbox.start
+        ).start()
+    
+    if METRICS_PORT:
+        metrics.start_http_server(METRICS_PORT)
+    
+    if LOCAL_MODULES:
+        start_refresh_loop()
+    
+    outbox.start()
+    if digest_scheduler is not None:
+        # Первый проход сразу досылает дайджесты, пропущенные во время простоя
+        digest_scheduler.start()
     
     # На BotHost обычно используют webhook, но polling тоже работает
     # Настраиваем для работы с BotHost
     logger.info("🚀 Бот запущен на платформе BotHost")
     logger.info("📱 Режим: Long Polling")
     
+    if worker_pool is not None:
+        worker_pool.poll_forever(timeout=30)
+        return
+    
     while True:
         try:
             logger.info("🔄 Запуск polling...")
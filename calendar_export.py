@@ -0,0 +1,166 @@
+"""Экспорт расписания в iCalendar (.ics)
+
+Для класса, учителя или кабинета строится календарь с еженедельно
+повторяющимися событиями (RRULE:FREQ=WEEKLY): телефон сам покажет уроки
+на любую неделю. Время уроков берётся из интервалов расписания
+('8.30–9.10') и записывается как местное время без часового пояса.
+
+Файл зависит только от уроков сущности, поэтому его версия — хеш этих
+уроков. Первый раз файл генерируется и загружается в Telegram, дальше
+по той же версии повторно отправляется сохранённый file_id: без
+генерации и без повторной загрузки. После обновления расписания
+изменившиеся сущности получают новую версию, остальные — нет.
+"""
+import datetime
+import hashlib
+import threading
+
+import metrics
+from schedule_parser import parse_time_range, DAY_ORDER
+
+PRODUCT_ID = '-//school-schedule-bot//RU'
+
+# Сколько file_id и сгенерированных файлов держать в памяти
+MAX_CACHED_FILES = 2000
+
+def lessons_version(lessons):
+    """Версия календаря: хеш уроков сущности"""
+    digest = hashlib.sha1()
+    for lesson in sorted(lessons):
+        digest.update('\x1f'.join(lesson).encode('utf-8'))
+        digest.update(b'\x1e')
+    return digest.hexdigest()[:16]
+
+def escape_text(text):
+    """Экранирование значения свойства по RFC 5545"""
+    return (
+        text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+        .replace('\r\n', '\\n').replace('\n', '\\n')
+    )
+
+def fold_line(line):
+    """Переносит строки длиннее 75 байт (RFC 5545, 3.1)"""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line
+    
+    parts = []
+    current = ''
+    size = 0
+    limit = 75
+    for char in line:
+        char_size = len(char.encode('utf-8'))
+        if size + char_size > limit:
+            parts.append(current)
+            current = ''
+            size = 0
+            limit = 74  # продолжение начинается с пробела
+        current += char
+        size += char_size
+    parts.append(current)
+    return '\r\n '.join(parts)
+
+def week_start(today):
+    """Понедельник недели, в которую попадает today"""
+    return today - datetime.timedelta(days=today.weekday())
+
+def build_calendar(kind_title, name, lessons, today=None, source_title=None):
+    """Текст .ics для уроков (день, время, предмет, учитель, кабинет, класс)"""
+    today = today or datetime.date.today()
+    monday = week_start(today)
+    stamp = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    
+    calendar_name = f"{kind_title} {name}"
+    if source_title:
+        calendar_name += f" ({source_title})"
+    
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        f'PRODID:{PRODUCT_ID}',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{escape_text(calendar_name)}'
+    ]
+    
+    for lesson in sorted(lessons):
+        day, time_str, subject, teacher, classroom, class_name = lesson
+        if day not in DAY_ORDER:
+            continue
+        start, end = parse_time_range(time_str)
+        if not start:
+            continue  # время не разобрано
+        if end <= start:
+            end = start + 45
+        
+        date = monday + datetime.timedelta(days=DAY_ORDER.index(day))
+        starts_at = datetime.datetime.combine(date, datetime.time()) + datetime.timedelta(minutes=start)
+        ends_at = datetime.datetime.combine(date, datetime.time()) + datetime.timedelta(minutes=end)
+        
+        description = []
+        if class_name:
+            description.append(f"Класс: {class_name}")
+        if teacher:
+            description.append(f"Учитель: {teacher}")
+        uid = hashlib.sha1('\x1f'.join(lesson).encode('utf-8')).hexdigest()
+        
+        lines += [
+            'BEGIN:VEVENT',
+            f'UID:{uid}@school-schedule-bot',
+            f'DTSTAMP:{stamp}',
+            f"DTSTART:{starts_at.strftime('%Y%m%dT%H%M%S')}",
+            f"DTEND:{ends_at.strftime('%Y%m%dT%H%M%S')}",
+            'RRULE:FREQ=WEEKLY',
+            f'SUMMARY:{escape_text(subject or "Урок")}'
+        ]
+        if classroom:
+            lines.append(f'LOCATION:{escape_text(f"каб. {classroom}")}')
+        if description:
+            lines.append(f"DESCRIPTION:{escape_text(chr(10).join(description))}")
+        lines.append('END:VEVENT')
+    
+    lines.append('END:VCALENDAR')
+    return ''.join(fold_line(line) + '\r\n' for line in lines)
+
+class CalendarCache:
+    """file_id и сгенерированные файлы по (источник, вид, ключ, версия)"""
+    
+    def __init__(self, max_items=MAX_CACHED_FILES):
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self._file_ids = {}
+        self._files = {}
+    
+    def get_file_id(self, key):
+        with self._lock:
+            file_id = self._file_ids.get(key)
+        metrics.inc('ics', 'file_id_hit' if file_id else 'file_id_miss')
+        return file_id
+    
+    def set_file_id(self, key, file_id):
+        with self._lock:
+            self._file_ids[key] = file_id
+            self._files.pop(key, None)  # файл больше не нужен, есть file_id
+            _trim(self._file_ids, self.max_items)
+    
+    def forget_file_id(self, key):
+        """file_id стал недействительным — в следующий раз загрузим заново"""
+        with self._lock:
+            self._file_ids.pop(key, None)
+    
+    def get_file(self, key, build):
+        """Содержимое файла; build() вызывается только при промахе"""
+        with self._lock:
+            content = self._files.get(key)
+        if content is None:
+            with metrics.timer('ics', 'build'):
+                content = build().encode('utf-8')
+            with self._lock:
+                self._files[key] = content
+                _trim(self._files, self.max_items)
+        return content
+
+def _trim(cache, max_items):
+    """Выбрасывает самые старые записи (словари сохраняют порядок вставки)"""
+    while len(cache) > max_items:
+        del cache[next(iter(cache))]
@@ -0,0 +1,300 @@
+"""Утренние дайджесты: "ваши уроки сегодня" в выбранное время
+
+Чат выбирает сущность (класс, учителя или кабинет) и время, например
+/digest 5А 07:00. Дайджесты разложены по минутным корзинам (минута
+суток -> чаты). Раз в минуту планировщик берёт наступившие корзины,
+группирует чаты по (источник, сущность) и рендерит текст один раз на
+сущность и день, а не на каждого получателя. Готовые сообщения уходят
+через общую очередь с ограничением скорости, так что 2000 дайджестов на
+07:00 не упираются в лимиты Telegram и не задерживают ответы на команды.
+
+Для каждого чата запоминается дата последнего дайджеста. Поэтому после
+перезапуска бота пропущенные дайджесты за последние CATCHUP_MINUTES
+досылаются, а повторно не отправляются. Время — локальное время сервера
+(переменная окружения TZ).
+"""
+import contextlib
+import datetime
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import metrics
+import state_store
+import subscriptions
+from schedule_parser import (
+    escape_markdown, normalize_name, get_lesson_table, parse_time, use_source,
+    reload_changed_sources, DAY_ORDER
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH = 'digests.json'
+
+# На сколько минут назад досылать пропущенные дайджесты
+CATCHUP_MINUTES = 120
+
+TIME_PATTERN = re.compile(r'^(\d{1,2})[:.](\d{2})$')
+
+def parse_digest_time(text):
+    """'7:00', '07.30' -> минута суток или None"""
+    match = TIME_PATTERN.match((text or '').strip())
+    if not match:
+        return None
+    hours, minutes = int(match.group(1)), int(match.group(2))
+    if hours > 23 or minutes > 59:
+        return None
+    return hours * 60 + minutes
+
+def format_minute(minute):
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+# ====== ХРАНИЛИЩЕ ======
+
+class DigestStore:
+    """Настройки дайджестов с индексом по минутам суток"""
+    
+    def __init__(self, path=DEFAULT_PATH, shared=False):
+        self.path = path
+        self.shared = shared  # файл изменяют несколько процессов (см. workers.py)
+        self._lock = threading.Lock()
+        self._digests = {}    # chat_id -> (источник, вид, название, минута)
+        self._by_minute = {}  # минута суток -> {chat_id}
+        self._last_sent = {}  # chat_id -> дата последнего дайджеста (ISO)
+        self._stamp = None    # отпечаток файла, из которого прочитаны дайджесты
+    
+    def load(self):
+        """Загружает дайджесты из файла"""
+        with self._lock:
+            loaded = self._read()
+        if loaded:
+            logger.info(f"📅 Загружено дайджестов: {len(self._digests)}")
+        return self
+    
+    def _read(self):
+        """Перечитывает файл (вызывается под блокировкой)"""
+        stamp = state_store.file_stamp(self.path)
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            logger.error(f"❌ Не удалось прочитать дайджесты {self.path}: {e}")
+            return False
+        
+        self._digests.clear()
+        self._by_minute.clear()
+        for item in data.get('digests', []):
+            self._set(item['chat_id'], item['source'], item['kind'], item['name'], item['minute'])
+        self._last_sent = {int(chat_id): day for chat_id, day in data.get('last_sent', {}).items()}
+        self._stamp = stamp
+        return True
+    
+    @contextlib.contextmanager
+    def _locked(self, write=False):
+        """Блокировка; в общем режиме — ещё и между процессами с перечитыванием файла"""
+        with self._lock:
+            if not self.shared:
+                yield
+                return
+            with state_store.file_lock(self.path) if write else contextlib.nullcontext():
+                if state_store.file_stamp(self.path) != self._stamp:
+                    self._read()
+                yield
+    
+    def _save(self):
+        """Сохраняет дайджесты (вызывается под блокировкой)"""
+        data = {
+            'digests': [
+                {'chat_id': chat_id, 'source': source, 'kind': kind, 'name': name, 'minute': minute}
+                for chat_id, (source, kind, name, minute) in self._digests.items()
+            ],
+            'last_sent': {str(chat_id): day for chat_id, day in self._last_sent.items()}
+        }
+        temp_path = f"{self.path}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(temp_path, self.path)
+            self._stamp = state_store.file_stamp(self.path)
+        except OSError as e:
+            logger.error(f"❌ Не удалось сохранить дайджесты {self.path}: {e}")
+    
+    def _set(self, chat_id, source, kind, name, minute):
+        self._remove(chat_id)
+        self._digests[chat_id] = (source, kind, name, minute)
+        self._by_minute.setdefault(minute, set()).add(chat_id)
+    
+    def _remove(self, chat_id):
+        digest = self._digests.pop(chat_id, None)
+        if digest is None:
+            return False
+        chats = self._by_minute.get(digest[3])
+        if chats:
+            chats.discard(chat_id)
+            if not chats:
+                del self._by_minute[digest[3]]
+        return True
+    
+    def set(self, chat_id, source, kind, name, minute, now=None):
+        """Включает дайджест для чата (один дайджест на чат)"""
+        now = now or datetime.datetime.now()
+        with self._locked(write=True):
+            self._set(chat_id, source, kind, name, minute)
+            # Если время сегодня уже прошло, первый дайджест придёт завтра
+            if minute <= now.hour * 60 + now.minute:
+                self._last_sent[chat_id] = now.date().isoformat()
+            else:
+                self._last_sent.pop(chat_id, None)
+            self._save()
+    
+    def remove(self, chat_id):
+        """Выключает дайджест"""
+        with self._locked(write=True):
+            removed = self._remove(chat_id)
+            self._last_sent.pop(chat_id, None)
+            if removed:
+                self._save()
+        return removed
+    
+    def get(self, chat_id):
+        """Настройка дайджеста чата: (источник, вид, название, минута) или None"""
+        with self._locked():
+            return self._digests.get(chat_id)
+    
+    def due(self, first_minute, last_minute, today):
+        """Дайджесты с временем в [first_minute, last_minute], ещё не отправленные сегодня
+        
+        Возвращает {(источник, вид, название): [chat_id]}.
+        """
+        groups = {}
+        with self._locked():
+            for minute in range(max(0, first_minute), last_minute + 1):
+                for chat_id in self._by_minute.get(minute, ()):
+                    if self._last_sent.get(chat_id) == today:
+                        continue
+                    source, kind, name, _ = self._digests[chat_id]
+                    groups.setdefault((source, kind, name), []).append(chat_id)
+        return groups
+    
+    def mark_sent(self, chat_ids, today):
+        """Запоминает, что сегодня дайджест отправлен"""
+        with self._locked(write=True):
+            for chat_id in chat_ids:
+                self._last_sent[chat_id] = today
+            self._save()
+    
+    def __len__(self):
+        with self._locked():
+            return len(self._digests)
+
+# ====== РЕНДЕРИНГ ======
+
+def render_digest(kind, name, day, lessons, source_title=None):
+    """Текст дайджеста на день"""
+    title = f"{subscriptions.KIND_TITLES[kind]} {name}"
+    if source_title:
+        title += f" ({source_title})"
+    
+    result = f"☀️ *Уроки на сегодня, {escape_markdown(day.lower())}*\n_{escape_markdown(title)}_\n\n"
+    for _, time_str, subject, teacher, classroom, class_name in lessons:
+        details = [subject]
+        if kind != 'class' and class_name:
+            details.append(class_name)
+        if kind != 'teacher' and teacher:
+            details.append(teacher)
+        if kind != 'room' and classroom and classroom.upper() not in ['', 'ДЕНЬ САМОПОДГОТОВКИ']:
+            details.append(f"каб. {classroom}")
+        line = ', '.join(item for item in details if item)
+        result += f"`{escape_markdown(time_str.replace('–', '-'))}` {escape_markdown(line)}\n"
+    return result
+
+class DigestScheduler:
+    """Раз в минуту отправляет наступившие дайджесты"""
+    
+    def __init__(self, store, send, source_titles=None):
+        self.store = store
+        self.send = send
+        self.source_titles = source_titles or {}
+        self._rendered = {}  # (источник, вид, ключ, день) -> (таблица, текст или None)
+        self._thread = None
+    
+    def start(self):
+        """Запускает планировщик в фоновом потоке"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='digest', daemon=True)
+            self._thread.start()
+        return self
+    
+    def _run(self):
+        while True:
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f"Ошибка отправки дайджестов: {e}")
+            # Просыпаемся в начале следующей минуты
+            time.sleep(60 - time.time() % 60 + 0.5)
+    
+    def render(self, source, kind, name, day):
+        """Текст дайджеста для сущности на день (один раз на версию расписания)"""
+        key = normalize_name(name)
+        with use_source(source):
+            table = get_lesson_table()
+        
+        cache_key = (source, kind, key, day)
+        cached = self._rendered.get(cache_key)
+        if cached is not None and cached[0] is table:
+            return cached[1]
+        
+        lessons = sorted(
+            (lesson for lesson in subscriptions.entity_lessons(table, kind, key) if lesson[0] == day),
+            key=lambda lesson: (parse_time(lesson[1]), lesson[5])
+        )
+        text = render_digest(kind, name, day, lessons, self.source_titles.get(source)) if lessons else None
+        self._rendered[cache_key] = (table, text)
+        metrics.inc('digests', 'rendered')
+        return text
+    
+    def tick(self, now=None):
+        """Отправляет дайджесты, время которых наступило (с досылкой пропущенных)"""
+        now = now or datetime.datetime.now()
+        today = now.date().isoformat()
+        minute = now.hour * 60 + now.minute
+        
+        # Файл мог обновить процесс-обработчик: дайджест строится по свежей таблице
+        reload_changed_sources()
+        
+        groups = self.store.due(minute - CATCHUP_MINUTES, minute, today)
+        if not groups:
+            return 0
+        
+        weekday = now.weekday()
+        day = DAY_ORDER[weekday] if weekday < len(DAY_ORDER) else None
+        
+        # Кэш рендеринга нужен только на текущий день
+        self._rendered = {key: value for key, value in self._rendered.items() if key[3] == day}
+        
+        sent = 0
+        processed = []
+        for (source, kind, name), chat_ids in groups.items():
+            processed.extend(chat_ids)
+            try:
+                text = self.render(source, kind, name, day) if day else None
+            except KeyError:
+                # Школа пропала из конфигурации
+                text = None
+            if text is None:
+                continue  # в этот день уроков нет
+            
+            for chat_id in chat_ids:
+                self.send(chat_id, text, parse_mode='MarkdownV2')
+            sent += len(chat_ids)
+        
+        self.store.mark_sent(processed, today)
+        metrics.inc('digests', 'sent', sent)
+        logger.info(f"☀️ Дайджесты {format_minute(minute)}: {sent} сообщений, {len(groups)} сущностей")
+        return sent
@@ -2,30 +2,190 @@ import requests
 from bs4 import BeautifulSoup
 import csv
 import logging
+import os
+import random
+import threading
+import time
+
+import http_pool
+import metrics
 
 logger = logging.getLogger(__name__)
 
-def download_schedule_from_site():
-    """Простая версия скачивания - по одной ячейке"""
+BASE_URL = "http://www.dnevnik25.ru/"
+SCHEDULE_PATH = "расписание.files/sheet001.htm"
+CSV_PATH = "school_schedule.csv"
+
+# Таймауты запроса к сайту: (соединение, ответ), секунд
+REQUEST_TIMEOUT = (5, 10)
+
+# Попытки скачивания и общий бюджет времени на все попытки
+MAX_ATTEMPTS = 3
+DOWNLOAD_DEADLINE = 30
+
+# Пауза между попытками: случайная от 0 до BACKOFF_BASE * 2^попытка
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 8.0
+
+# После стольких неудачных скачиваний подряд сайт считается недоступным
+BREAKER_FAILURES = 3
+# и следующая попытка делается не раньше, чем через столько секунд
+BREAKER_RESET_SECONDS = 300
+
+class DownloadError(Exception):
+    """Расписание не удалось скачать, старый файл не тронут"""
+
+class CircuitOpenError(DownloadError):
+    """Сайт недавно не отвечал, запрос не отправлялся"""
+    
+    def __init__(self, url, retry_in):
+        super().__init__(f"сайт {url} недоступен, следующая попытка через {int(retry_in)} с")
+        self.retry_in = retry_in
+
+class CircuitBreaker:
+    """Размыкатель: после серии ошибок сразу отказывает, пока сайт не оживёт
+    
+    closed — запросы идут как обычно; open — запросы не отправляются до
+    истечения reset_seconds; half_open — пропускается одна пробная попытка,
+    её успех замыкает цепь, неудача снова размыкает.
+    """
+    
+    def __init__(self, failures=BREAKER_FAILURES, reset_seconds=BREAKER_RESET_SECONDS):
+        self.max_failures = failures
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+    
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return 'half_open'
+        return 'open'
+    
+    def before_call(self, url):
+        """Бросает CircuitOpenError, если запрос сейчас отправлять не нужно"""
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return
+            if state == 'half_open' and not self.trial_running:
+                self.trial_running = True
+                return
+            retry_in = max(0, self.reset_seconds - (time.monotonic() - self.opened_at))
+        metrics.inc('downloads', 'circuit_open')
+        raise CircuitOpenError(url, retry_in)
+    
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+    
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.max_failures:
+                if self.opened_at is None:
+                    logger.warning(f"🔌 Сайт расписания недоступен, пауза {self.reset_seconds} с")
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+_breakers = {}  # адрес сайта -> CircuitBreaker
+_breakers_lock = threading.Lock()
+
+def get_breaker(base_url):
+    """Размыкатель для сайта"""
+    with _breakers_lock:
+        breaker = _breakers.get(base_url)
+        if breaker is None:
+            breaker = _breakers[base_url] = CircuitBreaker()
+        return breaker
+
+BREAKER_STATE_VALUES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+def breaker_states():
+    """Состояния размыкателей по сайтам для метрик: 0 — закрыт, 1 — проба, 2 — открыт"""
+    with _breakers_lock:
+        return {url: BREAKER_STATE_VALUES[breaker.state] for url, breaker in _breakers.items()}
+
+metrics.register_gauge('download_circuit', breaker_states)
+
+def fetch_with_retries(url):
+    """GET с повторами и случайной экспоненциальной паузой, при неудаче — DownloadError"""
+    deadline = time.monotonic() + DOWNLOAD_DEADLINE
+    last_error = None
     
-    base_url = "http://www.dnevnik25.ru/"
-    schedule_url = base_url + "расписание.files/sheet001.htm"
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            # Повторы делаются здесь, поэтому у сессии сайта они выключены
+            session = http_pool.get_session('site', connect_retries=0)
+            response = session.get(url, timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+            return response
+        except requests.RequestException as e:
+            last_error = e
+            status = getattr(e.response, 'status_code', None)
+            if status is not None and 400 <= status < 500 and status != 429:
+                break  # ошибка адреса, повтор не поможет
+        
+        if attempt == MAX_ATTEMPTS:
+            break
+        pause = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+        # Следующая попытка не должна выйти за общий бюджет времени
+        if time.monotonic() + pause + sum(REQUEST_TIMEOUT) > deadline:
+            break
+        logger.warning(f"⚠️ Попытка {attempt} не удалась ({last_error}), повтор через {pause:.1f} с")
+        metrics.inc('downloads', 'retry')
+        time.sleep(pause)
     
+    logger.warning(f"⚠️ Скачивание не удалось: {last_error}")
+    raise DownloadError(f"не удалось скачать {url}: {describe_request_error(last_error)}")
+
+def describe_request_error(error):
+    """Короткое описание ошибки requests для пользователя"""
+    if isinstance(error, requests.Timeout):
+        return "сайт не ответил вовремя"
+    if isinstance(error, requests.ConnectionError):
+        return "нет соединения с сайтом"
+    status = getattr(error.response, 'status_code', None)
+    if status is not None:
+        return f"сайт ответил кодом {status}"
+    return str(error)
+
+@metrics.timed('download')
+def download_schedule_from_site(base_url=None, csv_path=None):
+    """Скачивает расписание в CSV по одной ячейке
+    
+    Возвращает путь к файлу. При ошибке бросает DownloadError, а прежний
+    файл остаётся на месте, чтобы бот продолжал отвечать по нему.
+    """
+    
+    base_url = base_url or BASE_URL
+    csv_path = csv_path or CSV_PATH
+    schedule_url = base_url + SCHEDULE_PATH
+    breaker = get_breaker(base_url)
+    
+    breaker.before_call(base_url)
     logger.info(f"🌐 Скачиваю расписание (простая версия): {schedule_url}")
     
+    temp_path = f"{csv_path}.tmp"
     try:
-        response = requests.get(schedule_url, timeout=30)
+        response = fetch_with_retries(schedule_url)
         response.encoding = 'windows-1251'
         
         soup = BeautifulSoup(response.text, 'html.parser')
         table = soup.find('table')
         
         if not table:
-            logger.error("❌ Таблица не найдена")
-            return
+            metrics.inc('downloads', 'no_table')
+            raise DownloadError("на странице расписания не найдена таблица")
         
-        # Создаем CSV построчно
-        with open('school_schedule.csv', 'w', encoding='utf-8', newline='') as csvfile:
+        # Создаем CSV построчно во временном файле
+        with open(temp_path, 'w', encoding='utf-8', newline='') as csvfile:
             writer = csv.writer(csvfile)
             
             # Проходим по всем строкам таблицы
@@ -52,12 +212,25 @@ def download_schedule_from_site():
                 if row_data:
                     writer.writerow(row_data)
         
-        logger.info(f"✅ Расписание сохранено")
-        
-        # Создаем тестовый файл для проверки
-
+        # Подменяем файл целиком, только когда новый полностью записан
+        os.replace(temp_path, csv_path)
         
     except Exception as e:
         logger.error(f"❌ Ошибка: {e}")
+        metrics.inc('downloads', 'error')
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        if isinstance(e, DownloadError):
+            # Сайт не ответил или ответил не тем
+            breaker.record_failure()
+            raise
+        # Ошибка на нашей стороне (запись файла, разбор) — сайт не виноват
+        breaker.record_success()
+        raise DownloadError(f"не удалось сохранить {csv_path}: {e}") from e
+    
+    breaker.record_success()
+    logger.info(f"✅ Расписание сохранено")
+    metrics.inc('downloads', 'ok')
+    return csv_path
 
         
\ No newline at end of file
@@ -0,0 +1,158 @@
+"""Общие HTTP-сессии с пулом соединений
+
+По умолчанию telebot создаёт отдельную сессию requests в каждом потоке,
+а download_schedule открывал новое соединение на каждый запрос. При
+рассылках большая часть времени уходила на TCP- и TLS-рукопожатия.
+Здесь создаются именованные сессии ('telegram', 'site') с общим пулом
+соединений, TCP keep-alive, таймаутами и повтором при ошибке соединения:
+
+    session = http_pool.get_session('site')
+    response = session.get(url, timeout=http_pool.timeout())
+
+Повторяются только ошибки установления соединения: запрос, который
+дошёл до сервера, не отправляется второй раз (sendMessage не продублируется).
+Доля переиспользованных соединений видна в метриках ([http_requests],
+[http_connections], [http_reuse_percent]).
+"""
+import logging
+import os
+import socket
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Соединений в пуле на один хост (не меньше числа потоков, которые шлют запросы)
+POOL_SIZE = 8
+
+# Повторы при ошибке соединения
+CONNECT_RETRIES = 2
+
+# TCP keep-alive: через сколько секунд простоя проверять соединение (0 — выключено)
+KEEPALIVE_SECONDS = 60
+
+# Таймауты по умолчанию: (соединение, ответ), секунд
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+
+_sessions = {}  # имя -> (сессия, адаптер)
+_lock = threading.Lock()
+
+def _reset_in_child():
+    """После fork соединения родителя не используются: дочерний процесс открывает свои"""
+    global _lock
+    _lock = threading.Lock()
+    _sessions.clear()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_in_child)
+
+def configure(pool_size=None, connect_retries=None, keepalive_seconds=None,
+              connect_timeout=None, read_timeout=None):
+    """Меняет настройки пула (до создания сессий)"""
+    global POOL_SIZE, CONNECT_RETRIES, KEEPALIVE_SECONDS, CONNECT_TIMEOUT, READ_TIMEOUT
+    if pool_size is not None:
+        POOL_SIZE = pool_size
+    if connect_retries is not None:
+        CONNECT_RETRIES = connect_retries
+    if keepalive_seconds is not None:
+        KEEPALIVE_SECONDS = keepalive_seconds
+    if connect_timeout is not None:
+        CONNECT_TIMEOUT = connect_timeout
+    if read_timeout is not None:
+        READ_TIMEOUT = read_timeout
+
+def timeout():
+    """Таймауты (соединение, ответ) для запросов"""
+    return (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+def _socket_options():
+    """Опции сокета для TCP keep-alive (что поддерживает система)"""
+    options = [(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)]
+    if not KEEPALIVE_SECONDS:
+        return options
+    
+    options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, KEEPALIVE_SECONDS))
+    elif hasattr(socket, 'TCP_KEEPALIVE'):  # macOS
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, KEEPALIVE_SECONDS))
+    if hasattr(socket, 'TCP_KEEPINTVL'):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(1, KEEPALIVE_SECONDS // 4)))
+    if hasattr(socket, 'TCP_KEEPCNT'):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 4))
+    return options
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter с опциями сокета для keep-alive"""
+    
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = _socket_options()
+        super().init_poolmanager(*args, **kwargs)
+
+def make_session(pool_size=None, connect_retries=None):
+    """Сессия с пулом соединений и повтором при ошибке соединения"""
+    pool_size = pool_size or POOL_SIZE
+    retries = CONNECT_RETRIES if connect_retries is None else connect_retries
+    adapter = PooledAdapter(
+        pool_connections=4,
+        pool_maxsize=pool_size,
+        pool_block=False,
+        # Только ошибки соединения: запрос до сервера не дошёл, повтор безопасен
+        max_retries=Retry(total=retries, connect=retries, read=0, status=0, other=0,
+                          backoff_factor=0.2, raise_on_status=False)
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session, adapter
+
+def get_session(name, connect_retries=None):
+    """Общая сессия по имени (создаётся при первом обращении)"""
+    entry = _sessions.get(name)
+    if entry is None:
+        with _lock:
+            entry = _sessions.get(name)
+            if entry is None:
+                entry = _sessions[name] = make_session(connect_retries=connect_retries)
+                logger.info(f"🔌 HTTP-сессия {name}: пул {POOL_SIZE}, keep-alive {KEEPALIVE_SECONDS} с")
+    return entry[0]
+
+def _pool_counters(adapter):
+    """(запросов, открыто соединений) по всем пулам адаптера"""
+    requests_count = connections = 0
+    for key in list(adapter.poolmanager.pools.keys()):
+        pool = adapter.poolmanager.pools.get(key)
+        if pool is not None:
+            requests_count += pool.num_requests
+            connections += pool.num_connections
+    return requests_count, connections
+
+def pool_stats():
+    """{имя: (запросов, соединений)} по всем сессиям"""
+    with _lock:
+        entries = list(_sessions.items())
+    return {name: _pool_counters(adapter) for name, (_, adapter) in entries}
+
+def _requests_gauge():
+    return {name: counts[0] for name, counts in pool_stats().items()}
+
+def _connections_gauge():
+    return {name: counts[1] for name, counts in pool_stats().items()}
+
+def _reuse_gauge():
+    """Процент запросов, ушедших по уже открытому соединению"""
+    return {
+        name: round(100 * (1 - connections / requests_count), 1)
+        for name, (requests_count, connections) in pool_stats().items()
+        if requests_count
+    }
+
+metrics.register_gauge('http_requests', _requests_gauge)
+metrics.register_gauge('http_connections', _connections_gauge)
+metrics.register_gauge('http_reuse_percent', _reuse_gauge)
@@ -0,0 +1,175 @@
+"""Неблокирующее логирование через очередь
+
+logging.basicConfig пишет в консоль прямо из потока обработчика, и под
+нагрузкой медленный вывод контейнера попадает в задержку ответов. Здесь
+корневой логгер пишет только в очередь (QueueHandler), а в консоль записи
+выводит отдельный поток (QueueListener). Обработчик сообщения никогда не
+ждёт ввода-вывода.
+
+Каждая запись получает chat_id и request_id текущего запроса (см.
+request_context), так что строки одного запроса легко найти. Формат —
+текст или JSON (LOG_FORMAT=json), по строке на запись.
+
+Повторяющиеся сообщения прореживаются: с одной строки кода проходит не
+больше SAMPLE_BURST записей за SAMPLE_WINDOW секунд, остальные
+отбрасываются, а к первой записи следующего окна дописывается, сколько
+было пропущено. Ошибки (ERROR и выше) не прореживаются.
+"""
+import atexit
+import contextlib
+import contextvars
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(context)s%(message)s'
+
+# Прореживание: не больше SAMPLE_BURST записей с одной строки кода за окно
+SAMPLE_WINDOW = 60
+SAMPLE_BURST = 20
+
+# Длинные сообщения (например, текст исключения с HTML-ответом) обрезаются
+MAX_MESSAGE_LENGTH = 2000
+
+_chat_id = contextvars.ContextVar('log_chat_id', default=None)
+_request_id = contextvars.ContextVar('log_request_id', default=None)
+_request_counter = itertools.count(1)
+
+_listener = None
+
+@contextlib.contextmanager
+def request_context(chat_id):
+    """Помечает записи логов внутри блока чатом и номером запроса"""
+    request_id = f"{next(_request_counter):x}"
+    chat_token = _chat_id.set(chat_id)
+    request_token = _request_id.set(request_id)
+    try:
+        yield request_id
+    finally:
+        _request_id.reset(request_token)
+        _chat_id.reset(chat_token)
+
+class ContextFilter(logging.Filter):
+    """Добавляет к записи chat_id и request_id (в потоке, где она создана)"""
+    
+    def filter(self, record):
+        record.chat_id = _chat_id.get()
+        record.request_id = _request_id.get()
+        record.context = f"[чат {record.chat_id} #{record.request_id}] " if record.chat_id is not None else ''
+        return True
+
+class SamplingFilter(logging.Filter):
+    """Прореживает повторяющиеся записи с одной строки кода"""
+    
+    def __init__(self, window=SAMPLE_WINDOW, burst=SAMPLE_BURST):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._sites = {}  # (файл, строка) -> [начало окна, записей в окне]
+    
+    def filter(self, record):
+        if record.levelno >= logging.ERROR:
+            return True
+        
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None or now - site[0] >= self.window:
+                dropped = site[1] - self.burst if site is not None and site[1] > self.burst else 0
+                self._sites[key] = [now, 1]
+                if len(self._sites) > 10000:
+                    self._sites = {key: self._sites[key]}
+            else:
+                site[1] += 1
+                if site[1] > self.burst:
+                    return False
+                dropped = 0
+        
+        if dropped:
+            record.msg = f"{record.msg} (и ещё {dropped} похожих за {self.window} с пропущено)"
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON"""
+    
+    def format(self, record):
+        data = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S') + f".{int(record.msecs):03d}",
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'msg': record.getMessage()
+        }
+        if getattr(record, 'chat_id', None) is not None:
+            data['chat_id'] = record.chat_id
+            data['request_id'] = record.request_id
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+class TruncatingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который обрезает слишком длинные сообщения"""
+    
+    def prepare(self, record):
+        record = super().prepare(record)
+        if len(record.msg) > MAX_MESSAGE_LENGTH:
+            record.msg = record.msg[:MAX_MESSAGE_LENGTH] + f"… (+{len(record.msg) - MAX_MESSAGE_LENGTH})"
+        return record
+
+def setup_logging(level=None, log_format=None, stream=None):
+    """Направляет корневой логгер в очередь и запускает поток вывода
+    
+    Уровень и формат по умолчанию берутся из LOG_LEVEL и LOG_FORMAT.
+    """
+    global _listener
+    level = level or os.getenv('LOG_LEVEL', 'INFO').upper()
+    log_format = (log_format or os.getenv('LOG_FORMAT', 'text')).lower()
+    
+    output = logging.StreamHandler(stream or sys.stderr)
+    if log_format == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter(TEXT_FORMAT, defaults={'context': ''}))
+    
+    log_queue = queue.SimpleQueue()  # без ограничения размера: put() не блокируется
+    queue_handler = TruncatingQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(SamplingFilter())
+    
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    
+    if _listener is not None:
+        _listener.stop()
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+def stop_logging():
+    """Дописывает оставшиеся в очереди записи (вызывается при выходе)"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def _restart_in_child():
+    """Поток вывода не переживает fork: дочерний процесс запускает свой"""
+    global _listener
+    if _listener is not None:
+        _listener = None
+        setup_logging()
+
+atexit.register(stop_logging)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_in_child)
@@ -0,0 +1,363 @@
+"""Скомпилированная таблица уроков в файле, открываемом через mmap
+
+Каждый процесс-обработчик (см. workers.py) строил свою LessonTable:
+столбцы, словари строк и списки строк по учителям, кабинетам, классам и
+дням — N процессов держали N копий. Здесь таблица один раз записывается в
+плоский двоичный файл рядом с CSV (school_schedule.csv.idx), а процессы
+открывают его через mmap: все они читают одни и те же страницы из кэша
+страниц ОС, и поиск по индексу ничего не копирует.
+
+Формат — массивы uint32 по смещениям из заголовка:
+
+    заголовок   сигнатура, версия формата, отпечаток CSV, (смещение, длина) секций
+    strings     смещения строк в blob (UTF-8) — общая таблица строк
+    rows        по строке таблицы: 6 кодов полей урока и номер позиции класса
+    positions   позиции классов: строка, столбец, класс, день (номера строк)
+    dict_*      словарь столбца: код -> номер строки, в порядке появления
+    post_*      списки строк по ключу: (ключ, начало, длина), ключи по возрастанию байтов UTF-8
+    pool        номера строк таблицы для всех списков
+
+Файл содержит отпечаток CSV, из которого собран: если CSV заменили,
+индекс пересобирается (один процесс под файловой блокировкой), а
+остальные просто открывают новый файл. Прежний mmap живёт, пока на него
+есть ссылки: os.replace не трогает уже открытые файлы.
+"""
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+import state_store
+from schedule_parser import (
+    Lesson, LessonTable, LESSON_FIELDS, FILTER_FIELDS
+)
+
+MAGIC = b'SCHIDX\x00' + (b'L' if sys.byteorder == 'little' else b'B')
+FORMAT_VERSION = 1
+
+SECTIONS = (
+    ('strings', 'blob', 'rows', 'positions')
+    + tuple(f"dict_{field}" for field in LESSON_FIELDS)
+    + tuple(f"post_{field}" for field in FILTER_FIELDS)
+    + ('pool',)
+)
+HEADER = struct.Struct('<8sIqq' + 'II' * len(SECTIONS))
+
+ROW_WIDTH = len(LESSON_FIELDS) + 1  # поля урока и номер позиции
+FIELD_OFFSETS = {field: offset for offset, field in enumerate(LESSON_FIELDS)}
+NONE = 0xFFFFFFFF  # нет строки (день позиции до первого заголовка)
+
+def index_path(csv_path):
+    return f"{csv_path}.idx"
+
+def source_stamp(csv_path):
+    """(время изменения в нс, размер) CSV или None"""
+    try:
+        stat = os.stat(csv_path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+# ====== ЗАПИСЬ ======
+
+def compile_index(table, path, stamp):
+    """Записывает LessonTable в файл path (атомарно)"""
+    strings = {}
+    
+    def string_id(value):
+        if value is None:
+            return NONE
+        sid = strings.get(value)
+        if sid is None:
+            sid = strings[value] = len(strings)
+        return sid
+    
+    sections = {}
+    
+    # Коды столбцов свои у каждого файла: общие словари (время, предметы,
+    # дни) содержат строки всех школ, а в файл попадают только строки этой
+    dictionaries = {field: {} for field in LESSON_FIELDS}
+    rows = array('I')
+    for row in range(len(table)):
+        for field in LESSON_FIELDS:
+            codes = dictionaries[field]
+            sid = string_id(table.value(field, row))
+            code = codes.get(sid)
+            if code is None:
+                code = codes[sid] = len(codes)
+            rows.append(code)
+        rows.append(table.position[row])
+    sections['rows'] = rows
+    for field in LESSON_FIELDS:
+        sections[f"dict_{field}"] = array('I', dictionaries[field])
+    
+    positions = array('I')
+    for position in table.positions:
+        positions.extend((
+            position['line_num'], position['col_num'],
+            string_id(position['class_name']), string_id(position.get('day'))
+        ))
+    sections['positions'] = positions
+    
+    pool = array('I')
+    for field in FILTER_FIELDS:
+        entries = array('I')
+        postings = table.postings[field]
+        for key in sorted(postings, key=lambda key: key.encode('utf-8')):
+            entries.extend((string_id(key), len(pool), len(postings[key])))
+            pool.extend(postings[key])
+        sections[f"post_{field}"] = entries
+    sections['pool'] = pool
+    
+    # Строки собираются последними: выше в таблицу попали и ключи списков
+    offsets = array('I', [0])
+    blob = bytearray()
+    for value in strings:
+        blob += value.encode('utf-8')
+        offsets.append(len(blob))
+    blob += b'\x00' * (-len(blob) % 4)
+    sections['strings'] = offsets
+    sections['blob'] = blob
+    
+    header_size = HEADER.size + (-HEADER.size % 4)
+    layout = []
+    chunks = []
+    position = header_size
+    for name in SECTIONS:
+        data = sections[name]
+        raw = data.tobytes() if isinstance(data, array) else bytes(data)
+        length = len(data) if isinstance(data, array) else len(raw)
+        layout += [position, length]
+        chunks.append(raw)
+        position += len(raw)
+    
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, stamp[0], stamp[1], *layout)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(header + b'\x00' * (header_size - HEADER.size))
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(temp_path, path)
+
+# ====== ЧТЕНИЕ ======
+
+class MappedDictionary:
+    """Значения столбца (как StringDictionary.values)"""
+    
+    __slots__ = ('_table', '_ids', '_values')
+    
+    def __init__(self, table, ids):
+        self._table = table
+        self._ids = ids
+        self._values = None
+    
+    @property
+    def values(self):
+        if self._values is None:
+            self._values = [self._table.string(sid) for sid in self._ids]
+        return self._values
+    
+    def __len__(self):
+        return len(self._ids)
+    
+    def value(self, code):
+        return self._table.string(self._ids[code])
+
+class MappedPostings:
+    """Списки строк по ключу: get(key) двоичным поиском по отсортированным ключам"""
+    
+    __slots__ = ('_table', '_entries', '_pool', '_keys', '_found')
+    
+    def __init__(self, table, entries, pool):
+        self._table = table
+        self._entries = entries
+        self._pool = pool
+        self._keys = None
+        self._found = {}  # ключ -> срез пула (только найденные ключи: их не больше, чем в файле)
+    
+    def __len__(self):
+        return len(self._entries) // 3
+    
+    def _key_bytes(self, number):
+        return self._table.string_bytes(self._entries[number * 3])
+    
+    def get(self, key, default=None):
+        rows = self._found.get(key)
+        if rows is not None:
+            return rows
+        
+        encoded = key.encode('utf-8')
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self._key_bytes(middle) < encoded:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self) and self._key_bytes(low) == encoded:
+            start, count = self._entries[low * 3 + 1], self._entries[low * 3 + 2]
+            rows = self._found[key] = self._pool[start:start + count]
+            return rows
+        # Промахи не запоминаются: ключи приходят из текста пользователя
+        return default
+    
+    def __getitem__(self, key):
+        rows = self.get(key)
+        if rows is None:
+            raise KeyError(key)
+        return rows
+    
+    def __contains__(self, key):
+        return self.get(key) is not None
+    
+    def __iter__(self):
+        if self._keys is None:
+            self._keys = [self._table.string(self._entries[number * 3]) for number in range(len(self))]
+        return iter(self._keys)
+
+class MappedPositions:
+    """Позиции классов как словари (как LessonTable.positions)"""
+    
+    __slots__ = ('_table', '_records')
+    
+    def __init__(self, table, records):
+        self._table = table
+        self._records = records
+    
+    def __len__(self):
+        return len(self._records) // 4
+    
+    def __getitem__(self, number):
+        if not 0 <= number < len(self):
+            raise IndexError(number)
+        line_num, col_num, class_name, day = self._records[number * 4:number * 4 + 4]
+        return {
+            'line_num': line_num, 'col_num': col_num,
+            'class_name': self._table.string(class_name), 'day': self._table.string(day)
+        }
+    
+    def __iter__(self):
+        return (self[number] for number in range(len(self)))
+
+class MappedLessonTable:
+    """LessonTable поверх mmap: те же columns, postings, positions, lessons, mask, select
+    
+    Строки декодируются при первом обращении и кэшируются в процессе;
+    записи Lesson для всей таблицы создаются, только если их просят целиком
+    (lessons), а select собирает только нужные строки.
+    """
+    
+    __slots__ = ('path', 'stamp', '_mmap', '_bytes', '_strings', '_string_offsets', '_blob',
+                 '_rows', 'columns', 'position', 'positions', 'dictionaries', '_field_dictionaries',
+                 'postings', '_lessons')
+    
+    rows = staticmethod(LessonTable.rows)
+    all_rows = LessonTable.all_rows
+    mask = LessonTable.mask
+    
+    def __init__(self, path, expected_stamp=None):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.path = path
+        self._bytes = memoryview(self._mmap)
+        if len(self._bytes) < HEADER.size:
+            raise ValueError(f"{path}: файл индекса обрезан")
+        
+        magic, version, mtime_ns, size, *layout = HEADER.unpack_from(self._bytes)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path}: другой формат индекса")
+        self.stamp = (mtime_ns, size)
+        if expected_stamp is not None and self.stamp != tuple(expected_stamp):
+            raise ValueError(f"{path}: индекс собран по другой версии файла")
+        
+        words = self._bytes.cast('I')
+        sections = {}
+        for number, name in enumerate(SECTIONS):
+            offset, length = layout[number * 2], layout[number * 2 + 1]
+            if name == 'blob':
+                sections[name] = self._bytes[offset:offset + length]
+            else:
+                sections[name] = words[offset // 4:offset // 4 + length]
+            if offset + (length if name == 'blob' else length * 4) > len(self._bytes):
+                raise ValueError(f"{path}: файл индекса обрезан")
+        
+        self._string_offsets = sections['strings']
+        self._blob = sections['blob']
+        self._strings = [None] * (len(self._string_offsets) - 1)
+        
+        self._rows = sections['rows']
+        self.columns = {field: self._rows[offset::ROW_WIDTH] for field, offset in FIELD_OFFSETS.items()}
+        self.position = self._rows[len(LESSON_FIELDS)::ROW_WIDTH]
+        self.positions = MappedPositions(self, sections['positions'])
+        self.dictionaries = {
+            field: MappedDictionary(self, sections[f"dict_{field}"]) for field in LESSON_FIELDS
+        }
+        self._field_dictionaries = [self.dictionaries[field] for field in LESSON_FIELDS]
+        self.postings = {
+            field: MappedPostings(self, sections[f"post_{field}"], sections['pool']) for field in FILTER_FIELDS
+        }
+        self._lessons = None
+    
+    def __len__(self):
+        return len(self.position)
+    
+    def string_bytes(self, sid):
+        return self._blob[self._string_offsets[sid]:self._string_offsets[sid + 1]].tobytes()
+    
+    def string(self, sid):
+        if sid == NONE:
+            return None
+        value = self._strings[sid]
+        if value is None:
+            value = self._strings[sid] = sys.intern(self.string_bytes(sid).decode('utf-8'))
+        return value
+    
+    def value(self, field, row):
+        return self.dictionaries[field].value(self._rows[row * ROW_WIDTH + FIELD_OFFSETS[field]])
+    
+    def lesson(self, row):
+        """Запись Lesson для одной строки"""
+        start = row * ROW_WIDTH
+        return Lesson(*(
+            dictionary.value(code)
+            for dictionary, code in zip(self._field_dictionaries, self._rows[start:start + len(LESSON_FIELDS)])
+        ))
+    
+    @property
+    def lessons(self):
+        if self._lessons is None:
+            self._lessons = [self.lesson(row) for row in range(len(self))]
+        return self._lessons
+    
+    def select(self, mask):
+        """Уроки по маске в порядке файла"""
+        if self._lessons is not None:
+            return [self._lessons[row] for row in self.rows(mask)]
+        return [self.lesson(row) for row in self.rows(mask)]
+
+def open_index(path, expected_stamp=None):
+    """MappedLessonTable или None, если файла нет, он устарел или повреждён"""
+    try:
+        return MappedLessonTable(path, expected_stamp)
+    except (OSError, ValueError, struct.error, TypeError):
+        return None
+
+def load_or_compile(csv_path, parse):
+    """Открывает индекс CSV, при необходимости собрав его (parse(csv_path) -> LessonTable)"""
+    stamp = source_stamp(csv_path)
+    if stamp is None:
+        return parse(csv_path)
+    
+    path = index_path(csv_path)
+    table = open_index(path, stamp)
+    if table is not None:
+        return table
+    
+    # Собирает один процесс, остальные ждут блокировку и открывают готовый файл
+    with state_store.file_lock(path):
+        table = open_index(path, stamp)
+        if table is None:
+            compile_index(parse(csv_path), path, stamp)
+            table = open_index(path, stamp)
+    return table
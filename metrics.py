@@ -0,0 +1,282 @@
+"""Метрики бота: гистограммы задержек и счётчики
+
+Задержки записываются в гистограммы с фиксированными границами (в мс)
+по виду операции (handler, parser, render, telegram) и имени. Перцентили
+p50/p95/p99 оцениваются по гистограмме так же, как histogram_quantile в
+Prometheus. Всё хранится в памяти процесса и отдаётся командой /metrics
+и HTTP-эндпоинтом в текстовом формате Prometheus.
+"""
+import bisect
+import functools
+import http.server
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограммы, мс
+BUCKETS_MS = (
+    0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100,
+    250, 500, 1000, 2500, 5000, 10000, 30000, 60000
+)
+
+METRIC_PREFIX = 'schedule_bot'
+
+_lock = threading.Lock()
+_histograms = {}  # (вид, имя) -> Histogram
+_counters = {}    # (счётчик, метка) -> значение
+_gauges = {}      # имя -> функция, возвращающая {метка: значение}
+_started_at = time.time()
+
+def _reset_in_child():
+    """Процесс-обработчик (см. workers.py) считает свои метрики с нуля"""
+    global _lock, _started_at
+    _lock = threading.Lock()
+    _histograms.clear()
+    _counters.clear()
+    _started_at = time.time()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_in_child)
+
+# ====== ГИСТОГРАММЫ ======
+
+class Histogram:
+    """Гистограмма задержек с фиксированными корзинами"""
+    
+    __slots__ = ('counts', 'count', 'sum')
+    
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.sum = 0.0
+    
+    def observe(self, value_ms):
+        self.counts[bisect.bisect_left(BUCKETS_MS, value_ms)] += 1
+        self.count += 1
+        self.sum += value_ms
+    
+    def quantile(self, q):
+        """Оценка перцентиля линейной интерполяцией внутри корзины"""
+        if not self.count:
+            return 0.0
+        
+        rank = q * self.count
+        cumulative = 0
+        for index, bucket_count in enumerate(self.counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                lower = BUCKETS_MS[index - 1] if index > 0 else 0.0
+                if index >= len(BUCKETS_MS):
+                    # Последняя корзина (+Inf): верхней границы нет
+                    return BUCKETS_MS[-1]
+                upper = BUCKETS_MS[index]
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        
+        return BUCKETS_MS[-1]
+
+def observe(kind, name, value_ms):
+    """Записывает длительность операции"""
+    key = (kind, name)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(value_ms)
+
+class timer:
+    """Контекстный менеджер для замера: with metrics.timer('parser', 'x'): ..."""
+    
+    __slots__ = ('kind', 'name', 'started')
+    
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+    
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        observe(self.kind, self.name, (time.perf_counter() - self.started) * 1000)
+        if exc_type is not None:
+            inc('errors', f"{self.kind}.{self.name}")
+        return False
+
+def timed(kind, name=None):
+    """Декоратор: замеряет каждый вызов функции"""
+    def decorator(func):
+        metric_name = name or func.__name__
+        
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                inc('errors', f"{kind}.{metric_name}")
+                raise
+            finally:
+                observe(kind, metric_name, (time.perf_counter() - started) * 1000)
+        
+        return wrapper
+    return decorator
+
+# ====== СЧЁТЧИКИ ======
+
+def inc(counter, label='', value=1):
+    """Увеличивает счётчик (например, inc('cache_hits', 'teacher_index'))"""
+    key = (counter, label)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def register_gauge(name, func):
+    """Регистрирует показатель, значение которого вычисляется при чтении метрик"""
+    _gauges[name] = func
+
+def get_counter(counter, label=''):
+    """Текущее значение счётчика"""
+    return _counters.get((counter, label), 0)
+
+def reset():
+    """Сбрасывает все метрики (для бенчмарков)"""
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+# ====== ВЫВОД ======
+
+def snapshot():
+    """Копия текущих метрик: перцентили по гистограммам и счётчики"""
+    with _lock:
+        histograms = {
+            key: {
+                'count': histogram.count,
+                'sum_ms': histogram.sum,
+                'p50_ms': histogram.quantile(0.50),
+                'p95_ms': histogram.quantile(0.95),
+                'p99_ms': histogram.quantile(0.99)
+            }
+            for key, histogram in _histograms.items()
+        }
+        counters = dict(_counters)
+    
+    return {'histograms': histograms, 'counters': counters, 'gauges': _read_gauges(),
+            'uptime_s': time.time() - _started_at}
+
+def _read_gauges():
+    """Значения зарегистрированных показателей"""
+    gauges = {}
+    for name, func in list(_gauges.items()):
+        try:
+            gauges[name] = func()
+        except Exception as e:
+            logger.debug(f"Ошибка чтения показателя {name}: {e}")
+    return gauges
+
+def format_report(kinds=None):
+    """Текстовый отчёт для команды /metrics"""
+    data = snapshot()
+    uptime_minutes = int(data['uptime_s'] // 60)
+    lines = [f"📈 Метрики (аптайм {uptime_minutes // 60} ч {uptime_minutes % 60} мин)", ""]
+    
+    by_kind = {}
+    for (kind, name), stats in data['histograms'].items():
+        by_kind.setdefault(kind, []).append((name, stats))
+    
+    for kind in sorted(by_kind):
+        if kinds and kind not in kinds:
+            continue
+        lines.append(f"[{kind}]  count  p50 / p95 / p99, мс")
+        for name, stats in sorted(by_kind[kind], key=lambda item: -item[1]['count']):
+            lines.append(
+                f"  {name}: {stats['count']}  "
+                f"{stats['p50_ms']:.1f} / {stats['p95_ms']:.1f} / {stats['p99_ms']:.1f}"
+            )
+        lines.append("")
+    
+    if data['counters']:
+        lines.append("[counters]")
+        for (counter, label), value in sorted(data['counters'].items()):
+            lines.append(f"  {counter}{'.' + label if label else ''}: {value}")
+        lines.append("")
+    
+    for name, values in sorted(data['gauges'].items()):
+        lines.append(f"[{name}]")
+        for label, value in sorted(values.items()):
+            lines.append(f"  {label}: {value:g}")
+        lines.append("")
+    
+    return '\n'.join(lines).strip()
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_prometheus():
+    """Метрики в текстовом формате Prometheus"""
+    with _lock:
+        histograms = {key: (list(h.counts), h.count, h.sum) for key, h in _histograms.items()}
+        counters = dict(_counters)
+    
+    metric = f"{METRIC_PREFIX}_latency_ms"
+    lines = [f"# HELP {metric} Latency of bot operations in milliseconds", f"# TYPE {metric} histogram"]
+    for (kind, name), (counts, count, total) in sorted(histograms.items()):
+        labels = f'kind="{_escape_label(kind)}",name="{_escape_label(name)}"'
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS_MS, counts):
+            cumulative += bucket_count
+            lines.append(f'{metric}_bucket{{{labels},le="{bound:g}"}} {cumulative}')
+        lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {count}')
+        lines.append(f'{metric}_sum{{{labels}}} {total:.6f}')
+        lines.append(f'{metric}_count{{{labels}}} {count}')
+    
+    counter_names = sorted({counter for counter, _ in counters})
+    for counter in counter_names:
+        name = f"{METRIC_PREFIX}_{counter}_total"
+        lines.append(f"# TYPE {name} counter")
+        for (other, label), value in sorted(counters.items()):
+            if other == counter:
+                lines.append(f'{name}{{name="{_escape_label(label)}"}} {value}')
+    
+    for gauge_name, values in sorted(_read_gauges().items()):
+        name = f"{METRIC_PREFIX}_{gauge_name}"
+        lines.append(f"# TYPE {name} gauge")
+        for label, value in sorted(values.items()):
+            lines.append(f'{name}{{name="{_escape_label(label)}"}} {value:g}')
+    
+    lines.append(f"# TYPE {METRIC_PREFIX}_uptime_seconds gauge")
+    lines.append(f"{METRIC_PREFIX}_uptime_seconds {time.time() - _started_at:.0f}")
+    return '\n'.join(lines) + '\n'
+
+# ====== HTTP-ЭНДПОИНТ ======
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """GET /metrics в формате Prometheus"""
+    
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = format_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
+
+def start_http_server(port, host='127.0.0.1'):
+    """Запускает эндпоинт метрик в фоновом потоке, возвращает сервер или None"""
+    try:
+        server = http.server.ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        logger.warning(f"⚠️ Не удалось запустить эндпоинт метрик на {host}:{port}: {e}")
+        return None
+    
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    logger.info(f"📈 Метрики Prometheus: http://{host}:{server.server_address[1]}/metrics")
+    return server
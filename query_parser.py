@@ -0,0 +1,266 @@
+"""Разбор запросов на естественном языке: "9а завтра", "Протасова среда", "каб 243 3 урок"
+
+Текст разбивается на токены одним регулярным выражением, а затем
+токены сопоставляются с автоматом — префиксным деревом по словарям
+расписания (классы, учителя, кабинеты) и дням недели. На каждой позиции
+берётся самое длинное совпадение, поэтому "1 группа 456" распознаётся как
+кабинет целиком, а "9 а" — как класс 9А. Автомат строится один раз на
+версию индекса и не перебирает уроки при каждом запросе.
+
+В ответ попадает только запрошенный срез — день или один урок, а не вся
+неделя.
+"""
+import datetime
+import re
+import threading
+
+import subscriptions
+from trie import Trie
+from schedule_parser import (
+    escape_markdown, normalize_name, split_by_slash, get_index, get_lesson_table,
+    get_day_slots, day_of_date, parse_time, parse_time_range, DAY_ORDER, DAY_ABBREVIATIONS, NOT_A_ROOM
+)
+
+# Время (9.20, 9:20), число или слово
+TOKEN_PATTERN = re.compile(r'\d{1,2}[.:]\d{2}|\d+|[^\W\d_]+')
+
+# Слова, которые уточняют вид следующей сущности
+KIND_MARKERS = {
+    'КАБ': 'room', 'КАБИНЕТ': 'room', 'КАБИНЕТА': 'room', 'КАБИНЕТЕ': 'room', 'АУД': 'room',
+    'КЛАСС': 'class', 'КЛАССА': 'class',
+    'УЧИТЕЛЬ': 'teacher', 'УЧИТЕЛЯ': 'teacher', 'УЧИТЕЛЬНИЦА': 'teacher'
+}
+
+RELATIVE_DAYS = {'ВЧЕРА': -1, 'СЕГОДНЯ': 0, 'ЗАВТРА': 1, 'ПОСЛЕЗАВТРА': 2}
+
+# Воскресенья нет в расписании: на него отвечаем, что уроков нет
+SUNDAY = 'ВОСКРЕСЕНЬЕ'
+
+PERIOD_WORDS = {'УРОК', 'УРОКА', 'УРОКЕ', 'ПАРА', 'ПАРЕ'}
+ORDINAL_SUFFIXES = {'Й', 'ИЙ', 'ЫЙ', 'ОЙ'}
+
+def tokenize(text):
+    """'9а завтра' -> ['9', 'А', 'ЗАВТРА']"""
+    return TOKEN_PATTERN.findall((text or '').upper().replace('Ё', 'Е'))
+
+def _day_forms(day):
+    """Формы дня недели: 'СРЕДА', 'СРЕДУ', 'СРЕ', 'СРЕД'…"""
+    forms = {day}
+    if day.endswith('А'):
+        forms.add(day[:-1] + 'У')  # в среду, в пятницу, в субботу
+    forms.update(day[:length] for length in range(3, len(day)))
+    return forms
+
+def build_automaton(table):
+    """Автомат по словарям таблицы уроков: токены -> [(вид, ключ, название)]"""
+    automaton = Trie()
+    
+    for day in DAY_ORDER:
+        for form in _day_forms(day):
+            automaton.insert((form,), ('day', day, day))
+    for short, day in DAY_ABBREVIATIONS.items():
+        automaton.insert((short,), ('day', day, day))
+    for form in _day_forms(SUNDAY) | {'ВС'}:
+        automaton.insert((form,), ('day', SUNDAY, SUNDAY))
+    for word, offset in RELATIVE_DAYS.items():
+        automaton.insert((word,), ('relative_day', offset, word.lower()))
+    
+    for kind, field in subscriptions.KIND_FIELDS.items():
+        for value in table.dictionaries[field].values:
+            parts = [value] if kind == 'class' else split_by_slash(value)
+            for part in parts:
+                if part.upper() in NOT_A_ROOM:
+                    continue
+                tokens = tokenize(part)
+                if not tokens:
+                    continue
+                entity = (kind, normalize_name(part), part)
+                automaton.insert(tokens, entity)
+                if kind == 'teacher' and len(tokens) > 1:
+                    # "Иванова" находит "Иванова И.А."
+                    automaton.insert(tokens[:1], entity)
+    
+    return automaton
+
+_automata = {}  # источник -> (версия индекса, автомат)
+_automata_lock = threading.Lock()
+
+def get_automaton():
+    """Автомат текущего источника (перестраивается после обновления расписания)"""
+    index = get_index()
+    cached = _automata.get(index.name)
+    if cached is not None and cached[0] == index.version:
+        return cached[1]
+    
+    with _automata_lock:
+        cached = _automata.get(index.name)
+        if cached is None or cached[0] != index.version:
+            version = index.version
+            cached = _automata[index.name] = (version, build_automaton(get_lesson_table()))
+    return cached[1]
+
+def _match_period(tokens, position):
+    """Номер урока или время с позиции: ('3 урок', 'урок 3', '3-й урок', '9.20')
+    
+    Возвращает (число токенов, номер урока или время строкой) или (0, None).
+    """
+    token = tokens[position]
+    if ':' in token or '.' in token:
+        return 1, token.replace(':', '.')
+    
+    if token.isdigit():
+        next_position = position + 1
+        if next_position < len(tokens) and tokens[next_position] in ORDINAL_SUFFIXES:
+            next_position += 1
+        if next_position < len(tokens) and tokens[next_position] in PERIOD_WORDS:
+            return next_position - position + 1, int(token)
+    
+    if token in PERIOD_WORDS and position + 1 < len(tokens) and tokens[position + 1].isdigit():
+        return 2, int(tokens[position + 1])
+    
+    return 0, None
+
+def parse_query(text, today=None):
+    """Разбирает запрос
+    
+    Возвращает словарь с ключами kind, key, name (сущность), day (день
+    как в расписании или None), day_label ('завтра'), period (номер урока,
+    время 'Ч.ММ' или None) и weekend (запрошено воскресенье). None, если
+    в запросе нет ни класса, ни учителя, ни кабинета.
+    """
+    tokens = tokenize(text)
+    if not tokens:
+        return None
+    
+    automaton = get_automaton()
+    today = today or datetime.date.today()
+    query = {'kind': None, 'key': None, 'name': None, 'day': None, 'day_label': None,
+             'period': None, 'weekend': False}
+    wanted_kind = None
+    
+    position = 0
+    while position < len(tokens):
+        length, period = _match_period(tokens, position)
+        if length and query['period'] is None:
+            query['period'] = period
+            position += length
+            continue
+        
+        token = tokens[position]
+        if token in KIND_MARKERS:
+            wanted_kind = KIND_MARKERS[token]
+            position += 1
+            continue
+        
+        length, values = automaton.longest_match(tokens, position)
+        if not length:
+            position += 1
+            continue
+        position += length
+        
+        kind, key, name = values[0]
+        if kind == 'relative_day':
+            query['day_label'] = name
+            query['day'] = day_of_date(today + datetime.timedelta(days=key))
+            query['weekend'] = query['day'] is None
+        elif kind == 'day':
+            query['weekend'] = key == SUNDAY
+            query['day'] = None if query['weekend'] else key
+        elif query['kind'] is None:
+            # Вид указан явно ("кабинет 5") — берём совпадение этого вида
+            candidates = [value for value in values if value[0] not in ('day', 'relative_day')]
+            if wanted_kind:
+                candidates = [value for value in candidates if value[0] == wanted_kind] or candidates
+            query['kind'], query['key'], query['name'] = candidates[0]
+    
+    if query['kind'] is None:
+        return None
+    return query
+
+def is_narrow(query):
+    """Запрошен ли срез (день или урок), а не вся неделя"""
+    return bool(query and (query['day'] or query['period'] is not None or query['weekend']))
+
+def _lesson_sort_key(lesson):
+    day = lesson[0]
+    return (DAY_ORDER.index(day) if day in DAY_ORDER else 999, parse_time(lesson[1]), lesson[5])
+
+def select_lessons(query):
+    """Уроки среза: список (день, время, предмет, учитель, кабинет, класс) по времени"""
+    lessons = subscriptions.entity_lessons(get_lesson_table(), query['kind'], query['key'])
+    if query['day']:
+        lessons = [lesson for lesson in lessons if lesson[0] == query['day']]
+    lessons = sorted(lessons, key=_lesson_sort_key)
+    
+    period = query['period']
+    if period is None:
+        return lessons
+    
+    selected = []
+    for day in ([query['day']] if query['day'] else DAY_ORDER):
+        day_lessons = [lesson for lesson in lessons if lesson[0] == day]
+        if isinstance(period, int):
+            if query['kind'] == 'class':
+                # У класса номер урока считается в его смене
+                times = sorted({lesson[1] for lesson in day_lessons}, key=parse_time)
+                slot_time = times[period - 1] if 0 < period <= len(times) else None
+            else:
+                # У учителя и кабинета — как в /free: по всем урокам дня
+                _, slots = get_day_slots(day)
+                slot_time = slots[period - 1] if 0 < period <= len(slots) else None
+            if slot_time is None:
+                continue
+            start, end = parse_time_range(slot_time)
+        else:
+            start = parse_time(period)
+            end = start + 1
+        
+        selected += [
+            lesson for lesson in day_lessons
+            if parse_time_range(lesson[1])[0] < end and start < parse_time_range(lesson[1])[1]
+        ]
+    return selected
+
+def _describe(query):
+    title = f"{subscriptions.KIND_TITLES[query['kind']]} {query['name']}"
+    when = []
+    if query['day_label']:
+        when.append(query['day_label'])
+    elif query['weekend']:
+        when.append(SUNDAY.lower())
+    if query['day']:
+        when.append(query['day'].lower())
+    if isinstance(query['period'], int):
+        when.append(f"{query['period']} урок")
+    elif query['period']:
+        when.append(f"в {query['period']}")
+    return title, ', '.join(when)
+
+def format_slice(query, lessons):
+    """Короткий ответ со срезом расписания (MarkdownV2)"""
+    title, when = _describe(query)
+    header = f"📅 *{escape_markdown(title)}*"
+    if when:
+        header += f" — {escape_markdown(when)}"
+    
+    if query['weekend']:
+        return f"{header}\n\n😴 Выходной, уроков нет\\."
+    if not lessons:
+        return f"{header}\n\nУроков нет\\."
+    
+    kind = query['kind']
+    lines = []
+    for day, time_str, subject, teacher, classroom, class_name in lessons:
+        details = [subject]
+        if kind != 'class' and class_name:
+            details.append(class_name)
+        if kind != 'teacher' and teacher:
+            details.append(teacher)
+        if kind != 'room' and classroom and classroom.upper() not in NOT_A_ROOM:
+            details.append(f"каб. {classroom}")
+        prefix = '' if query['day'] else f"{day.capitalize()} "
+        lines.append(
+            f"`{escape_markdown(prefix + time_str.replace('–', '-'))}` "
+            f"{escape_markdown(', '.join(item for item in details if item))}"
+        )
+    return f"{header}\n\n" + '\n'.join(lines)
@@ -0,0 +1,170 @@
+import logging
+import time
+
+from schedule_parser import (
+    escape_markdown, split_by_slash, normalize_name, parse_time,
+    get_all_lessons, get_classroom_for_teacher, current_source, DAY_ORDER, NOT_A_ROOM
+)
+
+logger = logging.getLogger(__name__)
+
+# Сколько конфликтов каждого типа показывать в одном сообщении
+MAX_REPORT_ITEMS = 25
+
+_last_reports = {}  # источник расписания -> последний отчёт
+
+# ====== ТАБЛИЦА УРОКОВ ======
+
+def build_lesson_frame(lessons):
+    """Строит таблицу pandas: одна строка на пару (урок, учитель)"""
+    import pandas as pd
+    
+    columns = {
+        'lesson_id': [], 'day': [], 'time': [], 'class_name': [],
+        'subject': [], 'teacher': [], 'room': []
+    }
+    
+    for lesson_id, lesson in enumerate(lessons):
+        teacher_parts = split_by_slash(lesson['teacher']) or ['']
+        for teacher_index, teacher in enumerate(teacher_parts):
+            room = get_classroom_for_teacher(lesson['classroom'], teacher_index, len(teacher_parts))
+            if room.upper() in NOT_A_ROOM:
+                room = ''
+            
+            columns['lesson_id'].append(lesson_id)
+            columns['day'].append(lesson['day'])
+            columns['time'].append(lesson['time'])
+            columns['class_name'].append(lesson['class_name'])
+            columns['subject'].append(lesson['subject'])
+            columns['teacher'].append(teacher)
+            columns['room'].append(room)
+    
+    frame = pd.DataFrame(columns)
+    
+    # Ключи для группировки: без пробелов и в верхнем регистре, пустые -> NaN,
+    # чтобы урок без кабинета не попадал в группу "кабинет ''". Для подсчёта
+    # разных значений пустое — своё у каждого урока: урок без кабинета
+    # не считается объединённым с уроком в кабинете
+    missing = '?' + frame['lesson_id'].astype(str)
+    for column in ('teacher', 'room'):
+        keys = frame[column].str.upper().str.replace(r'\s+', '', regex=True)
+        frame[f'{column}_key'] = keys.mask(keys == '')
+        frame[f'{column}_other'] = keys.mask(keys == '', missing)
+    
+    return frame
+
+# ====== ПОИСК КОНФЛИКТОВ ======
+
+def _find_double_bookings(frame, key_column, other_column):
+    """Находит группы (день, время, ключ), где ключ встречается в нескольких
+    уроках с разными значениями other_column"""
+    rows = frame[frame[key_column].notna()]
+    
+    counts = rows.groupby(['day', 'time', key_column]).agg(
+        lessons=('lesson_id', 'nunique'),
+        others=(f'{other_column}_other', 'nunique')
+    )
+    conflict_keys = counts[(counts['lessons'] > 1) & (counts['others'] > 1)].index
+    if len(conflict_keys) == 0:
+        return []
+    
+    conflict_rows = rows.merge(conflict_keys.to_frame(index=False), on=['day', 'time', key_column])
+    
+    conflicts = []
+    for (day, time_str, _), group in conflict_rows.groupby(['day', 'time', key_column], sort=False):
+        display_column = 'teacher' if key_column == 'teacher_key' else 'room'
+        conflicts.append({
+            'day': day,
+            'time': time_str,
+            'name': group[display_column].iloc[0],
+            'entries': list(zip(group['class_name'], group[other_column]))
+        })
+    
+    conflicts.sort(key=lambda c: (
+        DAY_ORDER.index(c['day']) if c['day'] in DAY_ORDER else 999,
+        parse_time(c['time']),
+        normalize_name(c['name'])
+    ))
+    return conflicts
+
+def find_conflicts(lessons=None):
+    """Ищет учителей и кабинеты, занятые в двух местах одновременно
+    
+    Учитель в конфликте, если в одно время у него несколько уроков в разных
+    кабинетах. Кабинет в конфликте, если в одно время в нём несколько уроков
+    у разных учителей. Объединённые уроки (один учитель, один кабинет,
+    несколько классов) конфликтом не считаются; урок без кабинета
+    объединённым не считается ни с каким другим.
+    """
+    if lessons is None:
+        lessons = get_all_lessons()
+    
+    started = time.perf_counter()
+    frame = build_lesson_frame(lessons)
+    
+    report = {
+        'teachers': _find_double_bookings(frame, 'teacher_key', 'room'),
+        'rooms': _find_double_bookings(frame, 'room_key', 'teacher'),
+        'lessons': len(lessons),
+        'elapsed_ms': (time.perf_counter() - started) * 1000,
+        'checked_at': time.time()
+    }
+    return report
+
+def check_schedule():
+    """Проверяет текущее расписание и запоминает отчёт"""
+    report = _last_reports[current_source()] = find_conflicts()
+    
+    logger.info(
+        f"🔎 Проверка расписания {current_source()}: {len(report['teachers'])} конфликтов учителей, "
+        f"{len(report['rooms'])} конфликтов кабинетов "
+        f"({report['elapsed_ms']:.1f} мс)"
+    )
+    return report
+
+def get_last_report():
+    """Последний отчёт о конфликтах (проверяет расписание, если отчёта нет)"""
+    report = _last_reports.get(current_source())
+    if report is None:
+        return check_schedule()
+    return report
+
+# ====== ФОРМАТИРОВАНИЕ ======
+
+def _format_section(title, conflicts, entry_label):
+    """Форматирует один раздел отчёта"""
+    result = f"*{title} \\({len(conflicts)}\\):*\n"
+    label = f"{entry_label} " if entry_label else ""
+    
+    for conflict in conflicts[:MAX_REPORT_ITEMS]:
+        day = escape_markdown(conflict['day'])
+        time_display = escape_markdown(conflict['time'].replace('–', '-'))
+        name = escape_markdown(conflict['name'])
+        entries = ', '.join(
+            f"{escape_markdown(class_name)}"
+            + (f" \\({label}{escape_markdown(other)}\\)" if other else "")
+            for class_name, other in conflict['entries']
+        )
+        result += f"• {day} `{time_display}` *{name}*: {entries}\n"
+    
+    if len(conflicts) > MAX_REPORT_ITEMS:
+        result += f"_\\.\\.\\. и ещё {len(conflicts) - MAX_REPORT_ITEMS}_\n"
+    
+    return result + "\n"
+
+def format_conflicts_report(report):
+    """Форматирует отчёт о конфликтах для вывода"""
+    checked_at = escape_markdown(time.strftime('%d.%m.%Y %H:%M', time.localtime(report['checked_at'])))
+    elapsed = escape_markdown(f"{report['elapsed_ms']:.1f}")
+    footer = f"🕒 Проверено {checked_at}, уроков: {report['lessons']}, {elapsed} мс"
+    
+    if not report['teachers'] and not report['rooms']:
+        return f"✅ *Конфликтов в расписании не найдено\\.*\n\n{footer}"
+    
+    result = "⚠️ *Конфликты в расписании:*\n\n"
+    if report['teachers']:
+        result += _format_section("👨‍🏫 Учитель в двух местах одновременно", report['teachers'], "каб\\.")
+    if report['rooms']:
+        result += _format_section("🏫 Кабинет занят дважды", report['rooms'], "")
+    
+    return result + footer
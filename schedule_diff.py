@@ -0,0 +1,210 @@
+"""Что изменилось в расписании между двумя версиями
+
+Уроки обеих таблиц раскладываются по ключу (день, класс, время урока) в
+словари, и версии сравниваются соединением по ключу (hash join) — один
+проход по каждой таблице вместо сравнения каждого урока с каждым.
+
+Виды изменений:
+    added    — урок появился
+    removed  — урок убрали
+    teacher  — в том же месте тот же предмет ведёт другой учитель
+    moved    — тот же урок (класс, предмет, учитель) перенесли на другое
+               время, день или в другой кабинет
+
+Перенос ищется вторым соединением: оставшиеся удалённые и добавленные
+уроки сопоставляются по (класс, предмет, учитель).
+"""
+import collections
+import threading
+
+from schedule_parser import escape_markdown, normalize_name, split_by_slash, parse_time, DAY_ORDER
+from subscriptions import DAY_SHORT, KIND_TITLES
+
+MAX_CHANGES_IN_MESSAGE = 15
+
+# Урок в том же виде, что subscriptions.entity_lessons:
+# (день, время, предмет, учитель, кабинет, класс)
+Change = collections.namedtuple('Change', ['kind', 'old', 'new'])
+
+CHANGE_MARKS = {'added': '➕', 'removed': '➖', 'teacher': '👤', 'moved': '🔀'}
+
+def _slots(table):
+    """(день, класс, время) -> [урок] по всей таблице"""
+    slots = {}
+    if table is None:
+        return slots
+    for lesson in table.lessons:
+        key = (lesson.day, normalize_name(lesson.class_name), lesson.time)
+        slots.setdefault(key, []).append(
+            (lesson.day, lesson.time, lesson.subject, lesson.teacher, lesson.classroom, lesson.class_name)
+        )
+    return slots
+
+def _lesson_sort_key(lesson):
+    day = lesson[0]
+    return (DAY_ORDER.index(day) if day in DAY_ORDER else 999, parse_time(lesson[1]), lesson[5])
+
+def diff_tables(old_table, new_table):
+    """Список Change между двумя таблицами уроков (по дням и времени)"""
+    old_slots = _slots(old_table)
+    new_slots = _slots(new_table)
+    changes = []
+    removed = []
+    added = []
+    
+    for key, old_lessons in old_slots.items():
+        new_lessons = new_slots.get(key)
+        if new_lessons is None:
+            removed.extend(old_lessons)
+            continue
+        if old_lessons == new_lessons:
+            continue
+        
+        # Одинаковые уроки (например, у второй группы) не считаются изменением
+        unmatched_new = list(new_lessons)
+        unmatched_old = []
+        for lesson in old_lessons:
+            if lesson in unmatched_new:
+                unmatched_new.remove(lesson)
+            else:
+                unmatched_old.append(lesson)
+        
+        # Тот же предмет в том же месте — сменился учитель
+        for lesson in unmatched_old:
+            replacement = next(
+                (new for new in unmatched_new if new[2] == lesson[2] and new[3] != lesson[3]), None
+            )
+            if replacement is None:
+                removed.append(lesson)
+            else:
+                unmatched_new.remove(replacement)
+                changes.append(Change('teacher', lesson, replacement))
+        added.extend(unmatched_new)
+    
+    for key, new_lessons in new_slots.items():
+        if key not in old_slots:
+            added.extend(new_lessons)
+    
+    # Перенос: тот же класс, предмет и учитель в другом месте или кабинете
+    added_by_signature = {}
+    for lesson in added:
+        added_by_signature.setdefault((normalize_name(lesson[5]), lesson[2], lesson[3]), []).append(lesson)
+    for lesson in removed:
+        candidates = added_by_signature.get((normalize_name(lesson[5]), lesson[2], lesson[3]))
+        if candidates:
+            changes.append(Change('moved', lesson, candidates.pop(0)))
+        else:
+            changes.append(Change('removed', lesson, None))
+    for candidates in added_by_signature.values():
+        changes.extend(Change('added', None, lesson) for lesson in candidates)
+    
+    changes.sort(key=lambda change: _lesson_sort_key(change.old or change.new))
+    return changes
+
+def _matches(lesson, kind, key):
+    if lesson is None:
+        return False
+    if kind == 'class':
+        return normalize_name(lesson[5]) == key
+    value = lesson[3] if kind == 'teacher' else lesson[4]
+    return any(normalize_name(part) == key for part in split_by_slash(value))
+
+def filter_changes(changes, kind, key):
+    """Изменения, которые касаются класса, учителя или кабинета key (нормализованного)"""
+    return [change for change in changes if _matches(change.old, kind, key) or _matches(change.new, kind, key)]
+
+def count_changes(changes):
+    """{вид изменения: количество}"""
+    return dict(collections.Counter(change.kind for change in changes))
+
+# ====== ФОРМАТИРОВАНИЕ ======
+
+def _when(lesson):
+    return f"{DAY_SHORT.get(lesson[0], lesson[0])} {lesson[1].replace('–', '-')}"
+
+def _describe_lesson(kind, lesson):
+    details = [lesson[2]]
+    if kind != 'class' and lesson[5]:
+        details.append(lesson[5])
+    if kind != 'teacher' and lesson[3]:
+        details.append(lesson[3])
+    if kind != 'room' and lesson[4]:
+        details.append(f"каб. {lesson[4]}")
+    return ', '.join(item for item in details if item)
+
+def format_change(kind, change):
+    """Одна строка изменения (MarkdownV2)"""
+    mark = CHANGE_MARKS[change.kind]
+    old, new = change.old, change.new
+    if change.kind == 'added':
+        return f"{mark} {escape_markdown(_when(new))} {escape_markdown(_describe_lesson(kind, new))}"
+    if change.kind == 'removed':
+        return f"{mark} ~{escape_markdown(_when(old))} {escape_markdown(_describe_lesson(kind, old))}~"
+    if change.kind == 'teacher':
+        text = f"{_when(old)} {old[2]} ({old[5]}): {old[3]} → {new[3]}"
+        return f"{mark} {escape_markdown(text)}"
+    
+    # Перенос: показываем только то, что поменялось
+    before, after = [], []
+    if (old[0], old[1]) != (new[0], new[1]):
+        before.append(_when(old))
+        after.append(_when(new))
+    if old[4] != new[4]:
+        before.append(f"каб. {old[4] or '—'}")
+        after.append(f"каб. {new[4] or '—'}")
+    text = f"{old[2]} ({old[5]}): {', '.join(before)} → {', '.join(after)}"
+    return f"{mark} {escape_markdown(text)}"
+
+def format_changes_summary(kind, name, changes, title_note=None):
+    """Сводка изменений сущности (MarkdownV2)"""
+    title = f"{KIND_TITLES[kind]} {name}"
+    result = f"🔁 *Что изменилось: {escape_markdown(title)}*\n"
+    if title_note:
+        result += f"_{escape_markdown(title_note)}_\n"
+    result += "\n"
+    
+    if not changes:
+        return result + "✅ Изменений нет\\."
+    
+    for change in changes[:MAX_CHANGES_IN_MESSAGE]:
+        result += format_change(kind, change) + "\n"
+    if len(changes) > MAX_CHANGES_IN_MESSAGE:
+        result += f"_\\.\\.\\. и ещё {len(changes) - MAX_CHANGES_IN_MESSAGE}_\n"
+    return result
+
+def format_totals(changes, title_note=None):
+    """Общая сводка по всей школе: сколько изменений и у каких классов (MarkdownV2)"""
+    result = "🔁 *Что изменилось в расписании*\n"
+    if title_note:
+        result += f"_{escape_markdown(title_note)}_\n"
+    result += "\n"
+    if not changes:
+        return result + "✅ Изменений нет\\."
+    
+    counts = count_changes(changes)
+    labels = {'added': 'добавлено', 'removed': 'убрано', 'teacher': 'замена учителя', 'moved': 'перенесено'}
+    for change_kind, label in labels.items():
+        if counts.get(change_kind):
+            result += f"{CHANGE_MARKS[change_kind]} {label}: {counts[change_kind]}\n"
+    
+    classes = sorted({(change.old or change.new)[5] for change in changes})
+    result += f"\n📋 Классы: {escape_markdown(', '.join(classes))}\n"
+    result += "\n✏️ Подробно: /changes 5А, /changes учитель Иванов"
+    return result
+
+# ====== КЭШ ======
+
+_diffs = {}  # (источник, старая версия, новая версия) -> [Change]
+_diffs_lock = threading.Lock()
+
+def cached_diff(key, old_table_func, new_table_func):
+    """Изменения между версиями по ключу; таблицы строятся только при промахе"""
+    with _diffs_lock:
+        changes = _diffs.get(key)
+    if changes is None:
+        changes = diff_tables(old_table_func(), new_table_func())
+        with _diffs_lock:
+            if len(_diffs) >= 16:
+                _diffs.clear()
+            _diffs[key] = changes
+    return changes
@@ -0,0 +1,328 @@
+"""Расписание на неделю картинкой (PNG)
+
+Длинное расписание в MarkdownV2 неудобно читать с телефона, поэтому
+неделю класса, учителя или кабинета можно получить таблицей: столбцы —
+дни, строки — время уроков. Рисование локальное, через Pillow, без
+внешних сервисов. Pillow — необязательная зависимость (pip install
+Pillow): без неё команда /image просто сообщает, что картинки недоступны.
+
+Картинки рисуются лениво и кэшируются по (источник, вид, ключ, версия,
+тема), где версия — хеш уроков сущности (см. calendar_export). Кэш
+двухуровневый: последние картинки в памяти, остальные — файлы в
+IMAGE_CACHE_DIR (не больше MAX_DISK_IMAGES, давно не нужные удаляются:
+после обновления расписания старые версии уже не запросят). После первой загрузки в Telegram сохраняется file_id,
+и повторный запрос стоит одного вызова API. Рисование и загрузка идут в
+пуле потоков, обработчики сообщений их не ждут.
+"""
+import concurrent.futures
+import contextlib
+import hashlib
+import importlib.util
+import io
+import logging
+import os
+import threading
+
+import metrics
+from schedule_parser import parse_time, DAY_ORDER, DAY_ABBREVIATIONS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = 'image_cache'
+
+# Сколько картинок держать в памяти и на диске
+MAX_MEMORY_IMAGES = 64
+MAX_DISK_IMAGES = 2000
+
+# Потоков для рисования и загрузки
+RENDER_WORKERS = 2
+
+# Шрифты с кириллицей, первый найденный используется
+FONT_PATHS = [
+    os.getenv('SCHEDULE_FONT', ''),
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+    '/usr/share/fonts/dejavu/DejaVuSans.ttf',
+    '/Library/Fonts/Arial Unicode.ttf',
+    'C:\\Windows\\Fonts\\arial.ttf'
+]
+
+THEMES = {
+    'light': {
+        'background': (255, 255, 255), 'header': (52, 101, 164), 'header_text': (255, 255, 255),
+        'grid': (210, 215, 222), 'text': (30, 30, 30), 'muted': (110, 116, 125), 'stripe': (244, 247, 251)
+    },
+    'dark': {
+        'background': (30, 33, 39), 'header': (61, 90, 128), 'header_text': (240, 240, 240),
+        'grid': (62, 68, 78), 'text': (230, 232, 235), 'muted': (150, 156, 165), 'stripe': (37, 41, 48)
+    }
+}
+THEME_ALIASES = {'светлая': 'light', 'light': 'light', 'тёмная': 'dark', 'темная': 'dark', 'dark': 'dark'}
+
+DAY_SHORT = {day: short.capitalize() for short, day in DAY_ABBREVIATIONS.items()}
+
+TITLE_SIZE = 26
+TEXT_SIZE = 18
+SMALL_SIZE = 15
+PADDING = 10
+TIME_COLUMN_WIDTH = 110
+DAY_COLUMN_WIDTH = 230
+
+def is_available():
+    """Установлен ли Pillow"""
+    return importlib.util.find_spec('PIL') is not None
+
+_fonts = {}
+
+def _font(size):
+    """Шрифт нужного размера (загружается один раз)"""
+    font = _fonts.get(size)
+    if font is None:
+        from PIL import ImageFont
+        for path in FONT_PATHS:
+            if path and os.path.exists(path):
+                font = ImageFont.truetype(path, size)
+                break
+        else:
+            logger.warning("⚠️ Шрифт с кириллицей не найден, задайте SCHEDULE_FONT")
+            font = ImageFont.load_default()
+        _fonts[size] = font
+    return font
+
+def _wrap(draw, text, font, width):
+    """Разбивает текст на строки, которые помещаются в width"""
+    lines = []
+    current = ''
+    for word in text.split():
+        candidate = f"{current} {word}".strip()
+        if current and draw.textlength(candidate, font=font) > width:
+            lines.append(current)
+            current = word
+        else:
+            current = candidate
+    if current:
+        lines.append(current)
+    return lines
+
+def _cell_lines(kind, lessons):
+    """Строки ячейки: (текст, основной ли шрифт)"""
+    lines = []
+    for _, _, subject, teacher, classroom, class_name in sorted(lessons):
+        lines.append((subject or '—', True))
+        details = []
+        if kind != 'class' and class_name:
+            details.append(class_name)
+        if kind != 'teacher' and teacher:
+            details.append(teacher)
+        if kind != 'room' and classroom:
+            details.append(f"каб. {classroom}")
+        if details:
+            lines.append((', '.join(details), False))
+    return lines
+
+@metrics.timed('render')
+def render_week(kind, title, lessons, theme='light'):
+    """PNG с неделей: уроки (день, время, предмет, учитель, кабинет, класс)"""
+    from PIL import Image, ImageDraw
+    
+    colors = THEMES[theme]
+    title_font, text_font, small_font = _font(TITLE_SIZE), _font(TEXT_SIZE), _font(SMALL_SIZE)
+    
+    days = [day for day in DAY_ORDER if any(lesson[0] == day for lesson in lessons)]
+    times = sorted({lesson[1] for lesson in lessons}, key=parse_time)
+    cells = {}
+    for lesson in lessons:
+        cells.setdefault((lesson[1], lesson[0]), []).append(lesson)
+    
+    # Раскладываем текст по ячейкам, чтобы узнать высоту строк таблицы
+    measure = ImageDraw.Draw(Image.new('RGB', (1, 1)))
+    text_width = DAY_COLUMN_WIDTH - 2 * PADDING
+    layout = {}
+    row_heights = []
+    for time_str in times:
+        height = TEXT_SIZE + 2 * PADDING
+        for day in days:
+            wrapped = []
+            for text, main in _cell_lines(kind, cells.get((time_str, day), ())):
+                font = text_font if main else small_font
+                wrapped += [(line, font, main) for line in _wrap(measure, text, font, text_width)]
+            layout[(time_str, day)] = wrapped
+            cell_height = sum((TEXT_SIZE if main else SMALL_SIZE) + 4 for _, _, main in wrapped)
+            height = max(height, cell_height + 2 * PADDING)
+        row_heights.append(height)
+    
+    header_height = TEXT_SIZE + 2 * PADDING
+    title_height = TITLE_SIZE + 3 * PADDING
+    width = TIME_COLUMN_WIDTH + DAY_COLUMN_WIDTH * max(1, len(days))
+    height = title_height + header_height + sum(row_heights) + PADDING
+    
+    image = Image.new('RGB', (width, height), colors['background'])
+    draw = ImageDraw.Draw(image)
+    draw.text((PADDING, PADDING), title, font=title_font, fill=colors['text'])
+    
+    # Шапка с днями
+    top = title_height
+    draw.rectangle([0, top, width, top + header_height], fill=colors['header'])
+    for index, day in enumerate(days):
+        left = TIME_COLUMN_WIDTH + index * DAY_COLUMN_WIDTH
+        draw.text((left + PADDING, top + PADDING), DAY_SHORT.get(day, day), font=text_font, fill=colors['header_text'])
+    
+    # Строки с уроками
+    top += header_height
+    for row, (time_str, row_height) in enumerate(zip(times, row_heights)):
+        if row % 2:
+            draw.rectangle([0, top, width, top + row_height], fill=colors['stripe'])
+        draw.text((PADDING, top + PADDING), time_str.replace('–', '-'), font=small_font, fill=colors['muted'])
+        
+        for index, day in enumerate(days):
+            left = TIME_COLUMN_WIDTH + index * DAY_COLUMN_WIDTH
+            y = top + PADDING
+            for line, font, main in layout[(time_str, day)]:
+                draw.text((left + PADDING, y), line, font=font, fill=colors['text'] if main else colors['muted'])
+                y += (TEXT_SIZE if main else SMALL_SIZE) + 4
+        
+        top += row_height
+        draw.line([0, top, width, top], fill=colors['grid'])
+    
+    for index in range(len(days) + 1):
+        left = TIME_COLUMN_WIDTH + index * DAY_COLUMN_WIDTH
+        draw.line([left, title_height, left, top], fill=colors['grid'])
+    
+    output = io.BytesIO()
+    image.save(output, format='PNG', optimize=True)
+    return output.getvalue()
+
+class ImageCache:
+    """Картинки в памяти и на диске, file_id загруженных картинок"""
+    
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_memory_images=MAX_MEMORY_IMAGES,
+                 max_disk_images=MAX_DISK_IMAGES):
+        self.directory = directory
+        self.max_memory_images = max_memory_images
+        self.max_disk_images = max_disk_images
+        self._lock = threading.Lock()
+        self._images = {}    # ключ -> PNG (порядок вставки = порядок использования)
+        self._file_ids = {}  # ключ -> file_id в Telegram
+    
+    def _path(self, key):
+        name = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f"{name}.png")
+    
+    def get_file_id(self, key):
+        with self._lock:
+            file_id = self._file_ids.get(key)
+        metrics.inc('images', 'file_id_hit' if file_id else 'file_id_miss')
+        return file_id
+    
+    def set_file_id(self, key, file_id):
+        with self._lock:
+            self._file_ids[key] = file_id
+    
+    def forget_file_id(self, key):
+        with self._lock:
+            self._file_ids.pop(key, None)
+    
+    def get(self, key, render):
+        """PNG по ключу; render() вызывается только если картинки нет ни в памяти, ни на диске"""
+        with self._lock:
+            content = self._images.pop(key, None)
+            if content is not None:
+                self._images[key] = content
+                metrics.inc('images', 'memory_hit')
+                return content
+        
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+            metrics.inc('images', 'disk_hit')
+            # Время изменения — время последнего использования (см. _prune_disk)
+            with contextlib.suppress(OSError):
+                os.utime(path)
+        except OSError:
+            content = render()
+            metrics.inc('images', 'rendered')
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                temp_path = f"{path}.tmp"
+                with open(temp_path, 'wb') as f:
+                    f.write(content)
+                os.replace(temp_path, path)
+                self._prune_disk()
+            except OSError as e:
+                logger.warning(f"⚠️ Не удалось сохранить картинку в кэш: {e}")
+        
+        with self._lock:
+            self._images[key] = content
+            while len(self._images) > self.max_memory_images:
+                del self._images[next(iter(self._images))]
+        return content
+    
+    def _prune_disk(self):
+        """Удаляет давно не использованные файлы сверх max_disk_images"""
+        entries = []
+        with os.scandir(self.directory) as scanner:
+            for entry in scanner:
+                if entry.name.endswith('.png'):
+                    with contextlib.suppress(OSError):
+                        entries.append((entry.stat().st_mtime, entry.path))
+        if len(entries) <= self.max_disk_images:
+            return 0
+        
+        entries.sort()
+        removed = 0
+        for _, path in entries[:len(entries) - self.max_disk_images]:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+                removed += 1
+        metrics.inc('images', 'disk_evicted', removed)
+        return removed
+
+class ImageRenderer:
+    """Очередь рисования и отправки картинок в пуле потоков"""
+    
+    def __init__(self, cache, workers=RENDER_WORKERS):
+        self.cache = cache
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='render')
+        self._lock = threading.Lock()
+        self._pending = {}  # ключ -> чаты, которые ждут эту картинку
+        metrics.register_gauge('images', lambda: {'queue': self.pending()})
+    
+    def pending(self):
+        """Сколько картинок рисуется или ждёт очереди"""
+        with self._lock:
+            return len(self._pending)
+    
+    def submit(self, key, chat_id, render, deliver):
+        """Ставит картинку в очередь
+        
+        render() -> PNG. deliver(chat_id, картинка) отправляет PNG, file_id
+        или None (не удалось нарисовать) и возвращает file_id. Если та же
+        картинка уже рисуется, чат просто добавляется к ожидающим.
+        """
+        with self._lock:
+            waiting = self._pending.get(key)
+            if waiting is not None:
+                waiting.append(chat_id)
+                metrics.inc('images', 'coalesced')
+                return
+            self._pending[key] = [chat_id]
+        self._pool.submit(self._process, key, render, deliver)
+    
+    def _process(self, key, render, deliver):
+        try:
+            content = self.cache.get(key, render)
+        except Exception as e:
+            logger.error(f"❌ Ошибка рисования картинки {key}: {e}")
+            content = None
+        
+        # Первому чату загружаем файл, остальным отправляем по file_id
+        with self._lock:
+            chats = self._pending.pop(key, [])
+        file_id = None
+        for chat_id in chats:
+            try:
+                file_id = deliver(chat_id, file_id or content) or file_id
+            except Exception as e:
+                logger.error(f"❌ Не удалось отправить картинку в чат {chat_id}: {e}")
+        if file_id:
+            self.cache.set_file_id(key, file_id)
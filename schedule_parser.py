@@ -1,4 +1,117 @@
+import contextlib
+import contextvars
+import datetime
+import logging
+import os
 import re
+import sys
+import threading
+import time
+from array import array
+
+import metrics
+from trie import Trie
+
+logger = logging.getLogger(__name__)
+
+# ====== ЗАПИСИ УРОКОВ ======
+LESSON_FIELDS = ('time', 'subject', 'teacher', 'classroom', 'class_name', 'day')
+
+class LessonMapping:
+    """Доступ к полям урока как к словарю: lesson['teacher'], lesson.get('day')
+    
+    Нужен для совместимости со старым кодом, который работал со словарями.
+    """
+    __slots__ = ()
+    
+    def __getitem__(self, key):
+        if key in LESSON_FIELDS:
+            return getattr(self, key)
+        raise KeyError(key)
+    
+    def get(self, key, default=None):
+        if key in LESSON_FIELDS:
+            return getattr(self, key)
+        return default
+    
+    def __contains__(self, key):
+        return key in LESSON_FIELDS
+    
+    def keys(self):
+        return LESSON_FIELDS
+    
+    def values(self):
+        return tuple(getattr(self, field) for field in LESSON_FIELDS)
+    
+    def items(self):
+        return tuple((field, getattr(self, field)) for field in LESSON_FIELDS)
+    
+    def __iter__(self):
+        return iter(LESSON_FIELDS)
+    
+    def __len__(self):
+        return len(LESSON_FIELDS)
+    
+    def copy(self):
+        """Изменяемая копия в виде словаря (как раньше делал lesson.copy())"""
+        return dict(self.items())
+    
+    def __eq__(self, other):
+        if isinstance(other, LessonMapping):
+            return self.values() == other.values()
+        if isinstance(other, dict):
+            return self.copy() == other
+        return NotImplemented
+    
+    def __hash__(self):
+        return hash(self.values())
+    
+    def __repr__(self):
+        fields = ', '.join(f"{field}={getattr(self, field)!r}" for field in LESSON_FIELDS)
+        return f"{type(self).__name__}({fields})"
+
+class Lesson(LessonMapping):
+    """Неизменяемая запись урока без __dict__"""
+    __slots__ = LESSON_FIELDS
+    
+    def __init__(self, time, subject, teacher, classroom, class_name, day):
+        set_field = object.__setattr__
+        set_field(self, 'time', time)
+        set_field(self, 'subject', subject)
+        set_field(self, 'teacher', teacher)
+        set_field(self, 'classroom', classroom)
+        set_field(self, 'class_name', class_name)
+        set_field(self, 'day', day)
+    
+    def __setattr__(self, name, value):
+        raise AttributeError("Lesson is immutable")
+    
+    def __delattr__(self, name):
+        raise AttributeError("Lesson is immutable")
+    
+    def __reduce__(self):
+        return (Lesson, self.values())
+
+class TeacherLesson(LessonMapping):
+    """Урок с точки зрения одного учителя из составного (ИНКИНА/ЛАТЫШЕВА)
+    
+    Учитель и кабинет — свои, остальные поля читаются из исходной записи
+    без копирования.
+    """
+    __slots__ = ('lesson', 'teacher', 'classroom')
+    
+    def __init__(self, lesson, teacher, classroom):
+        self.lesson = lesson
+        self.teacher = teacher
+        self.classroom = classroom
+    
+    time = property(lambda self: self.lesson.time)
+    subject = property(lambda self: self.lesson.subject)
+    class_name = property(lambda self: self.lesson.class_name)
+    day = property(lambda self: self.lesson.day)
+    
+    def __reduce__(self):
+        return (TeacherLesson, (self.lesson, self.teacher, self.classroom))
 
 def escape_markdown(text):
     """Экранирует специальные символы MarkdownV2"""
@@ -21,10 +134,10 @@ def escape_markdown(text):
     
     return result
 
-def read_schedule_file():
-    """Читает файл расписания"""
+def read_schedule_file(path=None):
+    """Читает файл расписания (по умолчанию — текущего источника)"""
     try:
-        with open('school_schedule.csv', 'r', encoding='utf-8') as f:
+        with open(path or get_index().path, 'r', encoding='utf-8') as f:
             return f.readlines()
     except FileNotFoundError:
         return []
@@ -35,6 +148,146 @@ def normalize_name(name):
         return ""
     return re.sub(r'\s+', '', name.strip().upper())
 
+# ====== КОЛОНОЧНАЯ ТАБЛИЦА УРОКОВ ======
+
+# Поля, по которым можно фильтровать; учитель и кабинет разбиваются по слэшу
+FILTER_FIELDS = {'teacher': True, 'classroom': True, 'class_name': False, 'day': False}
+
+class StringDictionary:
+    """Словарь строк столбца: строка <-> код"""
+    
+    __slots__ = ('values', 'codes', 'lock')
+    
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+        self.lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self.values)
+    
+    def encode(self, value):
+        """Код строки (новые строки интернируются)"""
+        code = self.codes.get(value)
+        if code is None:
+            with self.lock:
+                code = self.codes.get(value)
+                if code is None:
+                    code = len(self.values)
+                    self.values.append(sys.intern(value))
+                    self.codes[value] = code
+        return code
+
+# Время, предметы и дни недели повторяются от школы к школе, поэтому их
+# словари общие для таблиц всех источников. Учителя, кабинеты и классы
+# у каждой школы свои и выгружаются вместе с её таблицей
+SHARED_FIELDS = ('time', 'subject', 'day')
+_shared_dictionaries = {field: StringDictionary() for field in SHARED_FIELDS}
+
+class LessonTable:
+    """Все уроки расписания по столбцам
+    
+    Каждый столбец хранится как array('H') с кодами строк, а сами строки —
+    в словаре столбца (одна интернированная строка на значение). Для полей
+    из FILTER_FIELDS хранятся списки строк таблицы по нормализованному
+    ключу, из которых при запросе строятся битовые маски: фильтр
+    "учитель X в среду" — это пересечение двух масок, без обхода уроков.
+    """
+    
+    __slots__ = ('columns', 'dictionaries', 'position', 'positions', 'postings', '_lessons')
+    
+    def __init__(self):
+        self.columns = {field: array('H') for field in LESSON_FIELDS}
+        self.dictionaries = {
+            field: _shared_dictionaries[field] if field in SHARED_FIELDS else StringDictionary()
+            for field in LESSON_FIELDS
+        }
+        self.position = array('I')  # номер позиции класса в файле для каждой строки
+        self.positions = []         # позиции классов (как в find_class_positions)
+        self.postings = {field: {} for field in FILTER_FIELDS}
+        self._lessons = None
+    
+    def __len__(self):
+        return len(self.position)
+    
+    def add_position(self, position):
+        """Запоминает позицию класса, возвращает её номер"""
+        self.positions.append(position)
+        return len(self.positions) - 1
+    
+    def encode(self, field, value):
+        """Код строки в словаре столбца"""
+        code = self.dictionaries[field].encode(value)
+        if code > 0xFFFF and self.columns[field].typecode == 'H':
+            self.columns[field] = array('I', self.columns[field])
+        return code
+    
+    def append(self, lesson, position_id):
+        """Добавляет урок в таблицу"""
+        row = len(self.position)
+        for field in LESSON_FIELDS:
+            self.columns[field].append(self.encode(field, getattr(lesson, field)))
+        self.position.append(position_id)
+        
+        for field, split in FILTER_FIELDS.items():
+            value = getattr(lesson, field)
+            parts = split_by_slash(value) if split else [value]
+            postings = self.postings[field]
+            for key in {normalize_name(part) for part in parts}:
+                if key:
+                    if key not in postings:
+                        postings[key] = array('I')
+                    postings[key].append(row)
+        
+        self._lessons = None
+        return row
+    
+    def value(self, field, row):
+        return self.dictionaries[field].values[self.columns[field][row]]
+    
+    @property
+    def lessons(self):
+        """Записи Lesson для всех строк (строки берутся из словарей столбцов)"""
+        if self._lessons is None:
+            columns = [(self.dictionaries[field].values, self.columns[field]) for field in LESSON_FIELDS]
+            self._lessons = [
+                Lesson(*(values[codes[row]] for values, codes in columns))
+                for row in range(len(self.position))
+            ]
+        return self._lessons
+    
+    @property
+    def all_rows(self):
+        """Маска со всеми строками таблицы"""
+        return (1 << len(self.position)) - 1
+    
+    def mask(self, field, value):
+        """Битовая маска строк, где поле field совпадает с value
+        
+        Для учителя и кабинета совпадением считается любая часть через слэш.
+        """
+        rows = self.postings[field].get(normalize_name(value))
+        if not rows:
+            return 0
+        bits = bytearray((len(self.position) + 7) // 8)
+        for row in rows:
+            bits[row >> 3] |= 1 << (row & 7)
+        return int.from_bytes(bits, 'little')
+    
+    @staticmethod
+    def rows(mask):
+        """Номера строк, выставленных в маске, по возрастанию"""
+        bits = bin(mask)[:1:-1]  # младший бит первым
+        row = bits.find('1')
+        while row >= 0:
+            yield row
+            row = bits.find('1', row + 1)
+    
+    def select(self, mask):
+        """Уроки по маске в порядке файла"""
+        lessons = self.lessons
+        return [lessons[row] for row in self.rows(mask)]
+
 # ====== БАЗОВЫЕ ФУНКЦИИ ДЛЯ ПАРСИНГА ======
 
 def split_by_slash(value):
@@ -44,9 +297,10 @@ def split_by_slash(value):
     parts = re.split(r'[\\\/]', value)
     return [part.strip() for part in parts if part.strip()]
 
-def find_schedule_headers():
+def find_schedule_headers(lines=None):
     """Находит все заголовки расписаний в файле"""
-    lines = read_schedule_file()
+    if lines is None:
+        lines = read_schedule_file()
     headers = []
     
     for line_num, line in enumerate(lines):
@@ -78,11 +332,13 @@ def get_day_for_line(line_num, headers):
 
 # ====== ПОИСК КЛАССОВ ======
 
-def find_class_positions(class_name):
+def find_class_positions(class_name, lines=None, headers=None):
     """Находит все позиции класса в файле"""
     normalized_target = normalize_name(class_name)
-    lines = read_schedule_file()
-    headers = find_schedule_headers()
+    if lines is None:
+        lines = read_schedule_file()
+    if headers is None:
+        headers = find_schedule_headers(lines)
     positions = []
     
     for line_num, line in enumerate(lines):
@@ -101,14 +357,16 @@ def find_class_positions(class_name):
     
     return positions
 
-def get_lessons_for_position(position):
+def get_lessons_for_position(position, lines=None, headers=None):
     """Получает уроки для класса в конкретной позиции"""
-    lines = read_schedule_file()
+    if lines is None:
+        lines = read_schedule_file()
     lessons = []
     
     line_num = position['line_num']
     col_num = position['col_num']
-    headers = find_schedule_headers()
+    if headers is None:
+        headers = find_schedule_headers(lines)
     base_day = position['day']
     
     i = line_num + 1
@@ -167,14 +425,10 @@ def get_lessons_for_position(position):
                         classroom = next_cells[col_num].strip()
                 
                 if subject or teacher or classroom:
-                    lessons.append({
-                        'time': time_str,
-                        'subject': subject,
-                        'teacher': teacher,
-                        'classroom': classroom,
-                        'class_name': position['class_name'],
-                        'day': base_day
-                    })
+                    lessons.append(Lesson(
+                        time_str, subject, teacher, classroom,
+                        position['class_name'], base_day
+                    ))
                 
                 i += 2
                 continue
@@ -183,23 +437,36 @@ def get_lessons_for_position(position):
     
     return lessons
 
-def get_schedule_for_class(class_name):
-    """Получает все расписания для класса"""
-    positions = find_class_positions(class_name)
-    if not positions:
-        return []
+@metrics.timed('parser')
+def get_schedule_for_class(class_name, days=None):
+    """Получает все расписания для класса
     
-    all_schedules = []
-    for pos in positions:
-        lessons = get_lessons_for_position(pos)
-        if lessons:
-            all_schedules.append({
-                'position_info': pos,
-                'lessons': lessons
-            })
+    Если указаны дни (days — список из DAY_ORDER), читаются только
+    шарды этих дней, а не вся неделя.
+    """
+    table = get_lesson_table()
+    if days is not None:
+        key = normalize_name(class_name)
+        return [
+            {'position_info': dict(table.positions[position_id]), 'lessons': position_lessons}
+            for day in days
+            for position_id, position_lessons in get_day_shard(day).classes.get(key, {}).items()
+        ]
+    
+    lessons = table.lessons
+    
+    # Строки таблицы идут в порядке позиций, поэтому группы
+    # получаются в том же порядке, что и при разборе файла
+    lessons_by_position = {}
+    for row in table.rows(table.mask('class_name', class_name)):
+        lessons_by_position.setdefault(table.position[row], []).append(lessons[row])
     
-    return all_schedules
+    return [
+        {'position_info': dict(table.positions[position_id]), 'lessons': position_lessons}
+        for position_id, position_lessons in lessons_by_position.items()
+    ]
 
+@metrics.timed('render')
 def format_class_schedule(class_name, schedules):
     """Форматирует расписание класса для вывода"""
     if not schedules:
@@ -255,11 +522,176 @@ def format_class_schedule(class_name, schedules):
 
 # ====== ПОИСК УЧИТЕЛЕЙ ======
 
+# ====== ИНДЕКС УРОКОВ ======
+# У каждого источника расписания (школы) свой файл и свой индекс. Кэши
+# индекса строятся под его блокировкой: запросы, пришедшие во время
+# фонового построения, ждут его окончания, а не строят свой
+DEFAULT_SOURCE = 'default'
+DEFAULT_SCHEDULE_PATH = 'school_schedule.csv'
+
+class ScheduleIndex:
+    """Файл расписания одного источника и построенные по нему кэши"""
+    
+    __slots__ = ('name', 'path', 'lock', 'last_used', 'version', 'updated_at',
+                 'lesson_table', 'teachers', 'room_index', 'room_occupancy', 'day_shards', 'catalog',
+                 'room_trie')
+    
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.lock = threading.RLock()
+        self.last_used = time.monotonic()
+        self.version = 0
+        self.reset()
+    
+    def reset(self):
+        """Сбрасывает все кэши"""
+        with self.lock:
+            # Номер версии входит в ключи кэшей запросов: после сброса
+            # результаты, посчитанные по старому файлу, не используются
+            self.version += 1
+            self.updated_at = None
+            self.lesson_table = None
+            self.teachers = None
+            self.room_index = None
+            self.room_occupancy = None
+            self.day_shards = {}
+            self.catalog = None
+            self.room_trie = None
+    
+    @property
+    def loaded(self):
+        return self.lesson_table is not None
+
+_indexes = {DEFAULT_SOURCE: ScheduleIndex(DEFAULT_SOURCE, DEFAULT_SCHEDULE_PATH)}
+_current_source = contextvars.ContextVar('schedule_source', default=DEFAULT_SOURCE)
+
+def register_source(name, path):
+    """Регистрирует источник расписания с файлом path"""
+    index = _indexes.get(name)
+    if index is None:
+        index = _indexes.setdefault(name, ScheduleIndex(name, path))
+    elif index.path != path:
+        with index.lock:
+            index.path = path
+            index.reset()
+    return index
+
+def unregister_source(name):
+    """Убирает источник (например, удалённую версию из истории) вместе с индексом"""
+    index = _indexes.pop(name, None)
+    if index is not None:
+        index.reset()
+    return index
+
+def get_index(name=None):
+    """Индекс источника name (по умолчанию — текущего)"""
+    name = name or _current_source.get()
+    index = _indexes.get(name)
+    if index is None:
+        raise KeyError(f"Неизвестный источник расписания: {name}")
+    index.last_used = time.monotonic()
+    return index
+
+def current_source():
+    """Имя источника, с которым сейчас работает парсер"""
+    return _current_source.get()
+
+@contextlib.contextmanager
+def use_source(name):
+    """Все запросы к парсеру внутри блока идут к источнику name
+    
+        with use_source('school25'):
+            get_teacher_schedule('Иванов')
+    """
+    index = get_index(name or DEFAULT_SOURCE)
+    token = _current_source.set(index.name)
+    try:
+        yield index
+    finally:
+        _current_source.reset(token)
+
+def evict_idle_indexes(max_idle_seconds, keep=()):
+    """Выгружает из памяти индексы источников, к которым давно не обращались
+    
+    Индексы источников из keep не выгружаются.
+    """
+    now = time.monotonic()
+    evicted = []
+    for index in list(_indexes.values()):
+        if index.name in keep:
+            continue
+        if index.loaded and now - index.last_used > max_idle_seconds:
+            index.reset()
+            evicted.append(index.name)
+            metrics.inc('index_evictions', index.name)
+    
+    if evicted:
+        logger.info(f"🧹 Выгружены неиспользуемые индексы: {', '.join(evicted)}")
+    return evicted
+
+def index_stats():
+    """Число уроков в загруженных индексах"""
+    stats = {}
+    for index in list(_indexes.values()):
+        table = index.lesson_table
+        if table is not None:
+            stats[index.name] = len(table)
+    return stats
+
+metrics.register_gauge('index_lessons', index_stats)
+
+# Модуль mapped_index, если таблицы уроков читаются из файлов через mmap
+# (включается в многопроцессном режиме, см. enable_mapped_index)
+_mapped_index = None
+
+def enable_mapped_index():
+    """Таблицы уроков собираются в файл рядом с CSV и открываются через mmap
+    
+    Процессы-обработчики тогда делят одну копию индекса в кэше страниц ОС
+    вместо того, чтобы строить каждый свою (см. mapped_index.py).
+    """
+    global _mapped_index
+    import mapped_index
+    _mapped_index = mapped_index
+    for index in list(_indexes.values()):
+        index.reset()
+
+@metrics.timed('parser')
 def get_all_lessons():
-    """Получает все уроки для всех классов"""
-    lines = read_schedule_file()
-    headers = find_schedule_headers()
-    all_lessons = []
+    """Получает все уроки для всех классов (из кэша)"""
+    return get_lesson_table().lessons
+
+def get_lesson_table():
+    """Колоночная таблица уроков (из кэша)"""
+    index = get_index()
+    table = index.lesson_table
+    if table is None:
+        with index.lock:
+            table = index.lesson_table
+            if table is None:
+                metrics.inc('index_rebuilds', 'lessons')
+                updated_at = _file_mtime(index.path)
+                if _mapped_index is not None:
+                    table = _mapped_index.load_or_compile(index.path, parse_lesson_table)
+                else:
+                    table = parse_lesson_table(index.path)
+                index.lesson_table = table
+                index.updated_at = updated_at
+                return table
+    
+    metrics.inc('cache_hits', 'lessons')
+    return table
+
+def parse_all_lessons():
+    """Разбирает файл расписания и возвращает все уроки всех классов"""
+    return parse_lesson_table().lessons
+
+def parse_lesson_table(path=None):
+    """Разбирает файл расписания в колоночную таблицу"""
+    lines = read_schedule_file(path)
+    headers = find_schedule_headers(lines)
+    table = LessonTable()
     
     # Сначала находим все классы
     class_positions = []
@@ -278,55 +710,62 @@ def get_all_lessons():
     
     # Для каждого класса получаем уроки
     for pos in class_positions:
-        lessons = get_lessons_for_position(pos)
+        position_id = table.add_position(pos)
+        lessons = get_lessons_for_position(pos, lines, headers)
         for lesson in lessons:
-            all_lessons.append(lesson)
+            table.append(lesson, position_id)
+    
+    return table
+
+@metrics.timed('parser')
+def find_lessons(teacher=None, room=None, class_name=None, day=None):
+    """Уроки по фильтрам, например find_lessons(teacher='Иванов', day='ср')
+    
+    Фильтры объединяются через И пересечением битовых масок таблицы.
+    """
+    table = get_lesson_table()
+    mask = table.all_rows
+    
+    filters = (('teacher', teacher), ('classroom', room), ('class_name', class_name))
+    for field, value in filters:
+        if value is not None:
+            mask &= table.mask(field, value)
+    
+    if day is not None:
+        full_day = normalize_day(day)
+        mask &= table.mask('day', full_day) if full_day else 0
+    
+    return table.select(mask)
+
+def get_classroom_for_teacher(classroom_field, teacher_index, teachers_count):
+    """Определяет кабинет учителя с номером teacher_index в составном уроке"""
+    if not classroom_field:
+        return ""
     
-    return all_lessons
+    classroom_parts = split_by_slash(classroom_field)
+    if len(classroom_parts) == teachers_count:
+        return classroom_parts[teacher_index]
+    elif classroom_parts:
+        return classroom_parts[0]
+    return ""
 
-def get_teacher_schedule(teacher_name):
-    """Получает расписание для учителя"""
+@metrics.timed('parser')
+def get_teacher_schedule(teacher_name, days=None):
+    """Получает расписание для учителя (только за дни days, если указаны)"""
     normalized_teacher = normalize_name(teacher_name)
-    all_lessons = get_all_lessons()
+    if days is not None:
+        return _schedule_from_shards('teachers', normalized_teacher, days)
+    
+    _, teacher_lookup, _ = get_teachers()
     schedule_by_day = {}
     
-    for lesson in all_lessons:
-        teacher_field = lesson['teacher']
-        if not teacher_field:
-            continue
-        
-        teacher_parts = split_by_slash(teacher_field)
-        teacher_index = -1
-        
-        # Ищем нашего учителя
-        for idx, part in enumerate(teacher_parts):
-            if normalize_name(part) == normalized_teacher:
-                teacher_index = idx
-                break
-        
-        if teacher_index >= 0:
-            # Нашли учителя, определяем кабинет
-            classroom_field = lesson['classroom']
-            classroom_for_teacher = ""
-            
-            if classroom_field:
-                classroom_parts = split_by_slash(classroom_field)
-                if len(classroom_parts) == len(teacher_parts):
-                    classroom_for_teacher = classroom_parts[teacher_index]
-                elif len(classroom_parts) == 1:
-                    classroom_for_teacher = classroom_parts[0]
-                elif classroom_parts:
-                    classroom_for_teacher = classroom_parts[0]
-            
-            # Создаем копию урока с правильным кабинетом
-            lesson_copy = lesson.copy()
-            lesson_copy['teacher'] = teacher_parts[teacher_index]
-            lesson_copy['classroom'] = classroom_for_teacher
-            
-            day = lesson['day']
-            if day not in schedule_by_day:
-                schedule_by_day[day] = []
-            schedule_by_day[day].append(lesson_copy)
+    # Уроки учителя уже лежат в индексе в виде TeacherLesson
+    # с его собственным кабинетом — копировать записи не нужно
+    for lesson in teacher_lookup.get(normalized_teacher, ()):
+        day = lesson.day
+        if day not in schedule_by_day:
+            schedule_by_day[day] = []
+        schedule_by_day[day].append(lesson)
     
     # Сортируем уроки внутри каждого дня по времени
     for day in schedule_by_day:
@@ -349,6 +788,7 @@ def parse_time(time_str):
     except:
         return 0
 
+@metrics.timed('render')
 def format_teacher_schedule(teacher_name, schedule_by_day):
     """Форматирует расписание учителя"""
     if not schedule_by_day:
@@ -403,54 +843,38 @@ def format_teacher_schedule(teacher_name, schedule_by_day):
     
     return result
 
+@metrics.timed('parser')
 def search_teachers_by_substring(substring):
     """Ищет учителей по части фамилии"""
     normalized_substring = normalize_name(substring)
-    all_lessons = get_all_lessons()
+    _, _, teacher_names = get_teachers()
     found_teachers = set()
     
-    for lesson in all_lessons:
-        teacher_field = lesson['teacher']
-        if not teacher_field:
-            continue
-        
-        teacher_parts = split_by_slash(teacher_field)
-        for part in teacher_parts:
-            if normalized_substring in normalize_name(part):
-                found_teachers.add(part)
+    # Перебираем словарь учителей, а не все уроки
+    for key, names in teacher_names.items():
+        if normalized_substring in key:
+            found_teachers.update(names)
     
-    return sorted(list(found_teachers))
+    return sorted(found_teachers)
 
 # ====== ПОИСК ПО КАБИНЕТУ ======
 
-def get_room_schedule(room_number):
-    """Получает расписание для кабинета"""
+@metrics.timed('parser')
+def get_room_schedule(room_number, days=None):
+    """Получает расписание для кабинета (только за дни days, если указаны)"""
     normalized_room = normalize_name(room_number)
-    all_lessons = get_all_lessons()
+    if days is not None:
+        return _schedule_from_shards('rooms', normalized_room, days)
+    
+    room_entry = get_cached_room_index().get(normalized_room)
     schedule_by_day = {}
     
-    for lesson in all_lessons:
-        classroom_field = lesson['classroom']
-        if not classroom_field:
-            continue
-        
-        # Проверяем все части кабинета (могут быть через слэш)
-        classroom_parts = split_by_slash(classroom_field)
-        classroom_found = False
-        
-        for part in classroom_parts:
-            if normalize_name(part) == normalized_room:
-                classroom_found = True
-                break
-        
-        if classroom_found:
-            day = lesson['day']
-            if day not in schedule_by_day:
-                schedule_by_day[day] = []
-            
-            # Создаем копию урока с информацией
-            lesson_copy = lesson.copy()
-            schedule_by_day[day].append(lesson_copy)
+    # Записи уроков неизменяемы, поэтому отдаём их без копирования
+    for lesson in (room_entry[1] if room_entry else ()):
+        day = lesson.day
+        if day not in schedule_by_day:
+            schedule_by_day[day] = []
+        schedule_by_day[day].append(lesson)
     
     # Сортируем уроки внутри каждого дня по времени
     for day in schedule_by_day:
@@ -458,6 +882,7 @@ def get_room_schedule(room_number):
     
     return schedule_by_day
 
+@metrics.timed('render')
 def format_room_schedule(room_number, schedule_by_day):
     """Форматирует расписание кабинета"""
     if not schedule_by_day:
@@ -516,27 +941,80 @@ def format_room_schedule(room_number, schedule_by_day):
 
 # ====== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ======
 
+@metrics.timed('parser')
 def get_available_classes():
     """Получает список всех доступных классов"""
-    lines = read_schedule_file()
-    classes = set()
-    
-    for line in lines:
-        cells = line.strip().split(',')
-        for cell in cells:
-            cell_clean = cell.strip()
-            if re.match(r'^\d+\s*[А-ЯA-Z](\s*[А-ЯA-Z])?$', cell_clean, re.IGNORECASE):
-                classes.add(cell_clean)
+    # Позиции классов уже найдены при построении таблицы уроков
+    classes = {position['class_name'] for position in get_lesson_table().positions}
     
     return sorted(list(classes), key=lambda x: (
         int(re.search(r'\d+', x).group()) if re.search(r'\d+', x) else 999,
         x
     ))
 
+class SelectionCatalog:
+    """Классы по параллелям и учителя по первой букве — для клавиатур выбора"""
+    
+    __slots__ = ('version', 'grades', 'initials')
+    
+    def __init__(self, version):
+        self.version = version  # версия индекса, по которой построен каталог
+        self.grades = {}        # параллель ('5') -> [классы], параллели по возрастанию
+        self.initials = {}      # буква -> [фамилии как в файле], буквы по алфавиту
+    
+    @property
+    def classes_count(self):
+        return sum(len(classes) for classes in self.grades.values())
+
+def get_selection_catalog():
+    """Каталог классов и учителей текущего источника (строится раз на версию индекса)"""
+    index = get_index()
+    catalog = index.catalog
+    if catalog is None:
+        with index.lock:
+            catalog = index.catalog
+            if catalog is None:
+                metrics.inc('index_rebuilds', 'catalog')
+                catalog = SelectionCatalog(index.version)
+                
+                for class_name in get_available_classes():
+                    grade = re.match(r'\d+', class_name)
+                    if grade:
+                        catalog.grades.setdefault(grade.group(), []).append(class_name)
+                
+                # Одна кнопка на учителя, даже если фамилия записана по-разному
+                teachers = {}
+                for value in get_lesson_table().dictionaries['teacher'].values:
+                    for teacher in split_by_slash(value):
+                        key = normalize_name(teacher)
+                        if key:
+                            teachers.setdefault(key, teacher.strip())
+                for key in sorted(teachers):
+                    catalog.initials.setdefault(key[0], []).append(teachers[key])
+                
+                index.catalog = catalog
+                return catalog
+    
+    metrics.inc('cache_hits', 'catalog')
+    return catalog
+
+def _file_mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+def schedule_updated_at():
+    """Когда скачан файл, по которому сейчас отвечает бот (время Unix) или None"""
+    index = get_index()
+    if index.updated_at is not None:
+        return index.updated_at
+    return _file_mtime(index.path)
+
 def has_schedule_file():
     """Проверяет наличие файла расписания"""
     try:
-        with open('school_schedule.csv', 'r', encoding='utf-8'):
+        with open(get_index().path, 'r', encoding='utf-8'):
             return True
     except FileNotFoundError:
         return False
@@ -593,36 +1071,457 @@ def format_teacher_schedule_old(teacher_info):
     return format_teacher_schedule(teacher_name, schedule_by_day)
 
 # ====== КЭШ ДЛЯ ПРОИЗВОДИТЕЛЬНОСТИ ======
-_teacher_index_cache = None
 
 def get_cached_teacher_index():
     """Совместимость со старым кодом"""
-    global _teacher_index_cache
-    if _teacher_index_cache is None:
-        _teacher_index_cache = {}
-        all_lessons = get_all_lessons()
+    return get_teachers()[0]
+
+def get_teachers():
+    """Индексы учителей текущего источника (из кэша)
+    
+    Возвращает кортеж из трёх словарей:
+    фамилия как в файле -> [TeacherLesson],
+    нормализованная фамилия -> [TeacherLesson],
+    нормализованная фамилия -> {варианты написания}.
+    """
+    index = get_index()
+    teachers = index.teachers
+    if teachers is None:
+        with index.lock:
+            teachers = index.teachers
+            if teachers is None:
+                metrics.inc('index_rebuilds', 'teacher_index')
+                teacher_index = {}
+                teacher_lookup = {}
+                teacher_names = {}
+                all_lessons = get_all_lessons()
+                
+                for lesson in all_lessons:
+                    teacher_field = lesson.teacher
+                    if not teacher_field:
+                        continue
+                    
+                    teacher_parts = split_by_slash(teacher_field)
+                    seen_keys = set()
+                    for teacher_index_in_lesson, teacher in enumerate(teacher_parts):
+                        # Проекция урока на учителя: свой кабинет, без копии записи
+                        view = TeacherLesson(lesson, teacher, get_classroom_for_teacher(
+                            lesson.classroom, teacher_index_in_lesson, len(teacher_parts)
+                        ))
+                        
+                        if teacher not in teacher_index:
+                            teacher_index[teacher] = []
+                        teacher_index[teacher].append(view)
+                        
+                        key = normalize_name(teacher)
+                        teacher_names.setdefault(key, set()).add(teacher)
+                        if key not in seen_keys:
+                            seen_keys.add(key)
+                            teacher_lookup.setdefault(key, []).append(view)
+                
+                teachers = index.teachers = (teacher_index, teacher_lookup, teacher_names)
+                return teachers
+    
+    metrics.inc('cache_hits', 'teacher_index')
+    return teachers
+
+# ====== СВОБОДНЫЕ КАБИНЕТЫ ======
+DAY_ORDER = ['ПОНЕДЕЛЬНИК', 'ВТОРНИК', 'СРЕДА', 'ЧЕТВЕРГ', 'ПЯТНИЦА', 'СУББОТА']
+DAY_ABBREVIATIONS = {'ПН': 'ПОНЕДЕЛЬНИК', 'ВТ': 'ВТОРНИК', 'СР': 'СРЕДА',
+                     'ЧТ': 'ЧЕТВЕРГ', 'ПТ': 'ПЯТНИЦА', 'СБ': 'СУББОТА'}
+NOT_A_ROOM = ['', 'ДЕНЬ САМОПОДГОТОВКИ']
+
+def parse_time_range(time_str):
+    """Преобразует интервал '8.30–9.10' в пару минут (начало, конец)"""
+    start = parse_time(time_str)
+    parts = re.split(r'[–\-]', time_str)
+    end = parse_time(parts[1]) if len(parts) > 1 else start
+    return start, max(start, end)
+
+def normalize_day(day_text):
+    """Приводит название дня к виду из файла (ПН, пон, понедельник -> ПОНЕДЕЛЬНИК)"""
+    day = normalize_name(day_text)
+    if not day:
+        return None
+    if day in DAY_ABBREVIATIONS:
+        return DAY_ABBREVIATIONS[day]
+    if len(day) >= 2:
+        for full_day in DAY_ORDER:
+            if full_day.startswith(day):
+                return full_day
+    return None
+
+def get_cached_room_index():
+    """Индекс кабинетов: нормализованный номер -> (название, уроки)"""
+    index = get_index()
+    room_index = index.room_index
+    if room_index is None:
+        with index.lock:
+            room_index = index.room_index
+            if room_index is None:
+                metrics.inc('index_rebuilds', 'room_index')
+                room_index = {}
+                for lesson in get_all_lessons():
+                    seen_keys = set()
+                    for room in split_by_slash(lesson.classroom):
+                        key = normalize_name(room)
+                        if key in seen_keys:
+                            continue
+                        seen_keys.add(key)
+                        if key not in room_index:
+                            room_index[key] = (room, [])
+                        room_index[key][1].append(lesson)
+                
+                index.room_index = room_index
+                return room_index
+    
+    metrics.inc('cache_hits', 'room_index')
+    return room_index
+
+def get_room_trie():
+    """Префиксное дерево кабинетов: начало слова в номере -> ключ в индексе кабинетов
+    
+    Ключами служат нормализованные хвосты номера с начала каждого слова:
+    "1 ГРУППА 456" находится и по "1 гр", и по "груп", и по "45".
+    """
+    index = get_index()
+    room_trie = index.room_trie
+    if room_trie is None:
+        with index.lock:
+            room_trie = index.room_trie
+            if room_trie is None:
+                metrics.inc('index_rebuilds', 'room_trie')
+                room_trie = Trie()
+                for key, (room, _) in get_cached_room_index().items():
+                    if room.upper() in NOT_A_ROOM:
+                        continue
+                    words = room.split()
+                    for start in range(len(words)):
+                        room_trie.insert(normalize_name(''.join(words[start:])), key)
+                
+                index.room_trie = room_trie
+                return room_trie
+    
+    metrics.inc('cache_hits', 'room_trie')
+    return room_trie
+
+@metrics.timed('parser')
+def search_rooms_by_prefix(prefix, limit=None):
+    """Кабинеты, номер которых (или слово в номере) начинается с prefix
+    
+    Стоит O(длины префикса + найденных), без обхода всех кабинетов.
+    Возвращает названия как в файле, по возрастанию номера.
+    """
+    normalized_prefix = normalize_name(prefix)
+    if not normalized_prefix:
+        return []
+    
+    keys = dict.fromkeys(get_room_trie().with_prefix(normalized_prefix))
+    room_index = get_cached_room_index()
+    rooms = [room_index[key][0] for key in sorted(keys, key=lambda key: (parse_room_number(key), key))]
+    return rooms[:limit] if limit is not None else rooms
+
+def get_room_occupancy():
+    """Битовая карта занятости: кабинет × (день, урок)
+    
+    Для каждого дня хранится список временных слотов, а для каждого
+    слота — целое число, в котором i-й бит выставлен, если i-й кабинет
+    занят в пересекающийся по времени интервал.
+    """
+    index = get_index()
+    occupancy = index.room_occupancy
+    if occupancy is None:
+        with index.lock:
+            occupancy = index.room_occupancy
+            if occupancy is None:
+                metrics.inc('index_rebuilds', 'room_occupancy')
+                room_index = get_cached_room_index()
+                room_keys = sorted(
+                    (key for key, (room, _) in room_index.items() if room.upper() not in NOT_A_ROOM),
+                    key=lambda key: (parse_room_number(key), key)
+                )
+                
+                # Временные интервалы уроков по дням
+                times_by_day = {}
+                for lesson in get_all_lessons():
+                    day_times = times_by_day.setdefault(lesson['day'], {})
+                    if lesson['time'] not in day_times:
+                        day_times[lesson['time']] = parse_time_range(lesson['time'])
+                
+                # Интервалы занятости каждого кабинета по дням
+                busy_by_day = {}
+                for bit, key in enumerate(room_keys):
+                    for lesson in room_index[key][1]:
+                        busy_by_day.setdefault(lesson['day'], []).append(
+                            (times_by_day[lesson['day']][lesson['time']], bit)
+                        )
+                
+                slots = {}
+                bitmap = {}
+                for day, day_times in times_by_day.items():
+                    slots[day] = sorted(day_times, key=lambda t: day_times[t])
+                    intervals = busy_by_day.get(day, [])
+                    
+                    for slot_num, slot_time in enumerate(slots[day]):
+                        slot_start, slot_end = day_times[slot_time]
+                        mask = 0
+                        for (start, end), bit in intervals:
+                            if start < slot_end and slot_start < end:
+                                mask |= 1 << bit
+                        bitmap[(day, slot_num)] = mask
+                
+                occupancy = index.room_occupancy = {
+                    'rooms': [room_index[key][0] for key in room_keys],
+                    'all_rooms': (1 << len(room_keys)) - 1,
+                    'slots': slots,
+                    'bitmap': bitmap
+                }
+                return occupancy
+    
+    metrics.inc('cache_hits', 'room_occupancy')
+    return occupancy
+
+# ====== ШАРДЫ ПО ДНЯМ ======
+# Самый частый запрос — расписание на один день ("что сегодня у 5А").
+# Шард дня хранит уроки только этого дня, разложенные по классам,
+# учителям и кабинетам, и строится по строкам дня из таблицы уроков —
+# запрос на сегодня не трогает и не форматирует остальные дни недели
+
+class DayShard:
+    """Уроки одного дня по нормализованным классам, учителям и кабинетам"""
+    
+    __slots__ = ('day', 'classes', 'teachers', 'rooms')
+    
+    def __init__(self, day):
+        self.day = day
+        self.classes = {}   # класс -> {номер позиции: [Lesson]} в порядке файла
+        self.teachers = {}  # учитель -> [TeacherLesson] по времени
+        self.rooms = {}     # кабинет -> [Lesson] по времени
+    
+    def add(self, lesson, position_id):
+        self.classes.setdefault(normalize_name(lesson.class_name), {}).setdefault(position_id, []).append(lesson)
         
-        for lesson in all_lessons:
-            teacher_field = lesson['teacher']
-            if not teacher_field:
-                continue
-            
-            teacher_parts = split_by_slash(teacher_field)
-            for teacher in teacher_parts:
-                if teacher not in _teacher_index_cache:
-                    _teacher_index_cache[teacher] = []
-                _teacher_index_cache[teacher].append(lesson)
-    
-    return _teacher_index_cache
-
-def reload_schedule():
-    """Перезагружает расписание"""
-    global _teacher_index_cache
-    _teacher_index_cache = None
+        teacher_parts = split_by_slash(lesson.teacher)
+        for teacher_index_in_lesson, teacher in enumerate(teacher_parts):
+            lessons = self.teachers.setdefault(normalize_name(teacher), [])
+            if lessons and lessons[-1].lesson is lesson:
+                continue  # та же фамилия дважды в составном уроке
+            lessons.append(TeacherLesson(lesson, teacher, get_classroom_for_teacher(
+                lesson.classroom, teacher_index_in_lesson, len(teacher_parts)
+            )))
+        
+        for key in {normalize_name(room) for room in split_by_slash(lesson.classroom)}:
+            self.rooms.setdefault(key, []).append(lesson)
+    
+    def sort(self):
+        for lessons in self.teachers.values():
+            lessons.sort(key=lambda x: parse_time(x['time']))
+        for lessons in self.rooms.values():
+            lessons.sort(key=lambda x: parse_time(x['time']))
+
+def get_day_shard(day):
+    """Шард дня day (как в DAY_ORDER) текущего источника (из кэша)"""
+    index = get_index()
+    shard = index.day_shards.get(day)
+    if shard is None:
+        with index.lock:
+            shard = index.day_shards.get(day)
+            if shard is None:
+                metrics.inc('index_rebuilds', 'day_shard')
+                table = get_lesson_table()
+                lessons = table.lessons
+                shard = DayShard(day)
+                for row in table.postings['day'].get(normalize_name(day), ()):
+                    shard.add(lessons[row], table.position[row])
+                shard.sort()
+                index.day_shards[day] = shard
+                return shard
+    
+    metrics.inc('cache_hits', 'day_shard')
+    return shard
+
+def _schedule_from_shards(field, key, days):
+    """{день: уроки} для учителя или кабинета по шардам дней"""
+    schedule_by_day = {}
+    for day in days:
+        lessons = getattr(get_day_shard(day), field).get(key)
+        if lessons:
+            schedule_by_day[day] = lessons
+    return schedule_by_day
+
+def day_of_date(date):
+    """День недели даты как в расписании или None для воскресенья"""
+    weekday = date.weekday()
+    return DAY_ORDER[weekday] if weekday < len(DAY_ORDER) else None
+
+def parse_day_range(text):
+    """Дни по тексту: 'ср' -> ['СРЕДА'], 'пн-ср' -> ['ПОНЕДЕЛЬНИК', 'ВТОРНИК', 'СРЕДА']
+    
+    Понимает также 'сегодня' и 'завтра'. Возвращает None, если это не дни.
+    """
+    text = (text or '').strip().lower()
+    relative = {'сегодня': 0, 'завтра': 1}
+    if text in relative:
+        day = day_of_date(datetime.date.today() + datetime.timedelta(days=relative[text]))
+        return [day] if day else []
+    
+    parts = re.split(r'\s*[–\-]\s*', text)
+    if len(parts) > 2:
+        return None
+    first, last = normalize_day(parts[0]), normalize_day(parts[-1])
+    if not first or not last:
+        return None
+    start, end = DAY_ORDER.index(first), DAY_ORDER.index(last)
+    if start > end:
+        return None
+    return DAY_ORDER[start:end + 1]
+
+def parse_room_number(room):
+    """Числовая часть номера кабинета для сортировки"""
+    match = re.search(r'\d+', room)
+    return int(match.group()) if match else 999999
+
+def find_slot(day, period, occupancy):
+    """Находит номер слота по номеру урока (1, 2, ...) или времени (9.20, 9:20)"""
+    day_slots = occupancy['slots'].get(day, [])
+    period = period.strip()
+    
+    if re.match(r'^\d{1,2}$', period):
+        slot_num = int(period) - 1
+        if 0 <= slot_num < len(day_slots):
+            return slot_num
+        return None
+    
+    if re.match(r'^\d{1,2}[.:]\d{2}$', period):
+        minutes = parse_time(period)
+        for slot_num, slot_time in enumerate(day_slots):
+            start, end = parse_time_range(slot_time)
+            if start <= minutes < end:
+                return slot_num
+    
+    return None
+
+@metrics.timed('parser')
+def find_free_rooms(day_text, period):
+    """Свободные кабинеты в указанный день и урок
+    
+    Возвращает словарь с днём, временем слота и списком кабинетов
+    или None, если день или урок не найдены.
+    """
+    day = normalize_day(day_text)
+    if not day:
+        return None
+    
+    occupancy = get_room_occupancy()
+    slot_num = find_slot(day, period, occupancy)
+    if slot_num is None:
+        return None
+    
+    # Одна битовая операция вместо перебора всех уроков
+    free_mask = occupancy['all_rooms'] & ~occupancy['bitmap'][(day, slot_num)]
+    rooms = occupancy['rooms']
+    
+    return {
+        'day': day,
+        'time': occupancy['slots'][day][slot_num],
+        'rooms': [rooms[bit] for bit in range(len(rooms)) if free_mask >> bit & 1]
+    }
+
+def get_day_slots(day_text):
+    """Список временных слотов дня"""
+    day = normalize_day(day_text)
+    if not day:
+        return None, []
+    return day, get_room_occupancy()['slots'].get(day, [])
+
+@metrics.timed('render')
+def format_free_rooms(free_info):
+    """Форматирует список свободных кабинетов"""
+    day = escape_markdown(free_info['day'])
+    time_display = escape_markdown(free_info['time'].replace('–', '-'))
+    
+    if not free_info['rooms']:
+        return f"🚫 *{day}*, `{time_display}`: свободных кабинетов нет\\."
+    
+    result = f"🟢 *Свободные кабинеты — {day}, `{time_display}`:*\n\n"
+    result += ', '.join(escape_markdown(room) for room in free_info['rooms'])
+    result += f"\n\n📊 Всего свободно: {len(free_info['rooms'])}"
+    return result
+
+def reload_schedule(source=None):
+    """Перезагружает расписание (по умолчанию — текущего источника)"""
+    get_index(source).reset()
     return True
 
+def reload_changed_sources():
+    """Сбрасывает индексы, файлы которых с момента разбора заменил другой процесс
+    
+    Процессы-обработчики (см. workers.py) так подхватывают расписание,
+    скачанное соседним процессом, без повторной загрузки. Возвращает
+    имена сброшенных источников.
+    """
+    reloaded = []
+    for index in list(_indexes.values()):
+        if index.loaded and index.updated_at != _file_mtime(index.path):
+            index.reset()
+            reloaded.append(index.name)
+            metrics.inc('index_reloads', index.name)
+    
+    if reloaded:
+        logger.info(f"🔄 Файл расписания обновлён другим процессом: {', '.join(reloaded)}")
+    return reloaded
+
+def warm_up_index():
+    """Строит все индексы заранее, чтобы первые запросы не ждали разбора файла"""
+    if not has_schedule_file():
+        logger.info("📭 Файл расписания не найден, индекс не построен")
+        return False
+    
+    started = time.perf_counter()
+    lessons = get_all_lessons()
+    teacher_index = get_cached_teacher_index()
+    get_room_occupancy()
+    get_room_trie()
+    for day in DAY_ORDER:
+        get_day_shard(day)
+    logger.info(
+        f"✅ Индекс {current_source()} построен за {(time.perf_counter() - started) * 1000:.0f} мс: "
+        f"{len(lessons)} уроков, {len(teacher_index)} учителей"
+    )
+    return True
+
+def start_index_warmup(source=None):
+    """Запускает построение индекса в фоновом потоке"""
+    # Новый поток не наследует контекст, поэтому источник передаём явно
+    thread = threading.Thread(
+        target=_warm_up_safely, args=(source or current_source(),),
+        name='index-warmup', daemon=True
+    )
+    thread.start()
+    return thread
+
+def _warm_up_safely(source):
+    try:
+        with use_source(source):
+            warm_up_index()
+    except Exception as e:
+        logger.error(f"⚠️ Ошибка построения индекса: {e}")
+
 # ====== ЭКСПОРТ ФУНКЦИЙ ======
 __all__ = [
+    'Lesson',
+    'TeacherLesson',
+    'LessonTable',
+    'ScheduleIndex',
+    'DEFAULT_SOURCE',
+    'register_source',
+    'get_index',
+    'use_source',
+    'current_source',
+    'evict_idle_indexes',
+    'get_lesson_table',
+    'enable_mapped_index',
+    'find_lessons',
     'escape_markdown',
     'get_schedule_for_class',
     'get_schedule_for_class_all_positions',
@@ -634,9 +1533,24 @@ __all__ = [
     'format_teacher_schedule_old',
     'search_teachers_by_substring',
     'get_available_classes',
+    'get_selection_catalog',
     'has_schedule_file',
+    'schedule_updated_at',
     'get_cached_teacher_index',
     'reload_schedule',
+    'reload_changed_sources',
     'get_room_schedule',
-    'format_room_schedule'
+    'format_room_schedule',
+    'get_cached_room_index',
+    'get_room_trie',
+    'search_rooms_by_prefix',
+    'get_room_occupancy',
+    'find_free_rooms',
+    'get_day_slots',
+    'get_day_shard',
+    'day_of_date',
+    'parse_day_range',
+    'format_free_rooms',
+    'warm_up_index',
+    'start_index_warmup'
 ]
\ No newline at end of file
@@ -0,0 +1,130 @@
+"""Источники расписания (школы)
+
+Источник — это сайт школы, файл, в который сохраняется скачанное
+расписание, и период автообновления. Список задаётся переменной
+окружения SCHEDULE_SOURCES в формате JSON:
+
+    SCHEDULE_SOURCES='[
+        {"name": "school25", "title": "Школа №25", "url": "http://www.dnevnik25.ru/",
+         "path": "school_schedule.csv", "refresh_minutes": 60},
+        {"name": "lyceum", "title": "Лицей №1", "url": "http://lyceum1.example/",
+         "path": "lyceum1.csv", "refresh_minutes": 120}
+    ]'
+
+Без переменной бот работает с одной школой, как раньше: адрес по
+умолчанию из download_schedule и файл school_schedule.csv.
+"""
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOURCE = 'default'
+DEFAULT_PATH = 'school_schedule.csv'
+
+# 0 — обновление только по команде /update
+DEFAULT_REFRESH_MINUTES = 0
+
+SOURCE_NAME = re.compile(r'^[a-z0-9_\-]+$')
+
+_sources = {}  # имя -> источник (в порядке из конфигурации)
+
+def make_source(name, title=None, url=None, path=None, refresh_minutes=DEFAULT_REFRESH_MINUTES):
+    """Описание источника"""
+    return {
+        'name': name,
+        'title': title or name,
+        'url': url,
+        'path': path or f"{name}.csv",
+        'refresh_minutes': refresh_minutes
+    }
+
+def default_sources():
+    """Одна школа с прежними адресом и файлом"""
+    return [make_source(DEFAULT_SOURCE, title="Школа", path=DEFAULT_PATH)]
+
+def parse_sources(raw):
+    """Разбирает JSON со списком источников, при ошибке бросает ValueError"""
+    try:
+        items = json.loads(raw)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"некорректный JSON: {e}") from None
+    
+    if not isinstance(items, list) or not items:
+        raise ValueError("ожидается непустой список источников")
+    
+    sources = []
+    names = set()
+    paths = set()
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError(f"источник должен быть объектом: {item!r}")
+        
+        name = str(item.get('name', '')).strip().lower()
+        if not SOURCE_NAME.match(name):
+            raise ValueError(f"некорректное имя источника: {item.get('name')!r}")
+        if name in names:
+            raise ValueError(f"повторяется имя источника: {name}")
+        
+        try:
+            refresh_minutes = int(item.get('refresh_minutes', DEFAULT_REFRESH_MINUTES))
+        except (TypeError, ValueError):
+            raise ValueError(f"{name}: refresh_minutes должен быть числом") from None
+        
+        source = make_source(
+            name, title=item.get('title'), url=item.get('url'),
+            path=item.get('path'), refresh_minutes=max(0, refresh_minutes)
+        )
+        if source['path'] in paths:
+            raise ValueError(f"{name}: файл {source['path']} уже используется другим источником")
+        
+        names.add(name)
+        paths.add(source['path'])
+        sources.append(source)
+    
+    return sources
+
+def load_sources(raw=None):
+    """Загружает список источников (из SCHEDULE_SOURCES или по умолчанию)"""
+    sources = default_sources()
+    if raw:
+        try:
+            sources = parse_sources(raw)
+        except ValueError as e:
+            logger.error(f"❌ Ошибка в SCHEDULE_SOURCES: {e}, используется школа по умолчанию")
+    
+    _sources.clear()
+    for source in sources:
+        _sources[source['name']] = source
+    
+    if len(_sources) > 1:
+        logger.info(f"🏫 Источников расписания: {len(_sources)} ({', '.join(_sources)})")
+    return list(_sources.values())
+
+def list_sources():
+    """Все источники в порядке из конфигурации"""
+    if not _sources:
+        load_sources()
+    return list(_sources.values())
+
+def get_source(name):
+    """Источник по имени или None"""
+    if not _sources:
+        load_sources()
+    return _sources.get(name)
+
+def default_source_name():
+    """Источник, который используется, пока школа в чате не выбрана"""
+    return list_sources()[0]['name']
+
+def find_source(text):
+    """Ищет источник по имени или номеру в списке (как в /school)"""
+    text = (text or '').strip().lower()
+    sources = list_sources()
+    if text.isdigit() and 1 <= int(text) <= len(sources):
+        return sources[int(text) - 1]
+    for source in sources:
+        if text in (source['name'], source['title'].lower()):
+            return source
+    return None
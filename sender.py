@@ -0,0 +1,152 @@
+"""Очередь исходящих сообщений с ограничением скорости
+
+Telegram ограничивает рассылки: не больше ~30 сообщений в секунду на
+бота и ~1 сообщения в секунду в один чат, при превышении отвечает 429
+с retry_after. Сообщения рассылок (уведомления об изменениях, дайджесты)
+кладутся в очередь, а фоновый поток отправляет их с нужными паузами:
+    
+    outbox = RateLimitedSender(bot.send_message)
+    outbox.start()
+    outbox.send(chat_id, text, parse_mode='MarkdownV2')
+
+Ответы на команды пользователя по-прежнему отправляются напрямую.
+"""
+import collections
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Сообщений в секунду на бота (с запасом до лимита Telegram)
+GLOBAL_RATE = 25
+
+# Минимальный интервал между сообщениями в один чат, секунд
+PER_CHAT_INTERVAL = 1.0
+
+# Сколько раз повторять отправку при сетевой ошибке
+MAX_ATTEMPTS = 3
+
+class RateLimitedSender:
+    """Отправка сообщений из очереди с ограничением скорости"""
+    
+    def __init__(self, send_func, rate=GLOBAL_RATE, per_chat_interval=PER_CHAT_INTERVAL, on_blocked=None):
+        self.send_func = send_func
+        self.interval = 1.0 / rate
+        self.per_chat_interval = per_chat_interval
+        self.on_blocked = on_blocked  # вызывается с chat_id, если бот заблокирован
+        
+        self._condition = threading.Condition()
+        self._queue = collections.deque()  # (chat_id, text, kwargs, attempt)
+        self._delayed = []                 # куча (время готовности, порядковый номер, сообщение)
+        self._sequence = itertools.count()
+        self._chat_ready_at = {}           # chat_id -> когда можно писать в чат снова
+        self._next_send_at = 0.0
+        self._thread = None
+    
+    def start(self):
+        """Запускает поток отправки"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='sender', daemon=True)
+            self._thread.start()
+        return self
+    
+    def send(self, chat_id, text, **kwargs):
+        """Ставит сообщение в очередь"""
+        with self._condition:
+            self._queue.append((chat_id, text, kwargs, 1))
+            self._condition.notify()
+        metrics.inc('outbox', 'queued')
+    
+    def pending(self):
+        """Сколько сообщений ждёт отправки"""
+        with self._condition:
+            return len(self._queue) + len(self._delayed)
+    
+    def _next_message(self):
+        """Ждёт сообщение, в чат которого уже можно писать"""
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                
+                if self._delayed and self._delayed[0][0] <= now:
+                    message = heapq.heappop(self._delayed)[2]
+                elif self._queue:
+                    message = self._queue.popleft()
+                else:
+                    timeout = self._delayed[0][0] - now if self._delayed else None
+                    self._condition.wait(timeout)
+                    continue
+                
+                ready_at = self._chat_ready_at.get(message[0], 0)
+                if ready_at > now:
+                    # В этот чат писали меньше секунды назад — откладываем,
+                    # не задерживая сообщения в другие чаты
+                    heapq.heappush(self._delayed, (ready_at, next(self._sequence), message))
+                    continue
+                
+                return message
+    
+    def _mark_sent(self, chat_id):
+        """Запоминает, когда в чат снова можно писать"""
+        with self._condition:
+            now = time.monotonic()
+            self._chat_ready_at[chat_id] = now + self.per_chat_interval
+            if len(self._chat_ready_at) > 10000:
+                self._chat_ready_at = {
+                    chat: ready for chat, ready in self._chat_ready_at.items() if ready > now
+                }
+    
+    def _retry_later(self, message, delay):
+        with self._condition:
+            ready_at = time.monotonic() + delay
+            heapq.heappush(self._delayed, (ready_at, next(self._sequence), message))
+            self._condition.notify()
+    
+    def _run(self):
+        while True:
+            message = self._next_message()
+            
+            # Общий темп отправки
+            pause = self._next_send_at - time.monotonic()
+            if pause > 0:
+                time.sleep(pause)
+            self._next_send_at = time.monotonic() + self.interval
+            
+            self._mark_sent(message[0])
+            self._deliver(message)
+    
+    def _deliver(self, message):
+        chat_id, text, kwargs, attempt = message
+        try:
+            with metrics.timer('outbox', 'send'):
+                self.send_func(chat_id, text, **kwargs)
+            metrics.inc('outbox', 'sent')
+        except Exception as e:
+            error_code = getattr(e, 'error_code', None)
+            
+            if error_code == 429:
+                # Превышен лимит: Telegram говорит, сколько ждать
+                result = getattr(e, 'result_json', None) or {}
+                retry_after = result.get('parameters', {}).get('retry_after', 5)
+                logger.warning(f"⏳ Лимит Telegram, пауза {retry_after} с")
+                self._next_send_at = time.monotonic() + retry_after
+                self._retry_later(message, retry_after)
+                metrics.inc('outbox', 'throttled')
+            elif error_code == 403:
+                # Пользователь заблокировал бота
+                logger.info(f"🚫 Чат {chat_id} недоступен: {e}")
+                metrics.inc('outbox', 'blocked')
+                if self.on_blocked:
+                    self.on_blocked(chat_id)
+            elif error_code is None and attempt < MAX_ATTEMPTS:
+                # Сетевая ошибка — пробуем ещё раз позже
+                self._retry_later((chat_id, text, kwargs, attempt + 1), 2 ** attempt)
+                metrics.inc('outbox', 'retried')
+            else:
+                logger.error(f"❌ Не удалось отправить сообщение в чат {chat_id}: {e}")
+                metrics.inc('outbox', 'failed')
@@ -0,0 +1,66 @@
+"""Объединение одинаковых одновременных запросов (single-flight)
+
+После звонка десятки учеников одного класса одновременно спрашивают его
+расписание. Без объединения каждый поток заново собирает и форматирует
+один и тот же ответ. SingleFlight пропускает вычисление только для
+первого запроса с данным ключом, остальные ждут и получают тот же
+результат:
+
+    flight = SingleFlight('schedule')
+    text = flight.do(('default', 'class', '7А', version), compute)
+
+Ключ должен включать версию данных, иначе запрос, пришедший сразу после
+обновления расписания, получит ответ по старому файлу. Результат общий
+для всех ожидающих, поэтому он не должен изменяться (например, строка).
+"""
+import threading
+
+import metrics
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Одно вычисление на ключ среди одновременных вызовов"""
+    
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}  # ключ -> выполняющийся вызов
+    
+    def do(self, key, func):
+        """Возвращает func() или результат уже идущего вызова с тем же ключом"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        
+        if not leader:
+            metrics.inc('singleflight', f'{self.name}_coalesced')
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        
+        metrics.inc('singleflight', f'{self.name}_executed')
+        try:
+            call.result = func()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+    
+    def in_flight(self):
+        """Сколько вычислений идёт сейчас"""
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,151 @@
+"""Общее состояние чатов для нескольких процессов бота
+
+Пока бот работает одним процессом, состояния диалогов, выбранная школа и
+последний найденный класс хранятся в обычных словарях. Процессы-обработчики
+(см. workers.py) не видят словарей друг друга, поэтому в многопроцессном
+режиме эти словари заменяются на SharedDict — словарь поверх одной
+таблицы SQLite в режиме WAL: чтения не блокируют запись, а запись одного
+ключа — это одна короткая транзакция.
+
+    store = StateStore('bot_state.sqlite3')
+    user_states = store.mapping('user_states')
+    user_states[chat_id] = 'waiting_for_class'
+
+Подписки и дайджесты остаются в своих JSON-файлах: процессы изменяют их
+под файловой блокировкой (file_lock) и перечитывают, если файл изменил
+другой процесс (file_stamp).
+"""
+import collections.abc
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: несколько процессов не поддерживаются
+    fcntl = None
+
+DEFAULT_PATH = 'bot_state.sqlite3'
+
+_MISSING = object()
+
+class StateStore:
+    """Таблица (пространство имён, ключ) -> значение в JSON"""
+    
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS state ('
+                'namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, '
+                'PRIMARY KEY (namespace, key)) WITHOUT ROWID'
+            )
+    
+    def _connection(self):
+        """Соединение текущего потока (после fork открывается новое)"""
+        entry = getattr(self._local, 'entry', None)
+        if entry is None or entry[0] != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            entry = self._local.entry = (os.getpid(), connection)
+        return entry[1]
+    
+    def get(self, namespace, key, default=None):
+        row = self._connection().execute(
+            'SELECT value FROM state WHERE namespace = ? AND key = ?', (namespace, json.dumps(key))
+        ).fetchone()
+        return json.loads(row[0]) if row else default
+    
+    def set(self, namespace, key, value):
+        self._connection().execute(
+            'INSERT OR REPLACE INTO state (namespace, key, value) VALUES (?, ?, ?)',
+            (namespace, json.dumps(key), json.dumps(value, ensure_ascii=False))
+        )
+    
+    def delete(self, namespace, key):
+        """Удаляет ключ, возвращает False, если его не было"""
+        cursor = self._connection().execute(
+            'DELETE FROM state WHERE namespace = ? AND key = ?', (namespace, json.dumps(key))
+        )
+        return cursor.rowcount > 0
+    
+    def keys(self, namespace):
+        rows = self._connection().execute('SELECT key FROM state WHERE namespace = ?', (namespace,))
+        return [json.loads(row[0]) for row in rows]
+    
+    def count(self, namespace):
+        return self._connection().execute(
+            'SELECT COUNT(*) FROM state WHERE namespace = ?', (namespace,)
+        ).fetchone()[0]
+    
+    def clear(self, namespace):
+        self._connection().execute('DELETE FROM state WHERE namespace = ?', (namespace,))
+    
+    def mapping(self, namespace):
+        """Словарь поверх пространства имён"""
+        return SharedDict(self, namespace)
+
+class SharedDict(collections.abc.MutableMapping):
+    """Словарь, общий для всех процессов (значения — JSON: кортежи читаются списками)"""
+    
+    def __init__(self, store, namespace):
+        self.store = store
+        self.namespace = namespace
+    
+    def __getitem__(self, key):
+        value = self.store.get(self.namespace, key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+    
+    def get(self, key, default=None):
+        return self.store.get(self.namespace, key, default)
+    
+    def __setitem__(self, key, value):
+        self.store.set(self.namespace, key, value)
+    
+    def __delitem__(self, key):
+        if not self.store.delete(self.namespace, key):
+            raise KeyError(key)
+    
+    def __contains__(self, key):
+        return self.store.get(self.namespace, key, _MISSING) is not _MISSING
+    
+    def __iter__(self):
+        return iter(self.store.keys(self.namespace))
+    
+    def __len__(self):
+        return self.store.count(self.namespace)
+    
+    def clear(self):
+        self.store.clear(self.namespace)
+
+# ====== ОБЩИЕ ФАЙЛЫ ======
+
+def file_stamp(path):
+    """Отпечаток файла или None — чтобы заметить, что его перезаписал другой процесс
+    
+    Файлы сохраняются через os.replace, поэтому каждая запись меняет inode.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Блокировка файла path между процессами (рядом создаётся path.lock)"""
+    if fcntl is None:
+        yield
+        return
+    with open(f"{path}.lock", 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,362 @@
+"""Подписки на изменения расписания
+
+Подписка — это пара (чат, сущность), где сущность — класс, учитель или
+кабинет в конкретной школе: ('default', 'class', '5А'). Хранилище держит
+два индекса — по сущности и по чату. После обновления расписания строки
+двух таблиц сравниваются один раз, и из изменившихся строк берутся
+ключи классов, учителей и кабинетов. Уроки сравниваются и сообщение
+строится только для подписанных сущностей из этого набора — один раз на
+сущность, затем оно рассылается её подписчикам. Работа растёт с числом
+изменившихся сущностей, а не с числом подписок.
+"""
+import contextlib
+import json
+import logging
+import operator
+import os
+import threading
+
+import metrics
+import state_store
+from schedule_parser import (
+    escape_markdown, normalize_name, split_by_slash, get_classroom_for_teacher,
+    get_lesson_table, parse_time, DAY_ORDER, DAY_ABBREVIATIONS, LESSON_FIELDS
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH = 'subscriptions.json'
+
+# Вид сущности -> поле колоночной таблицы уроков
+KIND_FIELDS = {'class': 'class_name', 'teacher': 'teacher', 'room': 'classroom'}
+KIND_TITLES = {'class': 'класс', 'teacher': 'учитель', 'room': 'кабинет'}
+KIND_ALIASES = {
+    'класс': 'class', 'class': 'class',
+    'учитель': 'teacher', 'учителя': 'teacher', 'teacher': 'teacher',
+    'кабинет': 'room', 'каб': 'room', 'room': 'room'
+}
+
+# Сколько изменений показывать в одном уведомлении
+MAX_CHANGES_IN_MESSAGE = 10
+
+DAY_SHORT = {day: short for short, day in DAY_ABBREVIATIONS.items()}
+
+# ====== ХРАНИЛИЩЕ ======
+
+class SubscriptionStore:
+    """Подписки, проиндексированные по сущности и по чату"""
+    
+    def __init__(self, path=DEFAULT_PATH, shared=False):
+        self.path = path
+        self.shared = shared  # файл изменяют несколько процессов (см. workers.py)
+        self._lock = threading.Lock()
+        self._by_entity = {}  # (источник, вид, ключ) -> {chat_id}
+        self._by_chat = {}    # chat_id -> {(источник, вид, ключ)}
+        self._names = {}      # (источник, вид, ключ) -> название для сообщений
+        self._stamp = None    # отпечаток файла, из которого прочитаны подписки
+    
+    def load(self):
+        """Загружает подписки из файла"""
+        with self._lock:
+            count = self._read()
+        if count is not None:
+            logger.info(f"🔔 Загружено подписок: {count}")
+        return self
+    
+    def _read(self):
+        """Перечитывает файл (вызывается под блокировкой), возвращает число подписок"""
+        stamp = state_store.file_stamp(self.path)
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                items = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.error(f"❌ Не удалось прочитать подписки {self.path}: {e}")
+            return None
+        
+        self._by_entity.clear()
+        self._by_chat.clear()
+        self._names.clear()
+        for item in items:
+            self._add(item['chat_id'], item['source'], item['kind'], item['name'])
+        self._stamp = stamp
+        return len(items)
+    
+    @contextlib.contextmanager
+    def _locked(self, write=False):
+        """Блокировка; в общем режиме — ещё и между процессами с перечитыванием файла"""
+        with self._lock:
+            if not self.shared:
+                yield
+                return
+            with state_store.file_lock(self.path) if write else contextlib.nullcontext():
+                if state_store.file_stamp(self.path) != self._stamp:
+                    self._read()
+                yield
+    
+    def _save(self):
+        """Сохраняет подписки (вызывается под блокировкой)"""
+        items = [
+            {'chat_id': chat_id, 'source': entity[0], 'kind': entity[1], 'name': self._names[entity]}
+            for chat_id, entities in self._by_chat.items()
+            for entity in sorted(entities)
+        ]
+        temp_path = f"{self.path}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(items, f, ensure_ascii=False)
+            os.replace(temp_path, self.path)
+            self._stamp = state_store.file_stamp(self.path)
+        except OSError as e:
+            logger.error(f"❌ Не удалось сохранить подписки {self.path}: {e}")
+    
+    def _add(self, chat_id, source, kind, name):
+        entity = (source, kind, normalize_name(name))
+        chats = self._by_entity.setdefault(entity, set())
+        if chat_id in chats:
+            return False
+        chats.add(chat_id)
+        self._by_chat.setdefault(chat_id, set()).add(entity)
+        self._names.setdefault(entity, name)
+        return True
+    
+    def _discard(self, chat_id, entity):
+        chats = self._by_entity.get(entity)
+        if not chats or chat_id not in chats:
+            return False
+        chats.discard(chat_id)
+        if not chats:
+            del self._by_entity[entity]
+            self._names.pop(entity, None)
+        
+        entities = self._by_chat[chat_id]
+        entities.discard(entity)
+        if not entities:
+            del self._by_chat[chat_id]
+        return True
+    
+    def add(self, chat_id, source, kind, name):
+        """Подписывает чат, возвращает False, если подписка уже была"""
+        with self._locked(write=True):
+            added = self._add(chat_id, source, kind, name)
+            if added:
+                self._save()
+        return added
+    
+    def remove(self, chat_id, source, kind, name):
+        """Отписывает чат от сущности"""
+        with self._locked(write=True):
+            removed = self._discard(chat_id, (source, kind, normalize_name(name)))
+            if removed:
+                self._save()
+        return removed
+    
+    def remove_chat(self, chat_id):
+        """Удаляет все подписки чата (например, если бот заблокирован)"""
+        with self._locked(write=True):
+            entities = list(self._by_chat.get(chat_id, ()))
+            for entity in entities:
+                self._discard(chat_id, entity)
+            if entities:
+                self._save()
+        return len(entities)
+    
+    def for_chat(self, chat_id):
+        """Подписки чата: список (источник, вид, название)"""
+        with self._locked():
+            return sorted(
+                (entity[0], entity[1], self._names[entity])
+                for entity in self._by_chat.get(chat_id, ())
+            )
+    
+    def entities(self, source):
+        """Сущности источника, на которые есть подписки: {(вид, ключ): название}"""
+        with self._locked():
+            return {
+                (kind, key): self._names[(entity_source, kind, key)]
+                for entity_source, kind, key in self._by_entity
+                if entity_source == source
+            }
+    
+    def subscribed(self, source, keys_by_kind):
+        """Сущности из keys_by_kind ({вид: {ключ}}), на которые есть подписки:
+        {(вид, ключ): (название, {chat_id})} — поиск по индексу, без обхода всех подписок"""
+        with self._locked():
+            result = {}
+            for kind, keys in keys_by_kind.items():
+                for key in keys:
+                    entity = (source, kind, key)
+                    chats = self._by_entity.get(entity)
+                    if chats:
+                        result[(kind, key)] = (self._names[entity], set(chats))
+            return result
+    
+    def subscribers(self, source, kind, key):
+        """Чаты, подписанные на сущность"""
+        with self._locked():
+            return set(self._by_entity.get((source, kind, key), ()))
+    
+    def has_source(self, source):
+        """Есть ли подписки на сущности источника"""
+        with self._locked():
+            return any(entity[0] == source for entity in self._by_entity)
+    
+    def __len__(self):
+        with self._locked():
+            return sum(len(chats) for chats in self._by_entity.values())
+
+# ====== СУЩНОСТИ ======
+
+def resolve_entity(text):
+    """Определяет сущность по тексту команды: '5А', 'кабинет 243', 'учитель Иванов'
+    
+    Возвращает (вид, название как в расписании) или None.
+    """
+    words = (text or '').split(maxsplit=1)
+    if not words:
+        return None
+    
+    kind = None
+    name = text.strip()
+    if len(words) == 2 and words[0].lower().rstrip('.') in KIND_ALIASES:
+        kind = KIND_ALIASES[words[0].lower().rstrip('.')]
+        name = words[1].strip()
+    
+    key = normalize_name(name)
+    table = get_lesson_table()
+    for candidate in ([kind] if kind else ['class', 'room', 'teacher']):
+        rows = table.postings[KIND_FIELDS[candidate]].get(key)
+        if rows:
+            return candidate, _display_name(table, candidate, key, rows[0])
+    return None
+
+def _display_name(table, kind, key, row):
+    """Название сущности так, как оно записано в расписании"""
+    value = table.value(KIND_FIELDS[kind], row)
+    if kind == 'class':
+        return value
+    for part in split_by_slash(value):
+        if normalize_name(part) == key:
+            return part
+    return value
+
+def entity_lessons(table, kind, key):
+    """Уроки сущности: множество (день, время, предмет, учитель, кабинет, класс)"""
+    lessons = set()
+    if table is None:
+        return lessons
+    
+    all_lessons = table.lessons
+    for row in table.postings[KIND_FIELDS[kind]].get(key, ()):
+        lesson = all_lessons[row]
+        teacher, classroom = lesson.teacher, lesson.classroom
+        
+        if kind == 'teacher':
+            # Для составного урока — свой кабинет учителя
+            parts = split_by_slash(teacher)
+            for teacher_index, part in enumerate(parts):
+                if normalize_name(part) == key:
+                    teacher = part
+                    classroom = get_classroom_for_teacher(classroom, teacher_index, len(parts))
+                    break
+        
+        lessons.add((lesson.day, lesson.time, lesson.subject, teacher, classroom, lesson.class_name))
+    return lessons
+
+_lesson_values = operator.attrgetter(*LESSON_FIELDS)
+
+def changed_keys(old_table, new_table):
+    """Ключи сущностей, у которых изменился хотя бы один урок: {вид: {ключ}}
+    
+    Таблицы сравниваются построчно один раз, без обхода уроков каждой сущности:
+    строки прежней таблицы собираются в множество, а строки новой вычёркиваются
+    из него — что осталось в нём или не нашлось в нём, и есть изменения.
+    """
+    old_rows = {_lesson_values(lesson) for lesson in old_table.lessons} if old_table is not None else set()
+    changed_rows = []
+    for lesson in (new_table.lessons if new_table is not None else ()):
+        row = _lesson_values(lesson)
+        if row in old_rows:
+            old_rows.discard(row)
+        else:
+            changed_rows.append(row)
+    changed_rows.extend(old_rows)
+    
+    keys = {kind: set() for kind in KIND_FIELDS}
+    for row in changed_rows:
+        values = dict(zip(LESSON_FIELDS, row))
+        keys['class'].add(normalize_name(values['class_name']))
+        keys['teacher'].update(normalize_name(part) for part in split_by_slash(values['teacher']))
+        keys['room'].update(normalize_name(part) for part in split_by_slash(values['classroom']))
+    
+    for kind_keys in keys.values():
+        kind_keys.discard('')
+    return keys
+
+# ====== УВЕДОМЛЕНИЯ ======
+
+def _lesson_sort_key(lesson):
+    day = lesson[0]
+    return (DAY_ORDER.index(day) if day in DAY_ORDER else 999, parse_time(lesson[1]), lesson[5])
+
+def _format_lesson(kind, lesson):
+    day, time_str, subject, teacher, classroom, class_name = lesson
+    when = f"{DAY_SHORT.get(day, day)} {time_str.replace('–', '-')}"
+    
+    details = [subject]
+    if kind != 'class' and class_name:
+        details.append(class_name)
+    if kind != 'teacher' and teacher:
+        details.append(teacher)
+    if kind != 'room' and classroom:
+        details.append(f"каб. {classroom}")
+    
+    return f"`{escape_markdown(when)}` {escape_markdown(', '.join(item for item in details if item))}"
+
+def format_changes(kind, name, removed, added, source_title=None):
+    """Компактное сообщение об изменениях в расписании сущности"""
+    title = f"{KIND_TITLES[kind]} {name}"
+    if source_title:
+        title += f" ({source_title})"
+    
+    changes = sorted(
+        [(lesson, '➖') for lesson in removed] + [(lesson, '➕') for lesson in added],
+        key=lambda item: (_lesson_sort_key(item[0]), item[1] == '➕')
+    )
+    
+    result = f"🔔 *Изменения в расписании: {escape_markdown(title)}*\n\n"
+    for lesson, mark in changes[:MAX_CHANGES_IN_MESSAGE]:
+        result += f"{mark} {_format_lesson(kind, lesson)}\n"
+    
+    if len(changes) > MAX_CHANGES_IN_MESSAGE:
+        result += f"_\\.\\.\\. и ещё {len(changes) - MAX_CHANGES_IN_MESSAGE}_\n"
+    return result
+
+def notify_changes(store, source, old_table, new_table, send, source_title=None):
+    """Сравнивает уроки подписанных сущностей и рассылает изменения
+    
+    send(chat_id, text, **kwargs) — обычно RateLimitedSender.send.
+    Возвращает (число изменившихся сущностей, число сообщений).
+    """
+    changed = 0
+    messages = 0
+    
+    # Обходятся только изменившиеся сущности, подписчики берутся из индекса
+    for (kind, key), (name, chats) in store.subscribed(source, changed_keys(old_table, new_table)).items():
+        old_lessons = entity_lessons(old_table, kind, key)
+        new_lessons = entity_lessons(new_table, kind, key)
+        if old_lessons == new_lessons:
+            continue
+        
+        changed += 1
+        text = format_changes(kind, name, old_lessons - new_lessons, new_lessons - old_lessons, source_title)
+        for chat_id in chats:
+            send(chat_id, text, parse_mode='MarkdownV2')
+            messages += 1
+    
+    metrics.inc('notifications', 'entities', changed)
+    metrics.inc('notifications', 'messages', messages)
+    if changed:
+        logger.info(f"🔔 {source}: изменилось {changed} сущностей, отправлено уведомлений: {messages}")
+    return changed, messages
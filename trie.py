@@ -0,0 +1,84 @@
+"""Префиксное дерево (trie) для словарей расписания
+
+Ключ — любая последовательность: строка (по символам) или кортеж токенов.
+Поиск самого длинного совпадения с позиции в тексте стоит O(длины
+совпадения) и не зависит от размера словаря, поэтому распознавание
+запроса не перебирает классы, учителей и кабинеты по одному.
+
+    names = Trie()
+    names.insert(('9', 'А'), ('class', '9А'))
+    names.longest_match(['9', 'А', 'ЗАВТРА'], 0)  # -> (2, [('class', '9А')])
+"""
+
+class Trie:
+    """Префиксное дерево: ключ-последовательность -> список значений"""
+    
+    __slots__ = ('_root', '_size')
+    
+    def __init__(self):
+        # Узел — пара [потомки, значения]; значения — None, пока их нет
+        self._root = [{}, None]
+        self._size = 0
+    
+    def __len__(self):
+        return self._size
+    
+    def insert(self, key, value):
+        """Добавляет значение по ключу (по одному ключу может быть несколько значений)"""
+        node = self._root
+        for item in key:
+            children = node[0]
+            child = children.get(item)
+            if child is None:
+                child = children[item] = [{}, None]
+            node = child
+        if node[1] is None:
+            node[1] = []
+        if value not in node[1]:
+            node[1].append(value)
+            self._size += 1
+    
+    def _find(self, key):
+        node = self._root
+        for item in key:
+            node = node[0].get(item)
+            if node is None:
+                return None
+        return node
+    
+    def get(self, key):
+        """Значения по точному ключу"""
+        node = self._find(key)
+        return list(node[1]) if node is not None and node[1] else []
+    
+    def longest_match(self, sequence, start=0):
+        """Самый длинный ключ, с которого начинается sequence[start:]
+        
+        Возвращает (длина, значения) или (0, []), если совпадений нет.
+        """
+        node = self._root
+        best_length, best_values = 0, []
+        for position in range(start, len(sequence)):
+            node = node[0].get(sequence[position])
+            if node is None:
+                break
+            if node[1]:
+                best_length, best_values = position - start + 1, node[1]
+        return best_length, list(best_values)
+    
+    def with_prefix(self, prefix, limit=None):
+        """Значения всех ключей, начинающихся с prefix (в порядке вставки потомков)"""
+        node = self._find(prefix)
+        if node is None:
+            return []
+        
+        values = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node[1]:
+                values.extend(node[1])
+                if limit is not None and len(values) >= limit:
+                    return values[:limit]
+            stack.extend(reversed(list(node[0].values())))
+        return values
@@ -0,0 +1,324 @@
+"""История версий файла расписания
+
+Каждое обновление перезаписывает school_schedule.csv, поэтому без истории
+нельзя ответить, каким было расписание в прошлый вторник, или найти,
+после какого файла сломался разбор. VersionStore сохраняет каждую
+отличающуюся версию файла:
+
+    schedule_history/
+        objects/3f/3fa2…       — секция одного дня (сжатая), имя — SHA-256 содержимого
+        default/20261019-073000-3fa2c1d0.json  — версия: время, хэш, список секций
+
+Файл режется на секции по заголовкам "РАСПИСАНИЕ НА …", а секция хранится
+под хэшем своего содержимого. Если в новой версии поменялась только среда,
+на диск записывается одна секция, остальные дни берутся из прошлых версий.
+
+Версии старше KEEP_DAYS удаляются, из более старых, чем KEEP_LAST
+последних, остаётся по одной за день; секции, на которые больше не
+ссылается ни одна версия, удаляются вместе с ними.
+
+Любую версию можно открыть как отдельный источник расписания со своим
+индексом (он выгружается из памяти, как индексы школ, когда не нужен):
+
+    with store.use_version('default', version_id):
+        get_schedule_for_class('5А')
+"""
+import bisect
+import contextlib
+import datetime
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+
+import metrics
+import state_store
+from schedule_parser import find_schedule_headers, register_source, unregister_source, use_source
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIR = 'schedule_history'
+
+# Все версии за последние KEEP_LAST обновлений, старше — по одной за день,
+# старше KEEP_DAYS дней — удаляются
+KEEP_LAST = 30
+KEEP_DAYS = 180
+
+VERSION_NAME = re.compile(r'^\d{8}-\d{6}-[0-9a-f]{8}$')
+
+def split_sections(content):
+    """Делит файл (bytes) на секции по заголовкам дней"""
+    lines = content.decode('utf-8').splitlines(keepends=True)
+    starts = [header['line_num'] for header in find_schedule_headers(lines)[:-1]]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)  # строки до первого заголовка — отдельная секция
+    bounds = starts + [len(lines)]
+    return [
+        ''.join(lines[start:end]).encode('utf-8')
+        for start, end in zip(bounds, bounds[1:])
+        if end > start
+    ]
+
+class VersionStore:
+    """Версии файлов расписания с общим хранилищем секций"""
+    
+    def __init__(self, directory=DEFAULT_DIR, keep_last=KEEP_LAST, keep_days=KEEP_DAYS):
+        self.directory = directory
+        self.keep_last = keep_last
+        self.keep_days = keep_days
+        self._lock = threading.RLock()
+        self._versions = {}  # источник -> [версия] по времени сохранения
+        self._stamps = {}    # источник -> отпечаток каталога, из которого прочитаны версии
+        metrics.register_gauge('history_versions', self.stats)
+    
+    # ====== ФАЙЛЫ ======
+    
+    def _source_dir(self, source):
+        return os.path.join(self.directory, source)
+    
+    def _object_path(self, digest):
+        return os.path.join(self.directory, 'objects', digest[:2], digest)
+    
+    def _manifest_path(self, source, version_id):
+        return os.path.join(self._source_dir(source), f"{version_id}.json")
+    
+    def _checkout_path(self, source, version_id):
+        return os.path.join(self.directory, 'checkout', source, f"{version_id}.csv")
+    
+    @staticmethod
+    def _index_name(source, version_id):
+        return f"{source}@{version_id}"
+    
+    @staticmethod
+    def _write_atomic(path, content):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(content)
+        os.replace(temp_path, path)
+    
+    def _put_object(self, content):
+        """Сохраняет секцию, если её ещё нет, и возвращает её хэш"""
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._object_path(digest)
+        if os.path.exists(path):
+            metrics.inc('history', 'sections_reused')
+        else:
+            self._write_atomic(path, zlib.compress(content, 6))
+            metrics.inc('history', 'sections_written')
+        return digest
+    
+    def _get_object(self, digest):
+        with open(self._object_path(digest), 'rb') as f:
+            return zlib.decompress(f.read())
+    
+    @contextlib.contextmanager
+    def _locked(self):
+        """Блокировка записи, в том числе между процессами (см. workers.py):
+        иначе сборка мусора в одном процессе удалит секции, которые другой
+        только что записал, но ещё не сослался на них из версии"""
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with state_store.file_lock(self.directory):
+                yield
+    
+    # ====== КАТАЛОГ ВЕРСИЙ ======
+    
+    def versions(self, source):
+        """Версии источника по возрастанию времени: список словарей
+        
+        Каталог перечитывается, если в нём появились или пропали версии
+        (например, их сохранил другой процесс, см. workers.py).
+        """
+        with self._lock:
+            versions = self._versions.get(source)
+            stamp = state_store.file_stamp(self._source_dir(source))
+            if versions is None or stamp != self._stamps.get(source):
+                versions = self._versions[source] = self._load_versions(source)
+                self._stamps[source] = stamp
+            return list(versions)
+    
+    def _load_versions(self, source):
+        directory = self._source_dir(source)
+        versions = []
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return versions
+        
+        for name in names:
+            version_id, extension = os.path.splitext(name)
+            if extension != '.json' or not VERSION_NAME.match(version_id):
+                continue
+            try:
+                with open(os.path.join(directory, name), 'r', encoding='utf-8') as f:
+                    versions.append(json.load(f))
+            except (OSError, ValueError) as e:
+                logger.error(f"❌ Не удалось прочитать версию {name}: {e}")
+        
+        versions.sort(key=lambda version: version['saved_at'])
+        return versions
+    
+    def get(self, source, version_id):
+        """Версия по id или None"""
+        for version in self.versions(source):
+            if version['id'] == version_id:
+                return version
+        return None
+    
+    def version_at(self, source, moment):
+        """Версия, действовавшая в момент moment (datetime или timestamp), или None"""
+        if isinstance(moment, datetime.datetime):
+            moment = moment.timestamp()
+        versions = self.versions(source)
+        position = bisect.bisect_right([version['saved_at'] for version in versions], moment)
+        return versions[position - 1] if position else None
+    
+    # ====== СОХРАНЕНИЕ ======
+    
+    def save(self, source, path, saved_at=None):
+        """Сохраняет файл как новую версию источника
+        
+        Возвращает версию или None, если файл не изменился с прошлой.
+        """
+        with open(path, 'rb') as f:
+            content = f.read()
+        file_digest = hashlib.sha256(content).hexdigest()
+        saved_at = saved_at or time.time()
+        
+        with self._locked():
+            versions = self.versions(source)
+            if versions and versions[-1]['sha256'] == file_digest:
+                return None
+            
+            sections = [self._put_object(section) for section in split_sections(content)]
+            version_id = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(saved_at))}-{file_digest[:8]}"
+            version = {
+                'id': version_id,
+                'saved_at': saved_at,
+                'sha256': file_digest,
+                'size': len(content),
+                'sections': sections
+            }
+            self._write_atomic(
+                self._manifest_path(source, version_id),
+                json.dumps(version, ensure_ascii=False).encode('utf-8')
+            )
+            self._versions[source] = versions + [version]
+            self._stamps[source] = state_store.file_stamp(self._source_dir(source))
+            
+            new_sections = len(set(sections) - {
+                digest for old in versions[-1:] for digest in old['sections']
+            })
+            logger.info(
+                f"🗂 Версия расписания {source} {version_id}: "
+                f"новых секций {new_sections} из {len(sections)}"
+            )
+            self._prune(source, time.time())
+            return version
+    
+    # ====== ЧТЕНИЕ ======
+    
+    def read(self, source, version_id):
+        """Содержимое файла версии (bytes)"""
+        version = self.get(source, version_id)
+        if version is None:
+            raise KeyError(f"Нет версии {version_id} у {source}")
+        content = b''.join(self._get_object(digest) for digest in version['sections'])
+        if hashlib.sha256(content).hexdigest() != version['sha256']:
+            raise ValueError(f"Версия {version_id} повреждена")
+        return content
+    
+    def checkout(self, source, version_id):
+        """Путь к файлу версии (собирается из секций один раз)"""
+        path = self._checkout_path(source, version_id)
+        if not os.path.exists(path):
+            self._write_atomic(path, self.read(source, version_id))
+        return path
+    
+    def open_index(self, source, version_id):
+        """Регистрирует версию как источник расписания и возвращает его имя"""
+        name = self._index_name(source, version_id)
+        register_source(name, self.checkout(source, version_id))
+        return name
+    
+    @contextlib.contextmanager
+    def use_version(self, source, version_id):
+        """Запросы к парсеру внутри блока идут к версии version_id"""
+        with use_source(self.open_index(source, version_id)) as index:
+            yield index
+    
+    # ====== ХРАНЕНИЕ ======
+    
+    def _expired(self, versions, now):
+        """Версии, которые удаляются по правилам хранения"""
+        expired = []
+        kept_days = set()
+        older = versions[:-self.keep_last] if self.keep_last else versions
+        for version in reversed(older):
+            if now - version['saved_at'] > self.keep_days * 86400:
+                expired.append(version)
+                continue
+            day = time.strftime('%Y-%m-%d', time.localtime(version['saved_at']))
+            if day in kept_days:
+                expired.append(version)
+            else:
+                kept_days.add(day)
+        return expired
+    
+    def prune(self, source, now=None):
+        """Удаляет лишние версии источника и секции без ссылок"""
+        with self._locked():
+            return self._prune(source, now or time.time())
+    
+    def _prune(self, source, now):
+        """prune() под блокировкой"""
+        versions = self.versions(source)
+        expired = self._expired(versions, now)
+        if not expired:
+            return 0
+        
+        expired_ids = {version['id'] for version in expired}
+        for version_id in expired_ids:
+            checkout_path = self._checkout_path(source, version_id)
+            for path in (self._manifest_path(source, version_id), checkout_path, f"{checkout_path}.idx"):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+            unregister_source(self._index_name(source, version_id))
+        self._versions[source] = [version for version in versions if version['id'] not in expired_ids]
+        self._stamps[source] = state_store.file_stamp(self._source_dir(source))
+        
+        removed = self._collect_garbage()
+        logger.info(f"🧹 Удалено версий {source}: {len(expired_ids)}, секций: {removed}")
+        return len(expired_ids)
+    
+    def _collect_garbage(self):
+        """Удаляет секции, на которые не ссылается ни одна версия"""
+        sources = [
+            name for name in os.listdir(self.directory)
+            if name not in ('objects', 'checkout') and os.path.isdir(os.path.join(self.directory, name))
+        ]
+        referenced = {
+            digest
+            for source in sources
+            for version in self.versions(source)
+            for digest in version['sections']
+        }
+        
+        removed = 0
+        objects_dir = os.path.join(self.directory, 'objects')
+        for prefix in os.listdir(objects_dir):
+            for digest in os.listdir(os.path.join(objects_dir, prefix)):
+                if digest not in referenced and not digest.endswith('.tmp'):
+                    os.remove(os.path.join(objects_dir, prefix, digest))
+                    removed += 1
+        return removed
+    
+    def stats(self):
+        """{источник: число версий} по загруженным каталогам"""
+        with self._lock:
+            return {source: len(versions) for source, versions in self._versions.items()}
@@ -0,0 +1,199 @@
+"""Несколько процессов-обработчиков (WORKERS > 1)
+
+Разбор и рендеринг расписания упираются в GIL: сколько потоков ни дай
+одному процессу, расписание считает одно ядро. В многопроцессном режиме
+главный процесс только забирает обновления из getUpdates (диспетчер) и
+раскладывает их по очередям процессов-обработчиков:
+
+    диспетчер: getUpdates -> chat_id % WORKERS -> очередь процесса
+    обработчик: chat_id // WORKERS % WORKER_THREADS -> очередь потока -> обработчики бота
+
+Все обновления одного чата попадают в один процесс и в один поток внутри
+него и обрабатываются по одному, поэтому ответы приходят в том же
+порядке, что и сообщения. Потоки внутри процесса нужны, чтобы ожидание
+ответа Telegram в одном чате не задерживало остальные.
+
+Процессы создаются через fork после построения индекса и получают его
+готовым. Таблица уроков при этом читается из скомпилированного файла
+через mmap (mapped_index.py), поэтому все процессы делят одну её копию.
+Если какой-то процесс скачал новое расписание, остальные замечают новый
+файл и открывают новую версию индекса без повторной загрузки
+(reload_changed_sources).
+
+Состояния диалогов — в SQLite (state_store.py), подписки и дайджесты —
+в общих файлах с блокировкой. Автообновление, дайджесты и эндпоинт
+метрик работают только в главном процессе; /metrics в чате показывает
+метрики процесса, который обработал команду.
+"""
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+import zlib
+
+from telebot import apihelper, types
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Обновлений в очереди одного процесса, после которых диспетчер ждёт
+QUEUE_SIZE = 1000
+
+# Как часто обработчик проверяет, не обновился ли файл расписания, секунд
+RELOAD_CHECK_INTERVAL = 1.0
+
+def update_chat_id(update):
+    """chat_id обновления (словарь из getUpdates) или None"""
+    for field in ('message', 'edited_message', 'channel_post', 'edited_channel_post',
+                  'my_chat_member', 'chat_member', 'chat_join_request'):
+        item = update.get(field)
+        if item:
+            return item['chat']['id']
+    callback_query = update.get('callback_query')
+    if callback_query:
+        message = callback_query.get('message')
+        return message['chat']['id'] if message else callback_query['from']['id']
+    for field in ('inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query', 'poll_answer'):
+        item = update.get(field)
+        if item and 'from' in item:
+            return item['from']['id']
+    return None
+
+def partition(chat_id, count):
+    """Номер очереди для чата: один чат — всегда одна очередь"""
+    if chat_id is None:
+        return 0
+    if not isinstance(chat_id, int):
+        chat_id = zlib.crc32(str(chat_id).encode('utf-8'))
+    return chat_id % count
+
+class WorkerPool:
+    """Диспетчер обновлений и процессы-обработчики"""
+    
+    def __init__(self, telebot_instance, processes, threads=4, before_update=None, on_start=None):
+        self.bot = telebot_instance
+        self.processes = processes
+        self.threads = threads
+        self.before_update = before_update  # проверка перед обновлением (не чаще RELOAD_CHECK_INTERVAL)
+        self.on_start = on_start            # вызывается в каждом процессе-обработчике при запуске
+        self._context = multiprocessing.get_context('fork')
+        self._queues = []
+        self._workers = []
+        self._stop = threading.Event()
+    
+    # ====== ПРОЦЕССЫ ======
+    
+    def start(self):
+        """Запускает процессы-обработчики (до запуска фоновых потоков главного процесса)"""
+        self._queues = [self._context.Queue(QUEUE_SIZE) for _ in range(self.processes)]
+        self._workers = [self._spawn(number) for number in range(self.processes)]
+        logger.info(f"👷 Запущено процессов-обработчиков: {self.processes} по {self.threads} потоков")
+        return self
+    
+    def _spawn(self, number):
+        process = self._context.Process(
+            target=_worker_main, name=f"worker-{number}", daemon=True,
+            args=(number, self.processes, self.threads, self.bot, self._queues[number],
+                  self.before_update, self.on_start)
+        )
+        process.start()
+        return process
+    
+    def ensure_alive(self):
+        """Перезапускает упавшие процессы (их очереди сохраняются)"""
+        for number, process in enumerate(self._workers):
+            if not process.is_alive():
+                logger.error(f"❌ Процесс-обработчик {number} завершился с кодом {process.exitcode}, перезапуск")
+                metrics.inc('worker_restarts', str(number))
+                self._workers[number] = self._spawn(number)
+    
+    def stop(self, timeout=10):
+        """Останавливает диспетчер и процессы (они дорабатывают свои очереди)"""
+        self._stop.set()
+        for updates in self._queues:
+            updates.put(None)
+        for process in self._workers:
+            process.join(timeout)
+    
+    # ====== ДИСПЕТЧЕР ======
+    
+    def dispatch(self, updates):
+        """Раскладывает обновления по очередям процессов"""
+        for update in updates:
+            number = partition(update_chat_id(update), self.processes)
+            self._queues[number].put(update)
+            metrics.inc('dispatched', str(number))
+    
+    def poll_forever(self, timeout=30):
+        """Long polling getUpdates и раздача обновлений до stop()"""
+        offset = None
+        while not self._stop.is_set():
+            try:
+                updates = apihelper.get_updates(
+                    self.bot.token, offset=offset, timeout=timeout, long_polling_timeout=timeout
+                )
+            except Exception as e:
+                logger.error(f"❌ Ошибка getUpdates: {e}")
+                time.sleep(1)
+                continue
+            
+            if updates:
+                offset = updates[-1]['update_id'] + 1
+                self.dispatch(updates)
+            self.ensure_alive()
+
+# ====== ПРОЦЕСС-ОБРАБОТЧИК ======
+
+def _worker_main(number, processes, threads, telebot_instance, updates, before_update, on_start):
+    """Точка входа процесса: раздаёт обновления своим потокам по чатам"""
+    # Обновление обрабатывается целиком в потоке чата, без пула потоков telebot
+    telebot_instance.threaded = False
+    if on_start is not None:
+        on_start()
+    
+    thread_queues = [queue.SimpleQueue() for _ in range(threads)]
+    thread_list = [
+        threading.Thread(
+            target=_run_thread, args=(telebot_instance, thread_queue, before_update),
+            name=f"worker-{number}-{index}", daemon=True
+        )
+        for index, thread_queue in enumerate(thread_queues)
+    ]
+    for thread in thread_list:
+        thread.start()
+    logger.info(f"👷 Процесс-обработчик {number} готов")
+    
+    while True:
+        update = updates.get()
+        if update is None:
+            break
+        chat_id = update_chat_id(update)
+        index = partition(chat_id // processes if isinstance(chat_id, int) else chat_id, threads)
+        thread_queues[index].put(update)
+    
+    for thread_queue in thread_queues:
+        thread_queue.put(None)
+    for thread in thread_list:
+        thread.join()
+
+def _run_thread(telebot_instance, thread_queue, before_update):
+    last_check = 0.0
+    while True:
+        update = thread_queue.get()
+        if update is None:
+            return
+        
+        now = time.monotonic()
+        if before_update is not None and now - last_check >= RELOAD_CHECK_INTERVAL:
+            last_check = now
+            try:
+                before_update()
+            except Exception as e:
+                logger.error(f"⚠️ Ошибка проверки расписания: {e}")
+        
+        try:
+            telebot_instance.process_new_updates([types.Update.de_json(update)])
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработки обновления {update.get('update_id')}: {e}")